@@ -0,0 +1,262 @@
+"""
+Revenue analytics computed by the database
+
+Grouping by period, service and staff happens in a MongoDB `$facet` pipeline
+(or SQL GROUP BY on the MySQL backend) so only aggregated rows cross the wire.
+Names are looked up for the returned ids only.
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+from pymongo import ReturnDocument
+from database import execute_query
+from cache import TTLCache
+
+REVENUE_STATUSES = ["confirmed", "completed"]
+
+# Default window per period when no start date is given
+DEFAULT_WINDOWS = {
+    "daily": timedelta(days=30),
+    "weekly": timedelta(weeks=12),
+    "monthly": timedelta(days=365),
+    "yearly": timedelta(days=1095),  # 3 years
+}
+
+def resolve_window(period: str, start_date: Optional[str], end_date: Optional[str]):
+    """Parse the requested window, falling back to the period's default"""
+    today = datetime.now(timezone.utc).date()
+    if start_date:
+        start = datetime.fromisoformat(start_date).date()
+    else:
+        start = today - DEFAULT_WINDOWS.get(period, DEFAULT_WINDOWS["yearly"])
+    end = datetime.fromisoformat(end_date).date() if end_date else today
+    return start, end
+
+def booking_line_items(booking):
+    """(service_id, revenue) pairs for a booking; legacy bookings without line items split evenly"""
+    line_items = booking.get("line_items")
+    if line_items:
+        return [(item["service_id"], float(item["price"])) for item in line_items]
+    services = booking.get("services") or []
+    total_price = float(booking.get("total_price") or 0)
+    return [(service_id, total_price / len(services)) for service_id in services]
+
+def build_revenue_response(period, start, end, summary, by_period, by_service, by_staff,
+                           service_names, staff_names):
+    """Shape aggregated rows like the original /analytics/revenue response"""
+    total_revenue = float(summary.get("revenue") or 0)
+    total_bookings = int(summary.get("bookings") or 0)
+    average_booking_value = total_revenue / total_bookings if total_bookings > 0 else 0
+
+    return {
+        "summary": {
+            "total_revenue": total_revenue,
+            "total_bookings": total_bookings,
+            "average_booking_value": round(average_booking_value, 2),
+            "period": period,
+            "start_date": start.isoformat(),
+            "end_date": end.isoformat()
+        },
+        "revenue_by_period": [
+            {"period": row["_id"], "revenue": float(row["revenue"]), "bookings": int(row["bookings"])}
+            for row in by_period
+        ],
+        "top_services": [
+            {
+                "service_name": service_names.get(row["_id"], "Unknown"),
+                "revenue": float(row["revenue"]),
+                "bookings": int(row["bookings"])
+            }
+            for row in by_service
+        ],
+        "staff_performance": [
+            {
+                "staff_name": staff_names.get(row["_id"], "Unknown"),
+                "staff_id": row["_id"],
+                "revenue": float(row["revenue"]),
+                "bookings": int(row["bookings"]),
+                "average_per_booking": float(row["revenue"]) / row["bookings"] if row["bookings"] > 0 else 0
+            }
+            for row in by_staff
+        ]
+    }
+
+# Result cache. Keys include a bookings version that every booking write changing
+# paid revenue bumps (see rollups.on_booking_changed), so cached results are never
+# stale; windows ending before today never expire
+ANALYTICS_TODAY_TTL = float(os.environ.get('ANALYTICS_TODAY_TTL', '60'))
+analytics_cache = TTLCache(maxsize=int(os.environ.get('ANALYTICS_CACHE_SIZE', '512')), ttl=float('inf'))
+
+async def get_bookings_version(db) -> int:
+    counter = await db.counters.find_one({"_id": "bookings_version"})
+    return counter["value"] if counter else 0
+
+async def bump_bookings_version(db) -> int:
+    counter = await db.counters.find_one_and_update(
+        {"_id": "bookings_version"}, {"$inc": {"value": 1}},
+        upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return counter["value"]
+
+async def cached_analytics(db, key: tuple, end: Optional[date], compute, versioned: bool = False):
+    """
+    Return the cached result for key, or await compute() and cache it.
+
+    With versioned=True, compute() returns (result, bookings version it was
+    computed from); results older than the current version are returned but
+    not cached.
+    """
+    version = await get_bookings_version(db)
+    cache_key = (*key, version)
+    result = analytics_cache.get(cache_key)
+    if result is None:
+        result = await compute()
+        if versioned:
+            result, source_version = result
+            # Served from a snapshot still catching up: fine to return, not to keep
+            if source_version < version:
+                return result
+        today = datetime.now(timezone.utc).date()
+        ttl = None if end is not None and end < today else ANALYTICS_TODAY_TTL
+        analytics_cache.set(cache_key, result, ttl=ttl)
+    return result
+
+# MongoDB
+def mongo_period_key(period: str, field: str = "$start_at"):
+    """Expression bucketing a date field by period (weeks start on Monday)"""
+    if period == "weekly":
+        week_start = {"$subtract": [
+            field, {"$multiply": [{"$subtract": [{"$isoDayOfWeek": field}, 1]}, 86400000]}
+        ]}
+        return {"$dateToString": {"format": "%Y-%m-%d", "date": week_start}}
+    formats = {"daily": "%Y-%m-%d", "monthly": "%Y-%m"}
+    return {"$dateToString": {"format": formats.get(period, "%Y"), "date": field}}
+
+# (service_id, revenue) items per booking, mirroring booking_line_items
+MONGO_LINE_ITEMS = {"$cond": [
+    {"$gt": [{"$size": {"$ifNull": ["$line_items", []]}}, 0]},
+    {"$map": {
+        "input": "$line_items", "as": "item",
+        "in": {"service_id": "$$item.service_id", "revenue": "$$item.price"}
+    }},
+    {"$map": {
+        "input": {"$ifNull": ["$services", []]}, "as": "service_id",
+        "in": {"service_id": "$$service_id", "revenue": {
+            "$divide": ["$total_price", {"$max": [{"$size": {"$ifNull": ["$services", []]}}, 1]}]
+        }}
+    }}
+]}
+
+def mongo_revenue_pipeline(period: str, start: date, end: date, staff_id: Optional[str] = None):
+    match = {
+        "start_at": {
+            "$gte": datetime.combine(start, datetime.min.time()),
+            "$lt": datetime.combine(end + timedelta(days=1), datetime.min.time())
+        },
+        "status": {"$in": REVENUE_STATUSES},
+        "payment_status": "paid"
+    }
+    if staff_id:
+        match["staff_id"] = staff_id
+
+    totals = {"revenue": {"$sum": "$total_price"}, "bookings": {"$sum": 1}}
+    return [
+        {"$match": match},
+        {"$project": {"_id": 0, "start_at": 1, "staff_id": 1, "services": 1, "line_items": 1, "total_price": 1}},
+        {"$facet": {
+            "summary": [{"$group": {"_id": None, **totals}}],
+            "by_period": [
+                {"$group": {"_id": mongo_period_key(period), **totals}},
+                {"$sort": {"_id": 1}}
+            ],
+            "by_service": [
+                {"$project": {"items": MONGO_LINE_ITEMS}},
+                {"$unwind": "$items"},
+                {"$group": {"_id": "$items.service_id", "revenue": {"$sum": "$items.revenue"}, "bookings": {"$sum": 1}}},
+                {"$sort": {"revenue": -1}},
+                {"$limit": 5}
+            ],
+            "by_staff": [
+                {"$group": {"_id": "$staff_id", **totals}},
+                {"$sort": {"revenue": -1}}
+            ]
+        }}
+    ]
+
+async def lookup_names(collection, ids):
+    """Map id -> name for the given ids only"""
+    if not ids:
+        return {}
+    documents = await collection.find({"id": {"$in": list(ids)}}, {"_id": 0, "id": 1, "name": 1}).to_list(length=None)
+    return {d["id"]: d["name"] for d in documents}
+
+async def ensure_analytics_indexes(db):
+    await db.bookings.create_index([("start_at", 1), ("payment_status", 1), ("status", 1)])
+
+async def mongo_revenue_analytics(db, period: str, start: date, end: date, staff_id: Optional[str] = None):
+    """Revenue analytics aggregated by MongoDB"""
+    results = await db.bookings.aggregate(mongo_revenue_pipeline(period, start, end, staff_id)).to_list(length=1)
+    facets = results[0] if results else {}
+    summary = (facets.get("summary") or [{}])[0]
+    by_service = facets.get("by_service", [])
+    by_staff = facets.get("by_staff", [])
+
+    service_names = await lookup_names(db.services, [row["_id"] for row in by_service])
+    staff_names = await lookup_names(db.staff, [row["_id"] for row in by_staff])
+    return build_revenue_response(
+        period, start, end, summary, facets.get("by_period", []), by_service, by_staff,
+        service_names, staff_names
+    )
+
+# MySQL
+MYSQL_PERIOD_KEYS = {
+    "daily": "DATE_FORMAT(b.booking_date, '%%Y-%%m-%%d')",
+    "weekly": "DATE_FORMAT(DATE_SUB(b.booking_date, INTERVAL WEEKDAY(b.booking_date) DAY), '%%Y-%%m-%%d')",
+    "monthly": "DATE_FORMAT(b.booking_date, '%%Y-%%m')",
+    "yearly": "DATE_FORMAT(b.booking_date, '%%Y')",
+}
+
+async def mysql_revenue_analytics(period: str, start: date, end: date, staff_id: Optional[str] = None):
+    """Revenue analytics aggregated with GROUP BY on the MySQL backend (mysql_schema.sql)"""
+    where = "b.booking_date BETWEEN %s AND %s AND b.status IN (%s, %s) AND b.payment_status = 'paid'"
+    params = [start, end, *REVENUE_STATUSES]
+    if staff_id:
+        where += " AND b.staff_id = %s"
+        params.append(staff_id)
+    period_key = MYSQL_PERIOD_KEYS.get(period, MYSQL_PERIOD_KEYS["yearly"])
+
+    summary = await execute_query(
+        f"SELECT SUM(b.total_price) AS revenue, COUNT(*) AS bookings FROM bookings b WHERE {where}",
+        tuple(params), fetch_one=True
+    )
+    by_period = await execute_query(
+        f"""SELECT {period_key} AS _id, SUM(b.total_price) AS revenue, COUNT(*) AS bookings
+            FROM bookings b WHERE {where}
+            GROUP BY _id ORDER BY _id""",
+        tuple(params), fetch_all=True
+    )
+    by_service = await execute_query(
+        f"""SELECT s.service_id AS _id, MAX(sv.name) AS name,
+                   SUM(b.total_price / GREATEST(JSON_LENGTH(b.services), 1)) AS revenue,
+                   COUNT(*) AS bookings
+            FROM bookings b
+            JOIN JSON_TABLE(b.services, '$[*]' COLUMNS (service_id VARCHAR(36) PATH '$')) s
+            LEFT JOIN services sv ON sv.id = s.service_id
+            WHERE {where}
+            GROUP BY s.service_id ORDER BY revenue DESC LIMIT 5""",
+        tuple(params), fetch_all=True
+    )
+    by_staff = await execute_query(
+        f"""SELECT b.staff_id AS _id, MAX(st.name) AS name,
+                   SUM(b.total_price) AS revenue, COUNT(*) AS bookings
+            FROM bookings b LEFT JOIN staff st ON st.id = b.staff_id
+            WHERE {where}
+            GROUP BY b.staff_id ORDER BY revenue DESC""",
+        tuple(params), fetch_all=True
+    )
+
+    return build_revenue_response(
+        period, start, end, summary or {}, by_period, by_service, by_staff,
+        {row["_id"]: row["name"] for row in by_service if row["name"]},
+        {row["_id"]: row["name"] for row in by_staff if row["name"]}
+    )
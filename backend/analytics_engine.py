@@ -0,0 +1,261 @@
+"""
+Vectorized analytics over a columnar booking snapshot
+
+Revenue-eligible bookings are loaded once into typed NumPy arrays (day, staff,
+revenue and per-service line items) and cached on disk as one .npy file per
+column, which later loads memory-map instead of re-reading MongoDB. Reports
+over multi-year histories are then a handful of boolean masks and
+`np.bincount` group-bys instead of per-booking Python loops.
+
+Each save goes into a fresh directory, and a CURRENT pointer file is swapped
+to it atomically, so a worker loading concurrently never mixes columns from
+two snapshots. Rebuilds run in a background task, with the per-booking work in
+a thread, and requests keep using the previous snapshot until it's ready.
+"""
+import asyncio
+import json
+import os
+import shutil
+import uuid
+from datetime import date, datetime, timezone
+from pathlib import Path
+from typing import Optional
+import numpy as np
+from analytics import (
+    REVENUE_STATUSES, booking_line_items, build_revenue_response, lookup_names, get_bookings_version
+)
+
+ROOT_DIR = Path(__file__).parent
+SNAPSHOT_DIR = Path(os.environ.get('ANALYTICS_SNAPSHOT_DIR', ROOT_DIR / 'analytics_snapshot'))
+SNAPSHOT_MAX_AGE = float(os.environ.get('ANALYTICS_SNAPSHOT_MAX_AGE', '600'))
+
+COLUMNS = ("day", "staff", "revenue", "item_booking", "item_service", "item_revenue")
+POINTER_FILE = "CURRENT"
+# Older snapshot directories kept for workers that are still loading them
+KEEP_SNAPSHOTS = 2
+
+class SnapshotBuilder:
+    """Accumulates bookings into column lists, one pass over the documents"""
+
+    def __init__(self):
+        self.day, self.staff, self.revenue = [], [], []
+        self.item_booking, self.item_service, self.item_revenue = [], [], []
+        self.staff_codes, self.service_codes = {}, {}
+
+    def add(self, booking):
+        start_at = booking.get("start_at")
+        day = start_at.date() if isinstance(start_at, datetime) else str(booking["booking_date"])[:10]
+        index = len(self.day)
+        self.day.append(np.datetime64(day, 'D'))
+        self.staff.append(self.staff_codes.setdefault(booking["staff_id"], len(self.staff_codes)))
+        self.revenue.append(float(booking.get("total_price") or 0))
+        for service_id, revenue in booking_line_items(booking):
+            self.item_booking.append(index)
+            self.item_service.append(self.service_codes.setdefault(service_id, len(self.service_codes)))
+            self.item_revenue.append(revenue)
+
+    def add_many(self, bookings):
+        for booking in bookings:
+            self.add(booking)
+
+    def finish(self, version: int = 0):
+        return BookingSnapshot(
+            {
+                "day": np.array(self.day, dtype='datetime64[D]'),
+                "staff": np.array(self.staff, dtype=np.int32),
+                "revenue": np.array(self.revenue, dtype=np.float64),
+                "item_booking": np.array(self.item_booking, dtype=np.int64),
+                "item_service": np.array(self.item_service, dtype=np.int32),
+                "item_revenue": np.array(self.item_revenue, dtype=np.float64),
+            },
+            list(self.staff_codes), list(self.service_codes),
+            datetime.now(timezone.utc).timestamp(), version
+        )
+
+class BookingSnapshot:
+    def __init__(self, columns, staff_ids, service_ids, built_at, version=0):
+        self.columns = columns
+        self.staff_ids = staff_ids
+        self.service_ids = service_ids
+        self.built_at = built_at
+        self.version = version  # bookings version the snapshot was built from
+
+    @classmethod
+    def from_documents(cls, bookings):
+        builder = SnapshotBuilder()
+        for booking in bookings:
+            builder.add(booking)
+        return builder.finish()
+
+    @property
+    def age(self):
+        return datetime.now(timezone.utc).timestamp() - self.built_at
+
+    def save(self, path: Path = SNAPSHOT_DIR):
+        """Write a complete snapshot directory, then point CURRENT at it"""
+        path.mkdir(parents=True, exist_ok=True)
+        name = f"v{self.version}-{uuid.uuid4().hex[:8]}"
+        directory = path / name
+        directory.mkdir()
+        for column in COLUMNS:
+            np.save(directory / f"{column}.npy", self.columns[column])
+        (directory / "meta.json").write_text(json.dumps({
+            "staff_ids": self.staff_ids, "service_ids": self.service_ids,
+            "built_at": self.built_at, "version": self.version
+        }))
+        tmp = path / f"{POINTER_FILE}.{name}.tmp"
+        tmp.write_text(name)
+        os.replace(tmp, path / POINTER_FILE)
+        prune_snapshots(path, name)
+
+    @classmethod
+    def load(cls, path: Path = SNAPSHOT_DIR):
+        """Memory-map the current snapshot, or return None if there isn't one"""
+        try:
+            directory = path / (path / POINTER_FILE).read_text().strip()
+            meta = json.loads((directory / "meta.json").read_text())
+            columns = {name: np.load(directory / f"{name}.npy", mmap_mode='r') for name in COLUMNS}
+        except (OSError, ValueError):
+            return None
+        return cls(columns, meta["staff_ids"], meta["service_ids"], meta["built_at"], meta.get("version", 0))
+
+    def revenue_rows(self, period: str, start: date, end: date, staff_id: Optional[str] = None):
+        """Aggregated (period, service, staff) rows in the shape the Mongo pipelines return"""
+        day = self.columns["day"]
+        mask = (day >= np.datetime64(start, 'D')) & (day <= np.datetime64(end, 'D'))
+        if staff_id:
+            if staff_id not in self.staff_ids:
+                mask[:] = False
+            else:
+                mask &= self.columns["staff"] == self.staff_ids.index(staff_id)
+
+        revenue = self.columns["revenue"][mask]
+        summary = {"revenue": float(revenue.sum()), "bookings": int(mask.sum())}
+
+        keys = period_keys(day[mask], period)
+        labels, inverse = np.unique(keys, return_inverse=True)
+        by_period = grouped_rows([str(label) for label in labels], inverse, revenue, len(labels))
+
+        by_staff = grouped_rows(
+            self.staff_ids, self.columns["staff"][mask], revenue, len(self.staff_ids)
+        )
+        by_staff.sort(key=lambda row: row["revenue"], reverse=True)
+
+        item_mask = mask[self.columns["item_booking"]]
+        by_service = grouped_rows(
+            self.service_ids, self.columns["item_service"][item_mask],
+            self.columns["item_revenue"][item_mask], len(self.service_ids)
+        )
+        by_service.sort(key=lambda row: row["revenue"], reverse=True)
+
+        return summary, by_period, by_service[:5], by_staff
+
+def prune_snapshots(path: Path, current: str):
+    """Remove all but the newest snapshot directories; mapped files stay readable after unlinking"""
+    directories = sorted(
+        (entry for entry in path.iterdir() if entry.is_dir() and entry.name != current),
+        key=lambda entry: entry.stat().st_mtime, reverse=True
+    )
+    for directory in directories[KEEP_SNAPSHOTS - 1:]:
+        shutil.rmtree(directory, ignore_errors=True)
+
+def period_keys(days, period: str):
+    """Bucket datetime64[D] values by period (weeks start on Monday)"""
+    if period == "daily":
+        return days
+    if period == "weekly":
+        # 1970-01-01 was a Thursday
+        return days - ((days.astype(np.int64) + 3) % 7).astype('timedelta64[D]')
+    if period == "monthly":
+        return days.astype('datetime64[M]')
+    return days.astype('datetime64[Y]')
+
+def grouped_rows(ids, codes, weights, size):
+    """Revenue and booking counts per code with np.bincount, skipping empty groups"""
+    revenue = np.bincount(codes, weights=weights, minlength=size)
+    counts = np.bincount(codes, minlength=size)
+    return [
+        {"_id": ids[code], "revenue": float(revenue[code]), "bookings": int(counts[code])}
+        for code in np.flatnonzero(counts)
+    ]
+
+async def build_snapshot(db, batch_size: int = 5000):
+    """Stream revenue-eligible bookings from MongoDB into a snapshot, one batch per thread hop"""
+    version = await get_bookings_version(db)
+    builder = SnapshotBuilder()
+    cursor = db.bookings.find(
+        {"status": {"$in": REVENUE_STATUSES}, "payment_status": "paid"},
+        {"_id": 0, "start_at": 1, "booking_date": 1, "staff_id": 1,
+         "services": 1, "line_items": 1, "total_price": 1}
+    ).batch_size(batch_size)
+    batch = []
+    async for booking in cursor:
+        batch.append(booking)
+        if len(batch) >= batch_size:
+            await asyncio.to_thread(builder.add_many, batch)
+            batch = []
+    await asyncio.to_thread(builder.add_many, batch)
+    return await asyncio.to_thread(builder.finish, version)
+
+def is_stale(snapshot, version: int, max_age: float) -> bool:
+    return snapshot is None or snapshot.version != version or snapshot.age > max_age
+
+_snapshot = None
+_refresh_task = None
+
+async def refresh_snapshot(db, max_age: float):
+    """Adopt a fresher snapshot another worker saved, or build and save a new one"""
+    global _snapshot
+    try:
+        version = await get_bookings_version(db)
+        saved = await asyncio.to_thread(BookingSnapshot.load)
+        if not is_stale(saved, version, max_age):
+            _snapshot = saved
+            return
+        snapshot = await build_snapshot(db)
+        await asyncio.to_thread(snapshot.save)
+        _snapshot = await asyncio.to_thread(BookingSnapshot.load) or snapshot
+    except Exception as e:
+        print(f"Error building analytics snapshot: {e}")
+
+async def get_snapshot(db, max_age: float = SNAPSHOT_MAX_AGE):
+    """
+    The latest snapshot, starting a background rebuild when it's out of date.
+
+    A stale snapshot is returned as is while the rebuild runs; only the very
+    first call in a process with nothing on disk waits for a build.
+    """
+    global _snapshot, _refresh_task
+    if _snapshot is None:
+        _snapshot = await asyncio.to_thread(BookingSnapshot.load)
+    version = await get_bookings_version(db)
+    if is_stale(_snapshot, version, max_age) and (_refresh_task is None or _refresh_task.done()):
+        _refresh_task = asyncio.create_task(refresh_snapshot(db, max_age))
+    if _snapshot is None:
+        await asyncio.shield(_refresh_task)
+        if _snapshot is None:
+            raise RuntimeError("Analytics snapshot could not be built")
+    return _snapshot
+
+async def revenue_history(db, period: str, start: Optional[date] = None, end: Optional[date] = None,
+                          staff_id: Optional[str] = None):
+    """
+    Revenue-by-period, staff performance, average ticket and top services from the snapshot.
+
+    Returns (response, bookings version of the snapshot it was computed from).
+    """
+    snapshot = await get_snapshot(db)
+    # Default to the whole history
+    days = snapshot.columns["day"]
+    today = datetime.now(timezone.utc).date()
+    start = start or (days.min().astype(object) if len(days) else today)
+    end = end or today
+    summary, by_period, by_service, by_staff = await asyncio.to_thread(
+        snapshot.revenue_rows, period, start, end, staff_id
+    )
+    service_names = await lookup_names(db.services, [row["_id"] for row in by_service])
+    staff_names = await lookup_names(db.staff, [row["_id"] for row in by_staff])
+    response = build_revenue_response(
+        period, start, end, summary, by_period, by_service, by_staff, service_names, staff_names
+    )
+    return response, snapshot.version
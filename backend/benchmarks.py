@@ -0,0 +1,416 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for backend hot paths
+
+Usage:
+    python benchmarks.py row-decoders --rows 100000
+    python benchmarks.py row-decoders --rows 100000 --live bookings
+    python benchmarks.py bulk-write --rows 20000 --batch-size 500
+    python benchmarks.py login-burst --logins 16
+    python benchmarks.py revenue-analytics --bookings 500000
+    python benchmarks.py analytics-engine --bookings 1000000
+    python benchmarks.py media-urls --records 10000
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time as timer
+import uuid
+from datetime import datetime, date, timedelta
+from pymysql.constants import FIELD_TYPE
+from passlib.context import CryptContext
+from passwords import PasswordHasher
+from motor.motor_asyncio import AsyncIOMotorClient
+from typing import List, Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from analytics_engine import BookingSnapshot
+from media_urls import MediaUrl, MediaVariants
+from analytics import (
+    mongo_revenue_analytics, mysql_revenue_analytics, ensure_analytics_indexes,
+    resolve_window, REVENUE_STATUSES
+)
+from database import (
+    init_db, close_db, get_db_connection, insert_record,
+    insert_many, upsert_many, prepare_record_for_response, get_row_decoder, execute_query
+)
+
+def report(name: str, rows: int, seconds: float):
+    """Print a single benchmark result line"""
+    rate = rows / seconds if seconds > 0 else float('inf')
+    print(f"{name:<40} {rows:>10} rows  {seconds:8.3f}s  {rate:>12,.0f} rows/sec")
+
+# Row decoders
+BOOKING_DESCRIPTION = (
+    ('id', FIELD_TYPE.VAR_STRING), ('customer_id', FIELD_TYPE.VAR_STRING),
+    ('customer_name', FIELD_TYPE.VAR_STRING), ('customer_email', FIELD_TYPE.VAR_STRING),
+    ('customer_phone', FIELD_TYPE.VAR_STRING), ('staff_id', FIELD_TYPE.VAR_STRING),
+    ('services', FIELD_TYPE.JSON), ('booking_date', FIELD_TYPE.DATE),
+    ('booking_time', FIELD_TYPE.TIME), ('total_duration', FIELD_TYPE.LONG),
+    ('total_price', FIELD_TYPE.NEWDECIMAL), ('payment_method', FIELD_TYPE.VAR_STRING),
+    ('payment_status', FIELD_TYPE.VAR_STRING), ('status', FIELD_TYPE.VAR_STRING),
+    ('notes', FIELD_TYPE.BLOB), ('admin_notes', FIELD_TYPE.BLOB),
+    ('created_at', FIELD_TYPE.TIMESTAMP), ('updated_at', FIELD_TYPE.TIMESTAMP),
+)
+
+def make_booking_rows(count: int):
+    """Generate rows shaped like DictCursor results from the bookings table"""
+    now = datetime.now()
+    services = f'["{uuid.uuid4()}", "{uuid.uuid4()}"]'
+    return [
+        {
+            'id': str(uuid.uuid4()), 'customer_id': str(uuid.uuid4()),
+            'customer_name': 'Customer', 'customer_email': 'customer@example.com',
+            'customer_phone': '+45 12 34 56 78', 'staff_id': str(uuid.uuid4()),
+            'services': services, 'booking_date': date(2024, 1, 1) + timedelta(days=i % 365),
+            'booking_time': timedelta(hours=9 + i % 8), 'total_duration': 30,
+            'total_price': 350.0, 'payment_method': 'cash', 'payment_status': 'paid',
+            'status': 'confirmed', 'notes': '', 'admin_notes': '',
+            'created_at': now, 'updated_at': now,
+        }
+        for i in range(count)
+    ]
+
+async def bench_row_decoders(rows: int, live_table: str = None):
+    """Compare prepare_record_for_response with precompiled row decoders"""
+    if live_table:
+        await init_db()
+        try:
+            async with get_db_connection() as (connection, cursor):
+                await cursor.execute(f"SELECT * FROM {live_table} LIMIT %s", (rows,))
+                data = list(await cursor.fetchall())
+                description = cursor.description
+        finally:
+            await close_db()
+    else:
+        data = make_booking_rows(rows)
+        description = BOOKING_DESCRIPTION
+
+    copies = [dict(row) for row in data]
+    start = timer.perf_counter()
+    [prepare_record_for_response(row) for row in data]
+    report("prepare_record_for_response", len(data), timer.perf_counter() - start)
+
+    start = timer.perf_counter()
+    decode_row = get_row_decoder(description)
+    [decode_row(row) for row in copies]
+    report("precompiled row decoder", len(copies), timer.perf_counter() - start)
+
+# Bulk writes
+BENCHMARK_TABLE = "benchmark_bulk_write"
+
+async def bench_bulk_write(rows: int, batch_size: int, single_rows: int):
+    """Compare insert_record in a loop with insert_many/upsert_many on a scratch table"""
+    await init_db()
+    try:
+        async with get_db_connection() as (connection, cursor):
+            await cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+            await cursor.execute(f"""
+                CREATE TABLE {BENCHMARK_TABLE} (
+                    id VARCHAR(36) PRIMARY KEY,
+                    name VARCHAR(255),
+                    services JSON,
+                    total_price DECIMAL(10,2),
+                    created_at TIMESTAMP
+                )
+            """)
+
+        data = [
+            {
+                'id': str(uuid.uuid4()), 'name': f'Row {i}', 'services': [str(uuid.uuid4())],
+                'total_price': 350.0, 'created_at': datetime.now()
+            }
+            for i in range(rows)
+        ]
+
+        start = timer.perf_counter()
+        for row in data[:single_rows]:
+            await insert_record(BENCHMARK_TABLE, row)
+        report("insert_record loop", single_rows, timer.perf_counter() - start)
+
+        async with get_db_connection() as (connection, cursor):
+            await cursor.execute(f"TRUNCATE TABLE {BENCHMARK_TABLE}")
+
+        stats = await insert_many(BENCHMARK_TABLE, data, batch_size=batch_size)
+        report(f"insert_many (batch {batch_size})", stats['rows'], stats['seconds'])
+
+        for row in data:
+            row['total_price'] = 400.0
+        stats = await upsert_many(BENCHMARK_TABLE, data, batch_size=batch_size)
+        report(f"upsert_many (batch {batch_size})", stats['rows'], stats['seconds'])
+    finally:
+        async with get_db_connection() as (connection, cursor):
+            await cursor.execute(f"DROP TABLE IF EXISTS {BENCHMARK_TABLE}")
+        await close_db()
+
+# Password hashing
+async def probe_latency(stop: asyncio.Event, interval: float = 0.01):
+    """Measure how late a lightweight request (e.g. a slot lookup) gets scheduled"""
+    delays = []
+    while not stop.is_set():
+        expected = timer.perf_counter() + interval
+        await asyncio.sleep(interval)
+        delays.append((timer.perf_counter() - expected) * 1000)
+    return delays
+
+def report_latency(name: str, delays: list, seconds: float):
+    delays = sorted(delays)
+    p50 = statistics.median(delays)
+    p99 = delays[min(len(delays) - 1, int(len(delays) * 0.99))]
+    print(f"{name:<40} {len(delays):>6} probes  {seconds:8.3f}s  p50 {p50:8.2f}ms  p99 {p99:8.2f}ms")
+
+async def bench_login_burst(logins: int, workers: int):
+    """Event loop latency while a burst of logins verifies bcrypt hashes"""
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    hashed = context.hash("benchmark-password")
+
+    async def inline_verify():
+        return context.verify("benchmark-password", hashed)
+
+    hasher = PasswordHasher(context, max_workers=workers)
+    modes = [("bcrypt on event loop", inline_verify),
+             (f"PasswordHasher ({hasher.max_workers} workers)",
+              lambda: hasher.verify("benchmark-password", hashed))]
+
+    for name, verify in modes:
+        stop = asyncio.Event()
+        probe = asyncio.create_task(probe_latency(stop))
+        await asyncio.sleep(0.05)
+        start = timer.perf_counter()
+        await asyncio.gather(*[verify() for _ in range(logins)])
+        seconds = timer.perf_counter() - start
+        stop.set()
+        report_latency(name, await probe, seconds)
+
+    print(f"hasher stats: {hasher.stats()}")
+    hasher.shutdown()
+
+# Revenue analytics
+ANALYTICS_DB = "benchmark_analytics"
+
+def python_revenue_analytics(bookings, period):
+    """The per-booking loops /analytics/revenue used before aggregation moved into the database"""
+    revenue_by_period, service_revenue, staff_revenue = {}, {}, {}
+    for booking in bookings:
+        booking_date = datetime.fromisoformat(booking["booking_date"]).date()
+        if period == "daily":
+            key = booking_date.isoformat()
+        elif period == "weekly":
+            key = (booking_date - timedelta(days=booking_date.weekday())).isoformat()
+        elif period == "monthly":
+            key = f"{booking_date.year}-{booking_date.month:02d}"
+        else:
+            key = str(booking_date.year)
+        bucket = revenue_by_period.setdefault(key, {"revenue": 0, "bookings": 0})
+        bucket["revenue"] += booking["total_price"]
+        bucket["bookings"] += 1
+    for booking in bookings:
+        for service_id in booking["services"]:
+            bucket = service_revenue.setdefault(service_id, {"revenue": 0, "bookings": 0})
+            bucket["revenue"] += booking["total_price"] / len(booking["services"])
+            bucket["bookings"] += 1
+    for booking in bookings:
+        bucket = staff_revenue.setdefault(booking["staff_id"], {"revenue": 0, "bookings": 0})
+        bucket["revenue"] += booking["total_price"]
+        bucket["bookings"] += 1
+    return revenue_by_period, service_revenue, staff_revenue
+
+def make_mongo_bookings(count: int, staff_ids, service_ids, days: int = 3 * 365):
+    first_day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days)
+    for _ in range(count):
+        start_at = first_day + timedelta(days=random.randrange(days), minutes=random.randrange(9 * 60, 18 * 60, 30))
+        services = random.sample(service_ids, random.randint(1, 3))
+        yield {
+            "id": str(uuid.uuid4()), "customer_id": str(uuid.uuid4()),
+            "staff_id": random.choice(staff_ids), "services": services,
+            "line_items": [
+                {"service_id": s, "name": "", "price": 250.0, "duration_minutes": 30} for s in services
+            ],
+            "booking_date": start_at.date().isoformat(), "booking_time": start_at.strftime('%H:%M:%S'),
+            "start_at": start_at, "end_at": start_at + timedelta(minutes=30 * len(services)),
+            "total_duration": 30 * len(services), "total_price": 250.0 * len(services),
+            "status": random.choice(REVENUE_STATUSES + ["pending", "cancelled"]),
+            "payment_status": random.choice(["paid", "paid", "pending"]),
+        }
+
+async def seed_analytics_db(db, bookings: int, batch_size: int = 10_000):
+    """Fill a scratch MongoDB database with synthetic staff, services and bookings"""
+    await db.client.drop_database(db.name)
+    staff = [{"id": str(uuid.uuid4()), "name": f"Staff {i}"} for i in range(8)]
+    services = [{"id": str(uuid.uuid4()), "name": f"Service {i}", "price": 250.0} for i in range(20)]
+    await db.staff.insert_many(staff)
+    await db.services.insert_many(services)
+
+    batch = []
+    for booking in make_mongo_bookings(bookings, [s["id"] for s in staff], [s["id"] for s in services]):
+        batch.append(booking)
+        if len(batch) >= batch_size:
+            await db.bookings.insert_many(batch)
+            batch = []
+    if batch:
+        await db.bookings.insert_many(batch)
+
+async def bench_revenue_analytics(bookings: int, period: str, reseed: bool, mysql: bool):
+    """Compare fetching bookings into Python loops with server-side aggregation"""
+    client = AsyncIOMotorClient(os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+    db = client[ANALYTICS_DB]
+    try:
+        if reseed or await db.bookings.estimated_document_count() != bookings:
+            start = timer.perf_counter()
+            await seed_analytics_db(db, bookings)
+            report("seed bookings", bookings, timer.perf_counter() - start)
+        await ensure_analytics_indexes(db)
+
+        start_date, end_date = resolve_window("yearly", None, None)
+        query = {
+            "start_at": {"$gte": datetime.combine(start_date, datetime.min.time())},
+            "status": {"$in": REVENUE_STATUSES}, "payment_status": "paid"
+        }
+
+        start = timer.perf_counter()
+        rows = await db.bookings.find(query).to_list(length=None)
+        python_revenue_analytics(rows, period)
+        await db.services.find().to_list(length=None)
+        await db.staff.find().to_list(length=None)
+        report("fetch + Python loops (mongo)", len(rows), timer.perf_counter() - start)
+
+        start = timer.perf_counter()
+        await mongo_revenue_analytics(db, period, start_date, end_date)
+        report("$facet pipeline (mongo)", len(rows), timer.perf_counter() - start)
+    finally:
+        client.close()
+
+    if mysql:
+        # Runs against the bookings already in the configured MySQL database
+        await init_db()
+        try:
+            start = timer.perf_counter()
+            rows = await execute_query("SELECT * FROM bookings WHERE booking_date >= %s", (start_date,), fetch_all=True)
+            report("fetch all rows (mysql)", len(rows), timer.perf_counter() - start)
+
+            start = timer.perf_counter()
+            await mysql_revenue_analytics(period, start_date, end_date)
+            report("GROUP BY queries (mysql)", len(rows), timer.perf_counter() - start)
+        finally:
+            await close_db()
+
+def bench_analytics_engine(bookings: int, period: str):
+    """Compare the per-booking Python loops with the vectorized snapshot"""
+    staff_ids = [str(uuid.uuid4()) for _ in range(8)]
+    service_ids = [str(uuid.uuid4()) for _ in range(20)]
+    data = list(make_mongo_bookings(bookings, staff_ids, service_ids, days=5 * 365))
+    start_date, end_date = date(1970, 1, 1), date.today()
+
+    start = timer.perf_counter()
+    python_revenue_analytics(data, period)
+    report("Python loops", len(data), timer.perf_counter() - start)
+
+    start = timer.perf_counter()
+    snapshot = BookingSnapshot.from_documents(data)
+    report("build snapshot", len(data), timer.perf_counter() - start)
+
+    start = timer.perf_counter()
+    snapshot.revenue_rows(period, start_date, end_date)
+    report("vectorized report", len(data), timer.perf_counter() - start)
+
+    start = timer.perf_counter()
+    snapshot.revenue_rows(period, start_date, end_date, staff_ids[0])
+    report("vectorized report (one staff)", len(data), timer.perf_counter() - start)
+
+# Media URLs
+class PlainStaff(BaseModel):
+    """Staff-shaped record with absolute URLs stored as plain strings"""
+    id: str
+    name: str
+    avatar_url: str = ""
+    portfolio_images: List[str] = Field(default_factory=list)
+    avatar_variants: Optional[dict] = None
+
+class KeyedStaff(BaseModel):
+    """The same record with storage keys resolved at serialization"""
+    id: str
+    name: str
+    avatar_url: MediaUrl = ""
+    portfolio_images: List[MediaUrl] = Field(default_factory=list)
+    avatar_variants: Optional[MediaVariants] = None
+
+def make_staff_records(count: int, base: str):
+    def variants(key):
+        stem = key.rsplit(".", 1)[0]
+        return {size: {fmt: f"{base}{stem}_{size}.{fmt}" for fmt in ("jpeg", "webp", "avif")}
+                for size in ("thumb", "medium", "large")}
+    records = []
+    for _ in range(count):
+        name = uuid.uuid4().hex
+        key = f"avatars/{name[:2]}/{name[2:4]}/{name}.jpg"
+        records.append({
+            "id": str(uuid.uuid4()), "name": "Staff", "avatar_url": base + key,
+            "portfolio_images": [f"{base}images/{name[:2]}/{name[2:4]}/{name}_{i}.jpg" for i in range(4)],
+            "avatar_variants": variants(key),
+        })
+    return records
+
+def bench_media_urls(records: int):
+    """List endpoint response cost with stored URLs vs keys resolved per response"""
+    for name, model, base in (
+        ("stored absolute URLs", PlainStaff, "https://api.example.com/api/uploads/"),
+        ("keys resolved to URLs", KeyedStaff, ""),
+    ):
+        documents = make_staff_records(records, base)
+        adapter = TypeAdapter(List[model])
+        timings = []
+        for _ in range(5):
+            # What a list endpoint does: build the models, then dump the response
+            start = timer.perf_counter()
+            adapter.dump_json([model(**document) for document in documents])
+            timings.append(timer.perf_counter() - start)
+        report(name, records, statistics.median(timings))
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    decoders = subparsers.add_parser("row-decoders", help="Row decoding for fetch_all results")
+    decoders.add_argument("--rows", type=int, default=100_000)
+    decoders.add_argument("--live", metavar="TABLE", help="Fetch rows from MySQL instead of generating them")
+
+    bulk = subparsers.add_parser("bulk-write", help="insert_many/upsert_many against MySQL")
+    bulk.add_argument("--rows", type=int, default=20_000)
+    bulk.add_argument("--batch-size", type=int, default=500)
+    bulk.add_argument("--single-rows", type=int, default=1_000,
+                      help="Rows written one statement at a time for comparison")
+
+    burst = subparsers.add_parser("login-burst", help="Event loop latency during a burst of bcrypt logins")
+    burst.add_argument("--logins", type=int, default=16)
+    burst.add_argument("--workers", type=int, default=None)
+
+    revenue = subparsers.add_parser("revenue-analytics", help="Python loops vs server-side revenue aggregation")
+    revenue.add_argument("--bookings", type=int, default=500_000)
+    revenue.add_argument("--period", default="monthly", choices=["daily", "weekly", "monthly", "yearly"])
+    revenue.add_argument("--reseed", action="store_true", help="Regenerate the scratch MongoDB database")
+    revenue.add_argument("--mysql", action="store_true", help="Also time the MySQL GROUP BY queries")
+
+    engine = subparsers.add_parser("analytics-engine", help="Python loops vs vectorized snapshot analytics")
+    engine.add_argument("--bookings", type=int, default=1_000_000)
+    engine.add_argument("--period", default="monthly", choices=["daily", "weekly", "monthly", "yearly"])
+
+    media_urls = subparsers.add_parser("media-urls", help="Serialization cost of resolving media keys to URLs")
+    media_urls.add_argument("--records", type=int, default=10_000)
+
+    args = parser.parse_args()
+    if args.benchmark == "row-decoders":
+        asyncio.run(bench_row_decoders(args.rows, args.live))
+    elif args.benchmark == "bulk-write":
+        asyncio.run(bench_bulk_write(args.rows, args.batch_size, args.single_rows))
+    elif args.benchmark == "login-burst":
+        asyncio.run(bench_login_burst(args.logins, args.workers))
+    elif args.benchmark == "revenue-analytics":
+        asyncio.run(bench_revenue_analytics(args.bookings, args.period, args.reseed, args.mysql))
+    elif args.benchmark == "analytics-engine":
+        bench_analytics_engine(args.bookings, args.period)
+    elif args.benchmark == "media-urls":
+        bench_media_urls(args.records)
+
+if __name__ == "__main__":
+    main()
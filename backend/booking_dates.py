@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Native start_at/end_at datetimes for bookings, staff breaks and corporate bookings
+
+Bookings store their date and time as ISO strings, which makes overlap checks a
+string comparison plus a Python loop. Each document also gets a native
+`start_at`/`end_at` pair so overlaps are a single indexed range query:
+`start_at < end AND end_at > start`.
+
+Existing documents are converted in batches by `migrate_booking_dates`, which
+the API runs on startup before it serves requests, since overlap checks and
+slot listings only see documents that have the window. Documents whose date or
+time can't be parsed are flagged with `window_error` and listed so they can be
+fixed by hand; they are retried on the next run. It can also be run directly:
+    python booking_dates.py [--batch-size 500]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, date, time, timedelta
+from pymongo import UpdateOne
+
+WINDOW_COLLECTIONS = ("bookings", "staff_breaks", "corporate_bookings")
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+def to_time(value):
+    if isinstance(value, time):
+        return value
+    if isinstance(value, datetime):
+        return value.time()
+    return time.fromisoformat(value)
+
+def booking_window(booking_date, booking_time, duration_minutes):
+    """Return the (start_at, end_at) pair for a booking"""
+    start_at = datetime.combine(to_date(booking_date), to_time(booking_time))
+    return start_at, start_at + timedelta(minutes=duration_minutes or 0)
+
+def break_window(start_date, start_time, end_date, end_time):
+    """Return the (start_at, end_at) envelope covering a staff break"""
+    return (
+        datetime.combine(to_date(start_date), to_time(start_time)),
+        datetime.combine(to_date(end_date), to_time(end_time)),
+    )
+
+def corporate_duration(employees, service_durations):
+    """Total minutes of all services booked for a company's employees"""
+    return sum(
+        service_durations.get(service_id, 0)
+        for employee in employees
+        for service_id in employee.get("service_ids", [])
+    )
+
+async def ensure_window_indexes(db):
+    """Create the (staff_id, start_at, end_at) indexes used by overlap queries"""
+    for collection in WINDOW_COLLECTIONS:
+        await db[collection].create_index([("staff_id", 1), ("start_at", 1), ("end_at", 1)])
+
+def document_window(collection, document, service_durations):
+    if collection == "staff_breaks":
+        return break_window(
+            document["start_date"], document["start_time"],
+            document["end_date"], document["end_time"]
+        )
+    if collection == "corporate_bookings":
+        duration = corporate_duration(document.get("employees", []), service_durations)
+    else:
+        duration = document.get("total_duration", 0)
+    return booking_window(document["booking_date"], document["booking_time"], duration)
+
+async def migrate_collection(db, collection, service_durations, batch_size=500):
+    """
+    Add start_at/end_at to documents in one collection that don't have them yet.
+
+    Returns (converted count, [(id, error)] for documents that couldn't be converted).
+    """
+    converted = 0
+    skipped = []
+    last_id = None
+    while True:
+        query = {"start_at": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection].find(query).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        operations = []
+        for document in batch:
+            try:
+                start_at, end_at = document_window(collection, document, service_durations)
+            except (KeyError, TypeError, ValueError) as e:
+                error = f"{type(e).__name__}: {e}"
+                skipped.append((document.get("id", str(document["_id"])), error))
+                operations.append(UpdateOne({"_id": document["_id"]}, {"$set": {"window_error": error}}))
+                continue
+            operations.append(UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {"start_at": start_at, "end_at": end_at}, "$unset": {"window_error": ""}}
+            ))
+        if operations:
+            result = await db[collection].bulk_write(operations, ordered=False)
+            converted += result.modified_count
+        # Yield between batches so request handling is not starved
+        await asyncio.sleep(0)
+
+    return converted, skipped
+
+async def migrate_booking_dates(db, batch_size=500):
+    """
+    Convert existing bookings, breaks and corporate bookings in batches.
+
+    Returns {collection: [(id, error)]} for the documents left without a window.
+    """
+    unconverted = {}
+    try:
+        services = await db.services.find({}, {"_id": 0, "id": 1, "duration_minutes": 1}).to_list(length=None)
+        service_durations = {s["id"]: s.get("duration_minutes", 0) for s in services}
+        for collection in WINDOW_COLLECTIONS:
+            converted, skipped = await migrate_collection(db, collection, service_durations, batch_size)
+            if converted or skipped:
+                print(f"Added start_at/end_at to {converted} {collection} ({len(skipped)} skipped)")
+            for document_id, error in skipped:
+                # Invisible to overlap checks until fixed, so name every one
+                print(f"  {collection} {document_id} has no start_at/end_at ({error}); fix its date/time fields")
+            if skipped:
+                unconverted[collection] = skipped
+    except Exception as e:
+        print(f"Error migrating booking dates: {e}")
+    return unconverted
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Add native start_at/end_at datetimes to bookings")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await ensure_window_indexes(db)
+        await migrate_booking_dates(db, args.batch_size)
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+Small in-process caches shared by the API servers
+"""
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Hashable, Optional
+
+_MISSING = object()
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a time-to-live (seconds)"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.get(key, _MISSING)
+        if entry is _MISSING:
+            self.misses += 1
+            return default
+        value, expires_at = entry
+        if expires_at <= monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """Store a value; `ttl` overrides the default lifetime for this entry"""
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        self._entries[key] = (value, monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._entries.pop(key, _MISSING)
+        return default if entry is _MISSING else entry[0]
+
+    def discard_where(self, predicate: Callable[[Hashable, Any], bool]) -> int:
+        """Remove every entry for which predicate(key, value) is true"""
+        stale = [key for key, (value, _) in self._entries.items() if predicate(key, value)]
+        for key in stale:
+            del self._entries[key]
+        return len(stale)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
@@ -14,9 +14,11 @@ import uuid
 from datetime import datetime, timezone, date, time, timedelta
 import jwt
 from passlib.context import CryptContext
-import shutil
 import mimetypes
 import aiomysql
+from cache import TTLCache
+from passwords import PasswordHasher, HasherBusy
+from file_uploads import save_upload
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -34,9 +36,25 @@ DB_CONFIG = {
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost are upgraded transparently on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_desired_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_desired_rounds=BCRYPT_ROUNDS
+)
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '0')) or None
+)
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
+# Resolved users keyed by (token subject, issued-at) so admin screens don't hit the DB per call
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('AUTH_CACHE_TTL', '60'))
+)
 BACKEND_URL = "https://frisorlafata.dk"
 
 # Global connection pool
@@ -66,6 +84,7 @@ async def lifespan(app: FastAPI):
     await init_db()
     yield
     await close_db()
+    password_hasher.shutdown()
 
 app = FastAPI(lifespan=lifespan, title="Frisor LaFata API", version="1.0.0")
 api_router = APIRouter(prefix="/api")
@@ -413,16 +432,24 @@ def prepare_from_db(record):
 # Authentication functions
 def create_access_token(data: dict):
     to_encode = data.copy()
-    expire = datetime.now(timezone.utc) + timedelta(hours=24)
-    to_encode.update({"exp": expire})
+    now = datetime.now(timezone.utc)
+    expire = now + timedelta(hours=24)
+    to_encode.update({"exp": expire, "iat": int(now.timestamp())})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_and_update_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be replaced"""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     try:
@@ -431,6 +458,11 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         if email is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
         
+        cache_key = (email, payload.get("iat"))
+        cached_user = user_cache.get(cache_key)
+        if cached_user is not None:
+            return cached_user
+        
         async with get_db_connection() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 await cursor.execute("SELECT * FROM users WHERE email = %s", (email,))
@@ -438,10 +470,17 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 if not result:
                     raise HTTPException(status_code=401, detail="User not found")
                 
-                return User(**prepare_from_db(result))
+                user = User(**prepare_from_db(result))
+                # Never cache past the token's own expiry
+                user_cache.set(cache_key, user, ttl=payload["exp"] - datetime.now(timezone.utc).timestamp())
+                return user
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
 
+def invalidate_cached_user(user_id: str):
+    """Drop cached users after their record changes"""
+    user_cache.discard_where(lambda key, user: user.id == user_id)
+
 async def get_admin_user(current_user: User = Depends(get_current_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
@@ -452,17 +491,28 @@ async def get_admin_user(current_user: User = Depends(get_current_user)):
 async def login(user_data: UserLogin):
     async with get_db_connection() as conn:
         async with conn.cursor(aiomysql.DictCursor) as cursor:
-            # Check users table
-            await cursor.execute("SELECT * FROM users WHERE email = %s", (user_data.email,))
+            # Fetch the user and password hash in one query
+            await cursor.execute(
+                """SELECT u.*, p.password AS password_hash
+                   FROM users u
+                   JOIN user_passwords p ON p.user_id = u.id
+                   WHERE u.email = %s
+                   LIMIT 1""",
+                (user_data.email,)
+            )
             result = await cursor.fetchone()
             
             if result:
+                hashed_password = result.pop('password_hash')
                 user = prepare_from_db(result)
-                # Check password from user_passwords table
-                await cursor.execute("SELECT password FROM user_passwords WHERE user_id = %s", (user['id'],))
-                pwd_result = await cursor.fetchone()
+                is_valid, new_hash = await verify_and_update_password(user_data.password, hashed_password)
                 
-                if pwd_result and verify_password(user_data.password, pwd_result['password']):
+                if is_valid:
+                    if new_hash:
+                        await cursor.execute(
+                            "UPDATE user_passwords SET password = %s WHERE user_id = %s",
+                            (new_hash, user['id'])
+                        )
                     access_token = create_access_token(data={"sub": user['email']})
                     return {"access_token": access_token, "token_type": "bearer", "user": user}
             
@@ -494,7 +544,7 @@ async def create_user(user: UserCreate, admin_user: User = Depends(get_admin_use
             )
             
             # Insert password
-            hashed_password = get_password_hash(user.password)
+            hashed_password = await get_password_hash(user.password)
             await cursor.execute(
                 "INSERT INTO user_passwords (user_id, password) VALUES (%s, %s)",
                 (user_id, hashed_password)
@@ -523,6 +573,7 @@ async def update_user(user_id: str, user: UserUpdate, admin_user: User = Depends
                 query = f"UPDATE users SET {', '.join(update_fields)} WHERE id = %s"
                 await cursor.execute(query, values)
                 await conn.commit()
+                invalidate_cached_user(user_id)
             
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 await cursor.execute("SELECT * FROM users WHERE id = %s", (user_id,))
@@ -538,6 +589,7 @@ async def delete_user(user_id: str, admin_user: User = Depends(get_admin_user)):
             await cursor.execute("DELETE FROM user_passwords WHERE user_id = %s", (user_id,))
             await cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
             await conn.commit()
+            invalidate_cached_user(user_id)
             return {"message": "User deleted successfully"}
 
 # Staff endpoints
@@ -1078,42 +1130,27 @@ async def upload_avatar(file: UploadFile = File(...), admin_user: User = Depends
     if file.content_type not in ["image/jpeg", "image/png", "image/gif"]:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    file_extension = file.filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = uploads_dir / "avatars" / filename
+    key, _, _, _ = await save_upload(file, "avatars", "jpg")
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    
-    return {"url": f"{BACKEND_URL}/uploads/avatars/{filename}"}
+    return {"url": f"{BACKEND_URL}/uploads/{key}"}
 
 @api_router.post("/upload/image")
 async def upload_image(file: UploadFile = File(...), admin_user: User = Depends(get_admin_user)):
     if file.content_type not in ["image/jpeg", "image/png", "image/gif"]:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    file_extension = file.filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = uploads_dir / "images" / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    key, _, _, _ = await save_upload(file, "images", "jpg")
     
-    return {"url": f"{BACKEND_URL}/uploads/images/{filename}"}
+    return {"url": f"{BACKEND_URL}/uploads/{key}"}
 
 @api_router.post("/upload/video")
 async def upload_video(file: UploadFile = File(...), admin_user: User = Depends(get_admin_user)):
     if file.content_type not in ["video/mp4", "video/webm", "video/ogg", "video/avi", "video/mov"]:
         raise HTTPException(status_code=400, detail="Invalid file type")
     
-    file_extension = file.filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = uploads_dir / "videos" / filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    key, _, _, _ = await save_upload(file, "videos", "mp4")
     
-    return {"url": f"{BACKEND_URL}/uploads/videos/{filename}"}
+    return {"url": f"{BACKEND_URL}/uploads/{key}"}
 
 # Available slots endpoint
 @api_router.get("/bookings/available-slots")
@@ -4,8 +4,10 @@ Database connection and utilities for MySQL
 import os
 import json
 import aiomysql
-from datetime import datetime, date, time, timezone
-from typing import Optional, List, Dict, Any
+from pymysql.constants import FIELD_TYPE
+from datetime import datetime, date, time, timedelta, timezone
+from time import perf_counter
+from typing import Optional, List, Dict, Any, Callable, Iterable
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
@@ -23,6 +25,9 @@ DB_CONFIG = {
     'autocommit': True
 }
 
+# Columns stored as JSON text (MariaDB reports JSON columns as LONGTEXT)
+JSON_FIELDS = {'specialties', 'portfolio_images', 'available_hours', 'services', 'categories', 'tags', 'images', 'videos'}
+
 # Global connection pool
 pool = None
 
@@ -80,7 +85,7 @@ def prepare_record_for_response(record: Dict[str, Any]) -> Dict[str, Any]:
     
     result = {}
     for key, value in record.items():
-        if key in ['specialties', 'portfolio_images', 'available_hours', 'services', 'categories', 'tags', 'images', 'videos']:
+        if key in JSON_FIELDS:
             # Deserialize JSON fields
             result[key] = deserialize_from_db(value) if value else []
         elif isinstance(value, datetime):
@@ -98,7 +103,7 @@ def prepare_data_for_insert(data: Dict[str, Any]) -> Dict[str, Any]:
     """Prepare data for database insertion"""
     result = {}
     for key, value in data.items():
-        if key in ['specialties', 'portfolio_images', 'available_hours', 'services', 'categories', 'tags', 'images', 'videos']:
+        if key in JSON_FIELDS:
             # Serialize JSON fields
             result[key] = serialize_for_db(value) if value else None
         elif isinstance(value, (datetime, date, time)):
@@ -108,6 +113,83 @@ def prepare_data_for_insert(data: Dict[str, Any]) -> Dict[str, Any]:
     
     return result
 
+# Precompiled row decoders
+def _decode_json(value: Any) -> Any:
+    """Decode a JSON column value, empty values become an empty list"""
+    if not value:
+        return []
+    if not isinstance(value, (str, bytes)):
+        return value
+    try:
+        return json.loads(value)
+    except (json.JSONDecodeError, ValueError):
+        return value
+
+def _decode_isoformat(value: Any) -> Any:
+    """Convert DATE/DATETIME/TIMESTAMP values to ISO strings"""
+    if value is None or isinstance(value, str):
+        return value
+    return value.isoformat()
+
+def _decode_time(value: Any) -> Any:
+    """Convert TIME values (returned by PyMySQL as timedelta) to HH:MM:SS"""
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    return value.strftime('%H:%M:%S')
+
+_TYPE_DECODERS = {
+    FIELD_TYPE.JSON: _decode_json,
+    FIELD_TYPE.DATE: _decode_isoformat,
+    FIELD_TYPE.NEWDATE: _decode_isoformat,
+    FIELD_TYPE.DATETIME: _decode_isoformat,
+    FIELD_TYPE.TIMESTAMP: _decode_isoformat,
+    FIELD_TYPE.TIME: _decode_time,
+}
+
+# Decoders are cached per result shape (column names + types), so each
+# table/query compiles its decoder once and reuses it for every fetch
+_row_decoders: Dict[tuple, Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+
+def _identity_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return row
+
+def build_row_decoder(description) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Build a row decoder from cursor column metadata.
+
+    Only JSON and temporal columns get a converter; every other column is
+    passed through untouched without any per-cell type checks.
+    """
+    converters = []
+    for column in description:
+        name, type_code = column[0], column[1]
+        if name in JSON_FIELDS:
+            converters.append((name, _decode_json))
+        elif type_code in _TYPE_DECODERS:
+            converters.append((name, _TYPE_DECODERS[type_code]))
+
+    if not converters:
+        return _identity_row
+
+    converters = tuple(converters)
+
+    def decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        for name, convert in converters:
+            row[name] = convert(row[name])
+        return row
+
+    return decode_row
+
+def get_row_decoder(description) -> Callable[[Dict[str, Any]], Dict[str, Any]]:
+    """Return the cached decoder for a result shape, building it on first use"""
+    key = tuple((column[0], column[1]) for column in description)
+    decoder = _row_decoders.get(key)
+    if decoder is None:
+        decoder = _row_decoders[key] = build_row_decoder(description)
+    return decoder
+
 async def execute_query(query: str, params: tuple = None, fetch_one: bool = False, fetch_all: bool = False) -> Any:
     """Execute a database query"""
     async with get_db_connection() as (connection, cursor):
@@ -116,10 +198,13 @@ async def execute_query(query: str, params: tuple = None, fetch_one: bool = Fals
             
             if fetch_one:
                 result = await cursor.fetchone()
-                return prepare_record_for_response(result) if result else None
+                return get_row_decoder(cursor.description)(result) if result else None
             elif fetch_all:
                 results = await cursor.fetchall()
-                return [prepare_record_for_response(row) for row in results]
+                if not results:
+                    return []
+                decode_row = get_row_decoder(cursor.description)
+                return [decode_row(row) for row in results]
             else:
                 return cursor.rowcount
         except Exception as e:
@@ -148,6 +233,81 @@ async def insert_record(table: str, data: Dict[str, Any]) -> str:
             print(f"Values: {values}")
             raise
 
+def build_insert_query(table: str, columns: List[str], upsert: bool = False,
+                       update_columns: Optional[List[str]] = None) -> str:
+    """Build an INSERT (optionally ... ON DUPLICATE KEY UPDATE) statement"""
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+    if upsert:
+        updates = [col for col in (update_columns or columns) if col != 'id' and col in columns]
+        if not updates:
+            updates = [columns[0]]
+        query += " ON DUPLICATE KEY UPDATE " + ', '.join(f"{col} = VALUES({col})" for col in updates)
+    return query
+
+async def _write_many(table: str, rows: Iterable[Dict[str, Any]], batch_size: int,
+                      upsert: bool, update_columns: Optional[List[str]]) -> Dict[str, Any]:
+    """Write rows in multi-row batches over one connection and one transaction"""
+    started = perf_counter()
+    written = 0
+    affected = 0
+    # Rows are grouped by their column set so every batch shares one statement
+    pending: Dict[tuple, List[list]] = {}
+
+    async with get_db_connection() as (connection, cursor):
+        async def flush(columns: tuple):
+            nonlocal written, affected
+            batch = pending.pop(columns, None)
+            if not batch:
+                return
+            query = build_insert_query(table, list(columns), upsert, update_columns)
+            try:
+                # executemany rewrites INSERT ... VALUES into a single multi-row statement
+                await cursor.executemany(query, batch)
+            except Exception as e:
+                print(f"Bulk write error: {e}")
+                print(f"Query: {query}")
+                print(f"Batch size: {len(batch)}")
+                raise
+            written += len(batch)
+            affected += cursor.rowcount
+
+        await connection.begin()
+        try:
+            for row in rows:
+                prepared_data = prepare_data_for_insert(row)
+                columns = tuple(prepared_data.keys())
+                batch = pending.setdefault(columns, [])
+                batch.append(list(prepared_data.values()))
+                if len(batch) >= batch_size:
+                    await flush(columns)
+            for columns in list(pending.keys()):
+                await flush(columns)
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+
+    seconds = perf_counter() - started
+    rows_per_sec = written / seconds if seconds > 0 else 0.0
+    print(f"{'Upserted' if upsert else 'Inserted'} {written} rows into {table} "
+          f"in {seconds:.2f}s ({rows_per_sec:,.0f} rows/sec)")
+    return {
+        'table': table,
+        'rows': written,
+        'affected': affected,
+        'seconds': seconds,
+        'rows_per_sec': rows_per_sec
+    }
+
+async def insert_many(table: str, rows: Iterable[Dict[str, Any]], batch_size: int = 500) -> Dict[str, Any]:
+    """Insert rows in multi-row batches within a single transaction and return write stats"""
+    return await _write_many(table, rows, batch_size, upsert=False, update_columns=None)
+
+async def upsert_many(table: str, rows: Iterable[Dict[str, Any]], batch_size: int = 500,
+                      update_columns: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Insert or update rows with INSERT ... ON DUPLICATE KEY UPDATE batches and return write stats"""
+    return await _write_many(table, rows, batch_size, upsert=True, update_columns=update_columns)
+
 async def update_record(table: str, record_id: str, data: Dict[str, Any]) -> int:
     """Update a record and return affected rows"""
     prepared_data = prepare_data_for_insert(data)
@@ -0,0 +1,214 @@
+"""
+Streaming, content-addressed file uploads
+
+Uploads are copied to disk in fixed-size chunks, with the blocking writes
+offloaded to a thread, so memory use stays flat regardless of file size.
+Files are spooled to a temp file in the storage's staging directory (outside
+the served uploads tree) and only moved into storage once complete, so a
+rejected or interrupted upload never leaves a partial file behind or exposes
+one by URL.
+
+The size limit for each upload type is enforced before Starlette parses the
+multipart body (which spools it in full): `UploadLimitMiddleware` rejects a
+too-large Content-Length outright and cuts off bodies that grow past the
+limit while being received. The per-file check while copying still applies.
+
+Files are named after the SHA-256 of their content, hashed while streaming,
+plus an extension detected from the content itself (the client's file name is
+only a fallback for unrecognized formats, normalized so .JPEG and .jpg agree),
+and handed to the configured storage backend (storage.py). Uploading the same
+file again reuses the stored copy, and a copy stored under another upload type
+is copied within storage (a hard link on local disk), so duplicates cost no
+extra disk or upload bandwidth. Since names only change with content, URLs
+are stable and can be cached forever.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from storage import get_storage, shard_key, with_file_type
+
+CHUNK_SIZE = 1024 * 1024
+
+MB = 1024 * 1024
+MAX_UPLOAD_BYTES = {
+    "avatars": int(os.environ.get('MAX_AVATAR_UPLOAD_MB', '10')) * MB,
+    "images": int(os.environ.get('MAX_IMAGE_UPLOAD_MB', '20')) * MB,
+    "videos": int(os.environ.get('MAX_VIDEO_UPLOAD_MB', '500')) * MB,
+}
+
+# Room for multipart boundaries and part headers on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+def too_large_detail(max_bytes: int) -> str:
+    return f"File too large, maximum size is {format_size(max_bytes)}"
+
+def format_size(size: int) -> str:
+    """Whole MB where exact ("20 MB"), otherwise KB or bytes with up to one decimal"""
+    for unit, factor in (("MB", MB), ("KB", 1024)):
+        if size >= factor:
+            return f"{size / factor:.1f}".removesuffix(".0") + f" {unit}"
+    return f"{size} bytes"
+
+class UploadLimitMiddleware:
+    """
+    Cap request bodies for upload routes at the ASGI receive level.
+
+    limits maps a request path to the largest file it accepts; the body may be
+    MULTIPART_OVERHEAD bigger than that.
+    """
+
+    def __init__(self, app, limits: dict):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        max_bytes = self.limits.get(scope["path"]) if scope["type"] == "http" else None
+        if max_bytes is None:
+            await self.app(scope, receive, send)
+            return
+
+        max_body = max_bytes + MULTIPART_OVERHEAD
+        headers = dict(scope["headers"])
+        try:
+            content_length = int(headers.get(b"content-length", b""))
+        except ValueError:
+            content_length = None
+        if content_length is not None and content_length > max_body:
+            response = JSONResponse({"detail": too_large_detail(max_bytes)}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > max_body:
+                    # Re-raised by FastAPI's body parsing and rendered as a 413
+                    raise HTTPException(status_code=413, detail=too_large_detail(max_bytes))
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Upload exceeds {max_bytes} bytes")
+        self.max_bytes = max_bytes
+
+async def stream_to_temp(upload: UploadFile, directory: Path, max_bytes: int, chunk_size: int = CHUNK_SIZE):
+    """Copy an upload into a temp file chunk by chunk, hashing as it goes; returns (temp path, size, sha256)"""
+    # Reject early when the multipart part already tells us the size
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    directory.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".upload-", suffix=".part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            def write(chunk):
+                buffer.write(chunk)
+                digest.update(chunk)
+
+            while chunk := await upload.read(chunk_size):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                await asyncio.to_thread(write, chunk)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return Path(tmp_path), size, digest.hexdigest()
+
+async def store_file(storage, tmp_path: Path, key: str, content_type: Optional[str] = None) -> bool:
+    """Put a hashed temp file into storage; returns False if the content was already stored"""
+    file_type = key.split("/", 1)[0]
+    try:
+        if await storage.exists(key):
+            return False
+        for other_type in MAX_UPLOAD_BYTES:
+            other_key = with_file_type(key, other_type)
+            if other_type != file_type and await storage.exists(other_key):
+                await storage.copy(other_key, key)
+                return False
+        await storage.put(tmp_path, key, content_type)
+        return True
+    finally:
+        # put() consumes the temp file; anything left over is a duplicate or a failed put
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+def file_sha256(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+# ISO base media "ftyp" brands -> extension
+FTYP_BRANDS = {
+    b"avif": "avif", b"avis": "avif", b"heic": "heic", b"heix": "heic", b"mif1": "heic",
+    b"qt  ": "mov", b"M4V ": "m4v",
+}
+EXTENSION_ALIASES = {"jpeg": "jpg", "jpe": "jpg", "jfif": "jpg", "tif": "tiff", "htm": "html"}
+
+def sniff_extension(head: bytes) -> Optional[str]:
+    """Extension for the format the first bytes of a file identify, or None"""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if head.startswith(b"RIFF") and head[8:12] in (b"WEBP", b"AVI "):
+        return "webp" if head[8:12] == b"WEBP" else "avi"
+    if head[4:8] == b"ftyp":
+        return FTYP_BRANDS.get(head[8:12], "mp4")
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return "webm"
+    if head.startswith(b"OggS"):
+        return "ogg"
+    if head.startswith((b"II*\x00", b"MM\x00*")):
+        return "tiff"
+    if head.startswith(b"BM"):
+        return "bmp"
+    return None
+
+def upload_extension(filename: str, default: str) -> str:
+    extension = filename.rsplit('.', 1)[-1].lower() if filename and '.' in filename else ''
+    extension = re.sub(r'[^a-z0-9]', '', extension)[:8] or default
+    return EXTENSION_ALIASES.get(extension, extension)
+
+def read_head(path: Path, size: int = 16) -> bytes:
+    with open(path, "rb") as f:
+        return f.read(size)
+
+async def save_upload(upload: UploadFile, file_type: str, default_extension: str):
+    """
+    Store an upload of file_type under its content hash, mapping oversized uploads to a 413.
+
+    Returns (key, size, sha256, created) where created is False for duplicates.
+    """
+    storage = get_storage()
+    max_bytes = MAX_UPLOAD_BYTES[file_type]
+    try:
+        tmp_path, size, sha256 = await stream_to_temp(upload, storage.staging_dir(), max_bytes)
+    except UploadTooLarge:
+        raise HTTPException(status_code=413, detail=too_large_detail(max_bytes))
+    # Same bytes, same key, whatever the client called the file
+    extension = sniff_extension(await asyncio.to_thread(read_head, tmp_path))
+    extension = extension or upload_extension(upload.filename, default_extension)
+    key = shard_key(file_type, f"{sha256}.{extension}")
+    created = await store_file(storage, tmp_path, key, upload.content_type)
+    return key, size, sha256, created
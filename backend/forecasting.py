@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Weekday x hour demand forecast for staffing
+
+Fits expected demand (average number of barbers busy) for every weekday and
+hour from historical bookings. A month-of-year factor captures seasonality:
+it is measured on complete calendar months only, relative to each weekday's
+average, and divided out of the history before recent weeks are weighted more
+(exponential decay with a configurable half-life). The stored demand is
+therefore season-neutral, and the factor of the month being planned is applied
+when recommendations are made.
+Everything after loading the bookings is vectorized NumPy over a per-minute
+occupancy array, so several years of history fit in seconds.
+
+The forecast is stored in the `demand_forecast` collection and read by
+`/analytics/staffing-recommendations`. Run it offline, e.g. nightly:
+    python forecasting.py [--years 3] [--half-life 8]
+"""
+import argparse
+import asyncio
+import os
+from datetime import date, datetime, timedelta, timezone
+from time import perf_counter
+import numpy as np
+from utilization import DAY_NAMES, MINUTES_PER_DAY, weekday_hours, interval_mask, week_start
+
+TARGET_OCCUPANCY = float(os.environ.get('STAFFING_TARGET_OCCUPANCY', '0.8'))
+
+def fit_demand(starts, ends, origin: datetime, days: int, half_life_weeks: float):
+    """
+    Fit demand from booking start/end datetimes (as datetime64[m] arrays).
+
+    Returns (demand[7, 24], bookings[7, 24], month_factors[12]) where demand is
+    the recency-weighted, deseasonalized average number of concurrent bookings
+    per hour slot.
+    """
+    weeks = days // 7
+    if weeks == 0:
+        return np.zeros((7, 24)), np.zeros((7, 24)), np.ones(12)
+    length = weeks * 7 * MINUTES_PER_DAY
+    origin64 = np.datetime64(origin, 'm')
+    start_minutes = (starts - origin64).astype(np.int64)
+    end_minutes = (ends - origin64).astype(np.int64)
+
+    # Concurrent bookings per minute via a difference array
+    diff = np.zeros(length + 1, dtype=np.int32)
+    valid = (end_minutes > start_minutes) & (start_minutes < length) & (end_minutes > 0)
+    np.add.at(diff, np.clip(start_minutes[valid], 0, length), 1)
+    np.add.at(diff, np.clip(end_minutes[valid], 0, length), -1)
+    concurrent = np.cumsum(diff[:-1]).reshape(weeks, 7, 24, 60).mean(axis=3)
+
+    # Bookings starting in each slot
+    slot = start_minutes[valid & (start_minutes >= 0)] // 60
+    started = np.bincount(slot, minlength=weeks * 7 * 24)[:weeks * 7 * 24].reshape(weeks, 7, 24)
+
+    days_of_history = np.datetime64(origin, 'D') + np.arange(weeks * 7)
+    month_factors = season_factors(days_of_history, concurrent.reshape(weeks * 7, 24).sum(axis=1))
+
+    # Divide the season out first, so recency weighting doesn't count it twice
+    day_factors = month_factors[days_of_history.astype('datetime64[M]').astype(np.int64) % 12]
+    day_factors = np.where(day_factors > 0, day_factors, 1.0).reshape(weeks, 7, 1)
+    concurrent = concurrent / day_factors
+    started = started / day_factors
+
+    # Exponential recency weights, halving every half_life_weeks into the past
+    age = np.arange(weeks)[::-1]
+    weights = 0.5 ** (age / half_life_weeks)
+    weights /= weights.sum()
+    demand = np.tensordot(weights, concurrent, axes=1)
+    bookings = np.tensordot(weights, started, axes=1)
+
+    return demand, bookings, month_factors
+
+def season_factors(days, daily):
+    """
+    Month-of-year demand factors from per-day totals (days as datetime64[D]).
+
+    Only complete calendar months count, and each day is compared with the
+    average of its weekday, so neither a partial month at either end of the
+    history nor a month's mix of weekdays skews the factor. Months without a
+    complete month of history get 1.
+    """
+    month_of_day = days.astype('datetime64[M]')
+    first_month = month_of_day[0] if days[0] == month_of_day[0].astype('datetime64[D]') else month_of_day[0] + 1
+    last_month = month_of_day[-1] if days[-1] + 1 == (month_of_day[-1] + 1).astype('datetime64[D]') else month_of_day[-1] - 1
+    complete = (month_of_day >= first_month) & (month_of_day <= last_month)
+    if not complete.any():
+        return np.ones(12)
+
+    weekdays = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+    weekday_mean = (
+        np.bincount(weekdays[complete], weights=daily[complete], minlength=7)
+        / np.maximum(np.bincount(weekdays[complete], minlength=7), 1)
+    )
+    months = month_of_day[complete].astype(np.int64) % 12
+    actual = np.bincount(months, weights=daily[complete], minlength=12)
+    expected = np.bincount(months, weights=weekday_mean[weekdays[complete]], minlength=12)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(expected > 0, actual / expected, 1.0)
+
+async def run_forecast(db, years: float = 3, half_life_weeks: float = 8):
+    """Fit demand from the last `years` of bookings and store it in demand_forecast"""
+    started = perf_counter()
+    today = datetime.now(timezone.utc).date()
+    end_day = week_start(today)  # only complete weeks
+    # At least one complete week, however short the requested history
+    first_day = min(week_start(end_day - timedelta(days=int(years * 365))), end_day - timedelta(weeks=1))
+    origin = datetime.combine(first_day, datetime.min.time())
+    days = (end_day - first_day).days
+
+    bookings = await db.bookings.find({
+        "status": {"$ne": "cancelled"},
+        "start_at": {"$gte": origin, "$lt": datetime.combine(end_day, datetime.min.time())}
+    }, {"_id": 0, "start_at": 1, "end_at": 1}).to_list(length=None)
+    loaded = perf_counter()
+
+    starts = np.array([b["start_at"] for b in bookings], dtype='datetime64[m]')
+    ends = np.array([b["end_at"] for b in bookings], dtype='datetime64[m]')
+    demand, expected_bookings, month_factors = fit_demand(starts, ends, origin, days, half_life_weeks)
+
+    generated_at = datetime.now(timezone.utc)
+    slots = [
+        {
+            "_id": f"{weekday}-{hour}",
+            "weekday": weekday,
+            "day_name": DAY_NAMES[weekday],
+            "hour": hour,
+            "expected_demand": round(float(demand[weekday, hour]), 4),
+            "expected_bookings": round(float(expected_bookings[weekday, hour]), 4),
+            "generated_at": generated_at
+        }
+        for weekday in range(7) for hour in range(24)
+    ]
+    await db.demand_forecast.delete_many({})
+    await db.demand_forecast.insert_many(slots + [{
+        "_id": "meta",
+        "month_factors": [round(float(f), 4) for f in month_factors],
+        "history_start": first_day.isoformat(),
+        "history_end": end_day.isoformat(),
+        "bookings": len(bookings),
+        "half_life_weeks": half_life_weeks,
+        "generated_at": generated_at
+    }])
+
+    return {
+        "bookings": len(bookings),
+        "weeks": days // 7,
+        "load_seconds": round(loaded - started, 3),
+        "fit_seconds": round(perf_counter() - loaded, 3)
+    }
+
+async def staffing_recommendations(db, target_week: date, business_hours, target_occupancy: float = TARGET_OCCUPANCY):
+    """Compare forecast demand with configured staff capacity for every weekday x hour"""
+    forecast = await db.demand_forecast.find({}).to_list(length=None)
+    meta = next((doc for doc in forecast if doc["_id"] == "meta"), None)
+    if meta is None:
+        return None
+
+    demand = np.zeros((7, 24))
+    for slot in forecast:
+        if slot["_id"] != "meta":
+            demand[slot["weekday"], slot["hour"]] = slot["expected_demand"]
+    # Seasonality per day, as a week can straddle two months
+    factors = np.array([meta["month_factors"][(target_week + timedelta(days=d)).month - 1] for d in range(7)])
+    demand *= factors[:, None]
+
+    staff_list = await db.staff.find({}, {"_id": 0, "id": 1, "name": 1, "available_hours": 1}).to_list(length=None)
+    capacity = np.zeros((7, 24), dtype=np.int64)
+    for staff in staff_list:
+        hours = weekday_hours(staff, business_hours)
+        starts = [d * MINUTES_PER_DAY + h[0] for d, h in enumerate(hours) if h]
+        ends = [d * MINUTES_PER_DAY + h[1] for d, h in enumerate(hours) if h]
+        # A staff member counts towards an hour they work at least half of
+        working = interval_mask(starts, ends, 7 * MINUTES_PER_DAY).reshape(7, 24, 60).sum(axis=2)
+        capacity += working >= 30
+
+    recommended = np.ceil(np.round(demand / target_occupancy, 4)).astype(np.int64)
+    gap = recommended - capacity
+
+    days = []
+    for weekday in range(7):
+        hours = [
+            {
+                "hour": hour,
+                "expected_demand": round(float(demand[weekday, hour]), 2),
+                "capacity": int(capacity[weekday, hour]),
+                "recommended_staff": int(recommended[weekday, hour]),
+                "gap": int(gap[weekday, hour])
+            }
+            for hour in range(24)
+            if capacity[weekday, hour] or recommended[weekday, hour]
+        ]
+        days.append({
+            "weekday": DAY_NAMES[weekday],
+            "date": (target_week + timedelta(days=weekday)).isoformat(),
+            "understaffed_hours": [h["hour"] for h in hours if h["gap"] > 0],
+            "overstaffed_hours": [h["hour"] for h in hours if h["gap"] < 0],
+            "staff_hours_needed": int(np.clip(gap[weekday], 0, None).sum()),
+            "staff_hours_spare": int(np.clip(-gap[weekday], 0, None).sum()),
+            "hours": hours
+        })
+
+    return {
+        "week_start": target_week.isoformat(),
+        "target_occupancy": target_occupancy,
+        "forecast_generated_at": meta["generated_at"],
+        "history_start": meta["history_start"],
+        "history_end": meta["history_end"],
+        "days": days
+    }
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Fit weekday x hour demand from historical bookings")
+    parser.add_argument("--years", type=float, default=3, help="Years of history to fit")
+    parser.add_argument("--half-life", type=float, default=8, help="Recency half-life in weeks")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        stats = await run_forecast(db, args.years, args.half_life)
+        print(f"Forecast fitted from {stats['bookings']} bookings over {stats['weeks']} weeks "
+              f"(load {stats['load_seconds']}s, fit {stats['fit_seconds']}s)")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
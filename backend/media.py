@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+"""
+Image derivatives for uploaded media
+
+Right after an avatar or image upload, the original is resized into
+thumb/medium/large variants. Each variant is saved in a fallback format
+(JPEG, or PNG for images with transparency) plus WebP, and AVIF where Pillow
+supports it. Resizing runs in a process pool so it neither blocks the event
+loop nor holds the GIL, and is skipped when identical content (same SHA-256)
+already has variants. The same pass records the image's width and height and
+a tiny inline placeholder (a ~16px WebP data: URI), so pages can lay out and
+show a blurred preview before any image downloads. Both are recorded for each
+upload in the `media` collection, keyed by storage key (see storage.py).
+Records that reference an upload get matching `*_variants` and `*_meta` fields.
+
+Generate variants for files uploaded before this existed:
+    python media.py backfill
+"""
+import argparse
+import asyncio
+import mimetypes
+import os
+import re
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from file_uploads import file_sha256
+from storage import get_storage, with_file_type
+from media_urls import media_key, variant_urls
+
+ROOT_DIR = Path(__file__).parent
+
+IMAGE_TYPES = ("avatars", "images")
+VARIANT_SIZES = {"thumb": 160, "medium": 640, "large": 1280}  # longest edge in pixels
+VARIANT_PATTERN = re.compile(r"_(thumb|medium|large)\.\w+$")
+
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "avif": "avif"}
+SAVE_OPTIONS = {
+    "jpeg": {"quality": 82, "optimize": True, "progressive": True},
+    "png": {"optimize": True},
+    "webp": {"quality": 80, "method": 4},
+    "avif": {"quality": 60},
+}
+# Longest edge of the inline placeholder; browsers scale it up blurred
+PLACEHOLDER_EDGE = 16
+
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', '2'))
+MEDIA_AVIF = os.environ.get('MEDIA_AVIF', '1') == '1'
+
+# Record field -> field holding the variants of the image(s) it references
+VARIANT_FIELDS = {
+    "staff": {"avatar_url": "avatar_variants", "portfolio_images": "portfolio_variants"},
+    "gallery": {"before_image": "before_image_variants", "after_image": "after_image_variants"},
+}
+# Record field -> field holding the width, height and placeholder of the image(s) it references
+META_FIELDS = {
+    "staff": {"avatar_url": "avatar_meta", "portfolio_images": "portfolio_meta"},
+    "gallery": {"before_image": "before_image_meta", "after_image": "after_image_meta"},
+}
+IMAGE_META = ("width", "height", "placeholder")
+
+def extra_formats():
+    """Modern formats to generate next to the fallback format"""
+    from PIL import features
+    formats = ["webp"]
+    if MEDIA_AVIF and features.check("avif"):
+        formats.append("avif")
+    return formats
+
+def placeholder_data_uri(image) -> str:
+    """A tiny WebP of the image as a data: URI, a few hundred bytes at most"""
+    import base64
+    import io
+    from PIL import Image
+
+    tiny = image.copy()
+    tiny.thumbnail((PLACEHOLDER_EDGE, PLACEHOLDER_EDGE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    tiny.save(buffer, format="WEBP", quality=40)
+    return "data:image/webp;base64," + base64.b64encode(buffer.getvalue()).decode("ascii")
+
+def render_variants(source: str, output_dir: str, stem: str, formats) -> tuple:
+    """
+    Resize one image into every variant size and format; runs in a worker process.
+
+    Returns (variant names by size and format, {width, height, placeholder}).
+    """
+    from PIL import Image, ImageOps
+
+    output_dir = Path(output_dir)
+    variants = {}
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original)
+        has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+        image = image.convert("RGBA" if has_alpha else "RGB")
+        fallback = "png" if has_alpha else "jpeg"
+        # Displayed size, after EXIF rotation
+        info = {"width": image.width, "height": image.height, "placeholder": placeholder_data_uri(image)}
+        for size_name, max_edge in VARIANT_SIZES.items():
+            resized = image.copy()
+            resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            variants[size_name] = {}
+            for fmt in (fallback, *formats):
+                name = f"{stem}_{size_name}.{EXTENSIONS[fmt]}"
+                resized.save(output_dir / name, format=fmt.upper(), **SAVE_OPTIONS[fmt])
+                variants[size_name][fmt] = name
+    return variants, info
+
+_pool = None
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    return _pool
+
+def shutdown_media_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def generate_variants(key: str) -> tuple:
+    """(variant keys by size and format, image info) for an uploaded image; variants are stored next to the original"""
+    storage = get_storage()
+    loop = asyncio.get_running_loop()
+    directory, _, filename = key.rpartition("/")
+    # Rendered into a scratch directory, then put into storage like any upload
+    output_dir = Path(tempfile.mkdtemp(dir=storage.staging_dir(), prefix=".variants-"))
+    try:
+        async with storage.local_file(key) as source:
+            names, info = await loop.run_in_executor(
+                get_pool(), render_variants, str(source), str(output_dir), Path(filename).stem, extra_formats()
+            )
+        variants = {}
+        for size, formats in names.items():
+            variants[size] = {}
+            for fmt, name in formats.items():
+                variant_key = f"{directory}/{name}"
+                await storage.put(output_dir / name, variant_key, mimetypes.guess_type(name)[0])
+                variants[size][fmt] = variant_key
+        return variants, info
+    finally:
+        await asyncio.to_thread(shutil.rmtree, output_dir, True)
+
+async def copy_variants(variants, file_type: str) -> dict:
+    """Copy variants generated for the same content under another upload type"""
+    storage = get_storage()
+    copied = {}
+    for size, formats in variants.items():
+        copied[size] = {}
+        for fmt, source_key in formats.items():
+            key = with_file_type(source_key, file_type)
+            if not await storage.exists(key):
+                await storage.copy(source_key, key)
+            copied[size][fmt] = key
+    return copied
+
+async def variants_exist(variants) -> bool:
+    storage = get_storage()
+    keys = [variant_key for formats in variants.values() for variant_key in formats.values()]
+    return all(await asyncio.gather(*(storage.exists(variant_key) for variant_key in keys)))
+
+async def existing_variants(db, key: str, sha256: Optional[str]) -> Optional[tuple]:
+    """(variants, image info) already generated for this file or for identical content"""
+    query = {"$or": [{"key": key}, {"sha256": sha256}]} if sha256 else {"key": key}
+    # Records from before placeholders existed are regenerated, and so are records
+    # whose variants were quarantined by media_gc.py
+    documents = await db.media.find(
+        {
+            **query, "variants": {"$ne": {}}, "placeholder": {"$exists": True},
+            "quarantined_at": {"$exists": False}
+        },
+        {"_id": 0, "key": 1, "variants": 1, **{field: 1 for field in IMAGE_META}}
+    ).to_list(length=None)
+    # Same key first
+    documents.sort(key=lambda doc: doc["key"] != key)
+    for document in documents:
+        if await variants_exist(document["variants"]):
+            break
+    else:
+        return None
+    info = {field: document.get(field) for field in IMAGE_META}
+    if document["key"] == key:
+        return document["variants"], info
+    return await copy_variants(document["variants"], key.split("/", 1)[0]), info
+
+async def process_upload(db, key: str, content_type: str, size: int,
+                         sha256: Optional[str] = None, uploaded: bool = True) -> dict:
+    """
+    Record an upload in the media collection and make sure it has image variants,
+    dimensions and a placeholder.
+
+    `last_uploaded_at` is bumped on every upload, duplicates included (pass
+    uploaded=False when backfilling existing files), and is what media_gc.py's
+    grace period counts from. There is no reference count: whether a file is
+    still used is decided by media_gc.py's scan. Returns the variant URLs.
+    """
+    now = datetime.now(timezone.utc)
+    file_type = key.split("/", 1)[0]
+    variants, info = {}, {}
+    if file_type in IMAGE_TYPES:
+        try:
+            variants, info = await existing_variants(db, key, sha256) or await generate_variants(key)
+        except Exception as e:
+            # The original is still usable without variants
+            print(f"Error generating variants for {key}: {e}")
+    await db.media.update_one(
+        {"key": key},
+        {
+            "$set": {
+                "file_type": file_type, "content_type": content_type, "size": size,
+                "sha256": sha256, "variants": variants, **info,
+                **({"last_uploaded_at": now} if uploaded else {})
+            },
+            # Uploaded again after media_gc.py quarantined it: live again.
+            # refs was an upload counter nothing read; dropped as records are touched
+            "$unset": {"quarantined_at": "", "refs": ""},
+            "$setOnInsert": {"created_at": now}
+        },
+        upsert=True
+    )
+    return variant_urls(variants)
+
+async def media_by_url(db, urls) -> dict:
+    """Map each upload URL or key to its media record, for uploads that have variants"""
+    keys = {url: media_key(url) for url in urls if media_key(url)}
+    if not keys:
+        return {}
+    documents = await db.media.find(
+        {"key": {"$in": list(set(keys.values()))}, "variants": {"$ne": {}}},
+        {"_id": 0, "key": 1, "variants": 1, **{field: 1 for field in IMAGE_META}}
+    ).to_list(length=None)
+    by_key = {doc["key"]: doc for doc in documents}
+    return {url: by_key[key] for url, key in keys.items() if key in by_key}
+
+def image_meta(media: Optional[dict]) -> Optional[dict]:
+    if not media or "placeholder" not in media:
+        return None
+    return {field: media[field] for field in IMAGE_META}
+
+async def attach_variants(db, collection: str, document: dict) -> dict:
+    """Set the *_variants and *_meta fields for whichever image fields the document contains"""
+    fields = [field for field in VARIANT_FIELDS[collection] if field in document]
+    urls = []
+    for field in fields:
+        value = document[field]
+        urls.extend(value if isinstance(value, list) else [value])
+    found = await media_by_url(db, [url for url in urls if url])
+    for field in fields:
+        value = document[field]
+        variants_field, meta_field = VARIANT_FIELDS[collection][field], META_FIELDS[collection][field]
+        if isinstance(value, list):
+            # Aligned with the list of images
+            document[variants_field] = [(found.get(url) or {}).get("variants") for url in value]
+            document[meta_field] = [image_meta(found.get(url)) for url in value]
+        else:
+            document[variants_field] = (found.get(value) or {}).get("variants")
+            document[meta_field] = image_meta(found.get(value))
+    return document
+
+async def backfill(db, concurrency: int = MEDIA_WORKERS):
+    """Generate variants and placeholders for existing uploads, then refresh the *_variants and *_meta fields"""
+    storage = get_storage()
+    done = {
+        doc["key"] async for doc in db.media.find(
+            {"variants": {"$ne": {}}, "placeholder": {"$exists": True}}, {"key": 1}
+        )
+    }
+    pending = []
+    for file_type in IMAGE_TYPES:
+        async for key, stored in storage.iter_objects(f"{file_type}/"):
+            name = key.rsplit("/", 1)[1]
+            if "/." not in key and not VARIANT_PATTERN.search(name) and key not in done:
+                pending.append((key, stored.size))
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def process(key, size):
+        async with semaphore:
+            content_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+            async with storage.local_file(key) as path:
+                sha256 = await asyncio.to_thread(file_sha256, path)
+            variants = await process_upload(db, key, content_type, size, sha256, uploaded=False)
+            return bool(variants)
+
+    generated = sum(await asyncio.gather(*(process(*item) for item in pending)))
+
+    updated = 0
+    for collection in VARIANT_FIELDS:
+        projection = {"_id": 0, "id": 1, **{field: 1 for field in VARIANT_FIELDS[collection]}}
+        async for document in db[collection].find({}, projection):
+            record_id = document.pop("id")
+            attached = await attach_variants(db, collection, document)
+            targets = [*VARIANT_FIELDS[collection].values(), *META_FIELDS[collection].values()]
+            update = {target: attached[target] for target in targets if target in attached}
+            if update:
+                await db[collection].update_one({"id": record_id}, {"$set": update})
+                updated += 1
+    return {"files": len(pending), "generated": generated, "records": updated}
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv(ROOT_DIR / '.env')
+    parser = argparse.ArgumentParser(description="Manage image variants for uploads")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("backfill", help="Generate variants for existing uploads")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.command == "backfill":
+            stats = await backfill(db)
+            print(f"Processed {stats['files']} files ({stats['generated']} with variants), "
+                  f"updated {stats['records']} records")
+    finally:
+        client.close()
+        shutdown_media_pool()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Garbage collection for uploaded files nothing references any more
+
+References are collected by streaming every document of the collections that
+can point at uploads and scanning all of their string values (plain key or
+URL fields, lists, free-form homepage sections and HTML page content) for
+storage keys and upload URLs. Image variants live as long as their original is referenced.
+Media records keep no reference count; this scan is the only source of
+truth for whether a file is still reachable.
+
+Unreferenced files uploaded longer ago than the grace period (so uploads whose
+record hasn't been saved yet are safe) are moved under "quarantine/<date>/" in
+storage rather than deleted; `purge` removes quarantined files later.
+
+    python media_gc.py report [--grace-days 7]       # dry run, reclaimable bytes
+    python media_gc.py quarantine [--grace-days 7]
+    python media_gc.py purge [--older-than-days 30]
+"""
+import argparse
+import asyncio
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from storage import get_storage, shard_key
+from media_urls import KEY_PREFIXES, media_base_url
+
+REFERENCE_COLLECTIONS = ("staff", "gallery", "pages", "settings", "homepage_sections")
+UPLOAD_TYPES = ("avatars", "images", "videos")
+QUARANTINE_PREFIX = "quarantine/"
+
+UPLOAD_URL = re.compile(r"/uploads/((?:avatars|images|videos)/[^\s\"'<>()?#]+)")
+VARIANT_NAME = re.compile(r"^(.+)_(?:thumb|medium|large)\.\w+$")
+
+def iter_strings(value):
+    """Every string nested anywhere in a document"""
+    if isinstance(value, str):
+        yield value
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_strings(item)
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_strings(item)
+
+async def referenced_keys(db, batch_size: int = 500) -> set:
+    """Storage keys referenced from any document, streamed collection by collection"""
+    keys = set()
+    # URLs embedded in HTML under MEDIA_BASE_URL, e.g. a CDN, need not contain "/uploads/"
+    base_url = media_base_url() + "/"
+    base_url_pattern = re.compile(re.escape(base_url) + r"((?:avatars|images|videos)/[^\s\"'<>()?#]+)")
+    for collection in REFERENCE_COLLECTIONS:
+        async for document in db[collection].find({}, {"_id": 0}).batch_size(batch_size):
+            for text in iter_strings(document):
+                if text.startswith(KEY_PREFIXES):
+                    keys.add(text)
+                    continue
+                if "/uploads/" in text:
+                    keys.update(match[1] for match in UPLOAD_URL.finditer(text))
+                if base_url in text:
+                    keys.update(match[1] for match in base_url_pattern.finditer(text))
+    # Flat URLs also cover the sharded location the file may have moved to
+    keys.update(shard_key(*key.split("/")) for key in list(keys) if key.count("/") == 1)
+    return keys
+
+def is_referenced(key: str, keys: set, live_stems: set) -> bool:
+    if key in keys:
+        return True
+    variant = VARIANT_NAME.match(key)
+    return bool(variant) and variant[1] in live_stems
+
+async def recently_uploaded_keys(db, cutoff: datetime) -> set:
+    """
+    Originals and variants of media uploaded since cutoff.
+
+    A duplicate upload reuses the existing file without touching its mtime,
+    so the grace period counts from the media record's last_uploaded_at.
+    """
+    keys = set()
+    async for media in db.media.find({"last_uploaded_at": {"$gte": cutoff}}, {"_id": 0, "key": 1, "variants": 1}):
+        keys.add(media["key"])
+        for formats in (media.get("variants") or {}).values():
+            keys.update(formats.values())
+    return keys
+
+async def find_orphans(db, grace_days: float):
+    """(key, size) of unreferenced files uploaded before the grace period"""
+    storage = get_storage()
+    keys = await referenced_keys(db)
+    live_stems = {key.rsplit(".", 1)[0] for key in keys}
+    cutoff = datetime.now(timezone.utc) - timedelta(days=grace_days)
+    recent = await recently_uploaded_keys(db, cutoff)
+
+    orphans = []
+    for file_type in UPLOAD_TYPES:
+        async for key, stored in storage.iter_objects(f"{file_type}/"):
+            # mtime still covers files with no media record
+            if key in recent or stored.mtime >= cutoff.timestamp():
+                continue
+            if not is_referenced(key, keys, live_stems):
+                orphans.append((key, stored.size))
+    return orphans, len(keys)
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+def print_report(orphans, reference_count: int, verbose: bool = False):
+    by_type = defaultdict(lambda: [0, 0])
+    for key, size in orphans:
+        by_type[key.partition("/")[0]][0] += 1
+        by_type[key.partition("/")[0]][1] += size
+    print(f"{reference_count} referenced files")
+    for file_type in UPLOAD_TYPES:
+        count, size = by_type.get(file_type, (0, 0))
+        print(f"  {file_type:8} {count:6} unreferenced  {format_bytes(size):>10}")
+    print(f"Reclaimable: {format_bytes(sum(size for _, size in orphans))}")
+    if verbose:
+        for key, size in orphans:
+            print(f"  {key}  {format_bytes(size)}")
+
+async def quarantine(db, orphans):
+    """Move orphans under quarantine/<date>/ and flag their media records"""
+    storage = get_storage()
+    prefix = f"{QUARANTINE_PREFIX}{datetime.now(timezone.utc).date().isoformat()}/"
+    for key, _ in orphans:
+        await storage.copy(key, prefix + key)
+        await storage.delete(key)
+    if orphans:
+        await db.media.update_many(
+            {"key": {"$in": [key for key, _ in orphans]}},
+            {"$set": {"quarantined_at": datetime.now(timezone.utc)}}
+        )
+    return len(orphans)
+
+async def purge(db, older_than_days: float):
+    """Delete quarantined files older than older_than_days, and their media records"""
+    storage = get_storage()
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).date()
+    purged, reclaimed, keys = 0, 0, []
+    async for key, stored in storage.iter_objects(QUARANTINE_PREFIX):
+        quarantined_on, _, original_key = key[len(QUARANTINE_PREFIX):].partition("/")
+        try:
+            if datetime.fromisoformat(quarantined_on).date() >= cutoff:
+                continue
+        except ValueError:
+            continue
+        await storage.delete(key)
+        keys.append(original_key)
+        purged += 1
+        reclaimed += stored.size
+    if keys:
+        await db.media.delete_many({"key": {"$in": keys}, "quarantined_at": {"$exists": True}})
+    return purged, reclaimed
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Find and remove uploads nothing references")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    for name, help_text in (("report", "Dry run: list reclaimable files"), ("quarantine", "Quarantine unreferenced files")):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument("--grace-days", type=float, default=7, help="Leave files younger than this alone")
+        subparser.add_argument("--verbose", action="store_true", help="List every file")
+    purge_parser = subparsers.add_parser("purge", help="Delete files quarantined long enough ago")
+    purge_parser.add_argument("--older-than-days", type=float, default=30)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.command == "purge":
+            purged, reclaimed = await purge(db, args.older_than_days)
+            print(f"Purged {purged} quarantined files, reclaimed {format_bytes(reclaimed)}")
+            return
+        orphans, reference_count = await find_orphans(db, args.grace_days)
+        print_report(orphans, reference_count, args.verbose)
+        if args.command == "quarantine":
+            moved = await quarantine(db, orphans)
+            print(f"Quarantined {moved} files under {QUARANTINE_PREFIX}")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,134 @@
+"""
+Public URLs for uploaded media
+
+Records store storage keys ("images/ab/cd/<hash>.jpg", see storage.py)
+rather than absolute URLs. `MediaUrl` model fields turn keys into URLs only
+when a response is serialized to JSON, so every endpoint (lists included)
+resolves them in the same place, and moving media behind a CDN is a config
+change rather than a data rewrite.
+
+The base URL comes from MEDIA_BASE_URL (e.g. https://cdn.example.com/media),
+defaulting to this API's own /api/uploads route.
+
+Incoming values may be keys or any upload URL, including ones stored with an
+old domain or returned by this API under the current base; they are stored as
+keys. Other URLs (external images, data: URIs) pass through unchanged.
+
+Upload URLs embedded in free text (page HTML, homepage section fields such as
+button_url and custom_css) are stored as domain-less "/api/uploads/<key>"
+paths and expanded under the current base on output the same way, so a
+domain change needs no rewrite_media_urls.py run for them either.
+"""
+import os
+import re
+from typing import Annotated, Dict, Optional
+from pydantic import BeforeValidator, PlainSerializer
+
+UPLOAD_TYPES = ("avatars", "images", "videos")
+KEY_PREFIXES = tuple(f"{file_type}/" for file_type in UPLOAD_TYPES)
+URL_PATTERN = re.compile(r"/uploads/((?:avatars|images|videos)/[^?#\s\"'<>]+)")
+# An upload URL inside text: optional origin and path prefix, then /uploads/<key>
+EMBEDDED_URL_PATTERN = re.compile(
+    r"(?:https?:)?(?://[^/\s\"'<>]+)?(?:/[\w.~%-]+)*?/uploads/((?:avatars|images|videos)/[^?#\s\"'<>()\\]+)"
+)
+EMBEDDED_PREFIX = "/api/uploads/"
+
+# Site settings are stored and returned as plain dicts, not models
+SETTINGS_MEDIA_FIELDS = ("hero_image", "hero_video")
+
+_base_url = None
+
+def media_base_url() -> str:
+    """Base for public media URLs, read on first use (after .env is loaded)"""
+    global _base_url
+    if _base_url is None:
+        backend_url = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+        _base_url = (os.environ.get('MEDIA_BASE_URL') or f"{backend_url}/api/uploads").rstrip("/")
+    return _base_url
+
+def media_key(value: Optional[str]) -> Optional[str]:
+    """Storage key for a key or an upload URL, or None for anything else"""
+    if not value:
+        return None
+    if value.startswith(KEY_PREFIXES):
+        return value
+    base = media_base_url() + "/"
+    if value.startswith(base) and value[len(base):].startswith(KEY_PREFIXES):
+        return value[len(base):]
+    match = URL_PATTERN.search(value) if "/uploads/" in value else None
+    return match[1] if match else None
+
+def media_url(value):
+    """Public URL for a stored key; other values are returned unchanged"""
+    if isinstance(value, str):
+        base = _base_url or media_base_url()
+        if value.startswith(KEY_PREFIXES):
+            return f"{base}/{value}"
+        key = media_key(value)
+        if key:
+            return f"{base}/{key}"
+    return value
+
+def store_as_key(value):
+    if isinstance(value, str):
+        return media_key(value) or value
+    return value
+
+def store_text_keys(text):
+    """Rewrite every upload URL in free text (under any domain or the current base) to /api/uploads/<key>"""
+    if not isinstance(text, str):
+        return text
+    base = media_base_url() + "/"
+    if base in text:
+        text = re.sub(
+            re.escape(base) + r"((?:avatars|images|videos)/)", lambda match: EMBEDDED_PREFIX + match[1], text
+        )
+    if "/uploads/" not in text:
+        return text
+    return EMBEDDED_URL_PATTERN.sub(lambda match: EMBEDDED_PREFIX + match[1], text)
+
+def text_media_urls(text):
+    """Expand upload paths (and legacy absolute upload URLs) in free text under the current base"""
+    if not isinstance(text, str) or "/uploads/" not in text:
+        return text
+    base = _base_url or media_base_url()
+    return EMBEDDED_URL_PATTERN.sub(lambda match: f"{base}/{match[1]}", text)
+
+def map_text(value, convert):
+    """Apply convert (store_text_keys or text_media_urls) to every string in a plain dict or list"""
+    if isinstance(value, dict):
+        return {key: map_text(item, convert) for key, item in value.items()}
+    if isinstance(value, list):
+        return [map_text(item, convert) for item in value]
+    return convert(value)
+
+def map_fields(document: dict, fields, convert) -> dict:
+    """Apply convert (store_as_key or media_url) to the given fields of a plain dict"""
+    for field in fields:
+        if field in document:
+            document[field] = convert(document[field])
+    return document
+
+def variant_urls(variants) -> dict:
+    """Variant keys by size and format, as URLs"""
+    base = _base_url or media_base_url()
+    return {
+        size: {
+            fmt: f"{base}/{key}" if key.startswith(KEY_PREFIXES) else media_url(key)
+            for fmt, key in formats.items()
+        }
+        for size, formats in variants.items()
+    }
+
+# Request models: keys or URLs in, keys stored
+MediaKey = Annotated[str, BeforeValidator(store_as_key)]
+# Response models: keys (or legacy URLs) as loaded from the database, URLs in JSON.
+# No validator, so building models for list endpoints costs nothing extra
+MediaUrl = Annotated[str, PlainSerializer(media_url, return_type=str, when_used="json")]
+# Free text with embedded upload URLs (page HTML): paths stored, URLs in JSON
+MediaText = Annotated[str, BeforeValidator(store_text_keys)]
+MediaTextUrls = Annotated[str, PlainSerializer(text_media_urls, return_type=str, when_used="json")]
+# Resolved as a whole: one call per record instead of one per size and format
+MediaVariants = Annotated[
+    Dict[str, Dict[str, str]], PlainSerializer(variant_urls, return_type=Dict[str, Dict[str, str]], when_used="json")
+]
@@ -1,15 +1,34 @@
 #!/usr/bin/env python3
 """
 Migration script to convert data from MongoDB to MySQL
+
+Collections are streamed from MongoDB with batched cursors ordered by _id and
+written to MySQL with bulk upserts. Independent tables are migrated
+concurrently, and progress is checkpointed per collection after every batch so
+an interrupted run resumes where it stopped.
+
+A batch that MySQL rejects (a foreign key or constraint violation) is retried
+row by row, so one bad document doesn't fail its collection. Documents that
+can't be mapped or written are recorded under "failed" in the checkpoint file
+and listed at the end; fix them and re-run with --reset (rows are upserted, and
+documents without an id get one derived from their _id, so migrating
+everything again is safe).
+
+Usage:
+    python migrate_to_mysql.py [--batch-size 1000] [--only bookings] [--reset]
 """
+import argparse
 import asyncio
 import motor.motor_asyncio
 import os
 import json
 import uuid
+from time import perf_counter
 from datetime import datetime, timezone
+from pathlib import Path
+from bson import ObjectId
 from dotenv import load_dotenv
-from database import init_db, close_db, get_db_connection, insert_record
+from database import init_db, close_db, upsert_many, execute_query
 
 # Load environment variables
 load_dotenv()
@@ -17,316 +36,417 @@ load_dotenv()
 # MongoDB connection (for reading old data)
 MONGO_URL = os.environ.get('MONGO_URL')
 mongo_client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_URL)
-mongo_db = mongo_client.frisorDB
-
-async def migrate_users():
-    """Migrate users from MongoDB to MySQL"""
-    print("Migrating users...")
-    
-    users = await mongo_db.users.find({}).to_list(length=None)
-    user_passwords = await mongo_db.user_passwords.find({}).to_list(length=None)
-    
-    # Create password lookup
-    password_lookup = {pwd['user_id']: pwd['password'] for pwd in user_passwords}
-    
-    for user in users:
-        user_data = {
-            'id': user.get('id', str(uuid.uuid4())),
-            'name': user.get('name', ''),
-            'email': user.get('email', ''),
-            'phone': user.get('phone', ''),
-            'is_admin': user.get('is_admin', False),
-            'created_at': user.get('created_at', datetime.now(timezone.utc))
-        }
-        
-        try:
-            await insert_record('users', user_data)
-            
-            # Insert password if exists
-            if user_data['id'] in password_lookup:
-                password_data = {
-                    'user_id': user_data['id'],
-                    'password': password_lookup[user_data['id']]
-                }
-                await insert_record('user_passwords', password_data)
-                
-            print(f"Migrated user: {user_data['name']} ({user_data['email']})")
-        except Exception as e:
-            print(f"Error migrating user {user_data.get('email', 'unknown')}: {e}")
-
-async def migrate_services():
-    """Migrate services from MongoDB to MySQL"""
-    print("Migrating services...")
-    
-    services = await mongo_db.services.find({}).to_list(length=None)
-    
-    for service in services:
-        service_data = {
-            'id': service.get('id', str(uuid.uuid4())),
-            'name': service.get('name', ''),
-            'duration_minutes': service.get('duration_minutes', 30),
-            'price': float(service.get('price', 0)),
-            'description': service.get('description', ''),
-            'category': service.get('category', 'general'),
-            'icon': service.get('icon', '✨'),
-            'created_at': service.get('created_at', datetime.now(timezone.utc))
-        }
-        
-        try:
-            await insert_record('services', service_data)
-            print(f"Migrated service: {service_data['name']}")
-        except Exception as e:
-            print(f"Error migrating service {service_data.get('name', 'unknown')}: {e}")
-
-async def migrate_staff():
-    """Migrate staff from MongoDB to MySQL"""
-    print("Migrating staff...")
-    
-    staff_members = await mongo_db.staff.find({}).to_list(length=None)
-    
-    for staff in staff_members:
-        staff_data = {
-            'id': staff.get('id', str(uuid.uuid4())),
-            'name': staff.get('name', ''),
-            'bio': staff.get('bio', ''),
-            'experience_years': staff.get('experience_years', 0),
-            'specialties': staff.get('specialties', []),
-            'phone': staff.get('phone', ''),
-            'email': staff.get('email', ''),
-            'avatar_url': staff.get('avatar_url', ''),
-            'portfolio_images': staff.get('portfolio_images', []),
-            'available_hours': staff.get('available_hours', {}),
-            'created_at': staff.get('created_at', datetime.now(timezone.utc))
-        }
-        
-        try:
-            await insert_record('staff', staff_data)
-            print(f"Migrated staff: {staff_data['name']}")
-        except Exception as e:
-            print(f"Error migrating staff {staff_data.get('name', 'unknown')}: {e}")
-
-async def migrate_bookings():
-    """Migrate bookings from MongoDB to MySQL"""
-    print("Migrating bookings...")
-    
-    bookings = await mongo_db.bookings.find({}).to_list(length=None)
-    
-    for booking in bookings:
-        booking_data = {
-            'id': booking.get('id', str(uuid.uuid4())),
-            'customer_id': booking.get('customer_id', str(uuid.uuid4())),
-            'customer_name': booking.get('customer_name', ''),
-            'customer_email': booking.get('customer_email', ''),
-            'customer_phone': booking.get('customer_phone', ''),
-            'staff_id': booking.get('staff_id', ''),
-            'services': booking.get('services', []),
-            'booking_date': booking.get('date', datetime.now().date()),
-            'booking_time': booking.get('time', datetime.now().time()),
-            'total_duration': booking.get('total_duration', 30),
-            'total_price': float(booking.get('total_price', 0)),
-            'payment_method': booking.get('payment_method', 'cash'),
-            'payment_status': booking.get('payment_status', 'pending'),
-            'status': booking.get('status', 'pending'),
-            'notes': booking.get('notes', ''),
-            'admin_notes': booking.get('admin_notes', ''),
-            'created_at': booking.get('created_at', datetime.now(timezone.utc))
-        }
-        
-        try:
-            await insert_record('bookings', booking_data)
-            print(f"Migrated booking: {booking_data['id']}")
-        except Exception as e:
-            print(f"Error migrating booking {booking_data.get('id', 'unknown')}: {e}")
-
-async def migrate_gallery():
-    """Migrate gallery from MongoDB to MySQL"""
-    print("Migrating gallery...")
-    
-    gallery_items = await mongo_db.gallery.find({}).to_list(length=None)
-    
-    for item in gallery_items:
-        gallery_data = {
-            'id': item.get('id', str(uuid.uuid4())),
-            'title': item.get('title', ''),
-            'description': item.get('description', ''),
-            'before_image': item.get('before_image', ''),
-            'after_image': item.get('after_image', ''),
-            'service_type': item.get('service_type', ''),
-            'staff_id': item.get('staff_id'),
-            'is_featured': item.get('is_featured', False),
-            'created_at': item.get('created_at', datetime.now(timezone.utc))
-        }
-        
-        try:
-            await insert_record('gallery', gallery_data)
-            print(f"Migrated gallery item: {gallery_data['title']}")
-        except Exception as e:
-            print(f"Error migrating gallery item {gallery_data.get('title', 'unknown')}: {e}")
-
-async def migrate_pages():
-    """Migrate pages from MongoDB to MySQL"""
-    print("Migrating pages...")
-    
-    pages = await mongo_db.pages.find({}).to_list(length=None)
-    
-    for page in pages:
-        page_data = {
-            'id': page.get('id', str(uuid.uuid4())),
-            'title': page.get('title', ''),
-            'slug': page.get('slug', ''),
-            'content': page.get('content', ''),
-            'excerpt': page.get('excerpt', ''),
-            'meta_description': page.get('meta_description', ''),
-            'page_type': page.get('page_type', 'page'),
-            'categories': page.get('categories', []),
-            'tags': page.get('tags', []),
-            'featured_image': page.get('featured_image', ''),
-            'images': page.get('images', []),
-            'videos': page.get('videos', []),
-            'is_published': page.get('is_published', True),
-            'show_in_navigation': page.get('show_in_navigation', False),
-            'navigation_order': page.get('navigation_order', 0),
-            'created_at': page.get('created_at', datetime.now(timezone.utc))
-        }
-        
+mongo_db = mongo_client[os.environ.get('DB_NAME', 'frisorDB')]
+
+CHECKPOINT_FILE = Path(os.environ.get(
+    'MIGRATION_CHECKPOINT_FILE', Path(__file__).parent / 'migration_checkpoint.json'
+))
+
+def to_datetime(value, default=None):
+    """Normalize ISO strings and aware datetimes to naive UTC datetimes for MySQL"""
+    if value is None:
+        value = default
+    if isinstance(value, str):
         try:
-            await insert_record('pages', page_data)
-            print(f"Migrated page: {page_data['title']}")
-        except Exception as e:
-            print(f"Error migrating page {page_data.get('title', 'unknown')}: {e}")
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            value = default
+    if isinstance(value, datetime) and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+# Document mappers (MongoDB document -> MySQL row)
+def stable_id(document, purpose: str = 'id'):
+    """A UUID derived from the document's _id, so re-runs upsert the same row instead of adding one"""
+    return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{document['_id']}:{purpose}"))
+
+def map_user(user):
+    return {
+        'id': user.get('id') or stable_id(user),
+        'name': user.get('name', ''),
+        'email': user.get('email', ''),
+        'phone': user.get('phone', ''),
+        'is_admin': user.get('is_admin', False),
+        'created_at': to_datetime(user.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_user_password(password_doc):
+    return {
+        'user_id': password_doc['user_id'],
+        'password': password_doc['password']
+    }
+
+def map_service(service):
+    return {
+        'id': service.get('id') or stable_id(service),
+        'name': service.get('name', ''),
+        'duration_minutes': service.get('duration_minutes', 30),
+        'price': float(service.get('price', 0)),
+        'description': service.get('description', ''),
+        'category': service.get('category', 'general'),
+        'icon': service.get('icon', '✨'),
+        'created_at': to_datetime(service.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_staff(staff):
+    return {
+        'id': staff.get('id') or stable_id(staff),
+        'name': staff.get('name', ''),
+        'bio': staff.get('bio', ''),
+        'experience_years': staff.get('experience_years', 0),
+        'specialties': staff.get('specialties', []),
+        'phone': staff.get('phone', ''),
+        'email': staff.get('email', ''),
+        'avatar_url': staff.get('avatar_url', ''),
+        'portfolio_images': staff.get('portfolio_images', []),
+        'available_hours': staff.get('available_hours', {}),
+        'created_at': to_datetime(staff.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_booking(booking):
+    return {
+        'id': booking.get('id') or stable_id(booking),
+        'customer_id': booking.get('customer_id') or stable_id(booking, 'customer'),
+        'customer_name': booking.get('customer_name', ''),
+        'customer_email': booking.get('customer_email', ''),
+        'customer_phone': booking.get('customer_phone', ''),
+        'staff_id': booking.get('staff_id', ''),
+        'services': booking.get('services', []),
+        'booking_date': booking.get('booking_date', booking.get('date', datetime.now().date())),
+        'booking_time': booking.get('booking_time', booking.get('time', datetime.now().time())),
+        'total_duration': booking.get('total_duration', 30),
+        'total_price': float(booking.get('total_price', 0)),
+        'payment_method': booking.get('payment_method', 'cash'),
+        'payment_status': booking.get('payment_status', 'pending'),
+        'status': booking.get('status', 'pending'),
+        'notes': booking.get('notes', ''),
+        'admin_notes': booking.get('admin_notes', ''),
+        'created_at': to_datetime(booking.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_gallery_item(item):
+    return {
+        'id': item.get('id') or stable_id(item),
+        'title': item.get('title', ''),
+        'description': item.get('description', ''),
+        'before_image': item.get('before_image', ''),
+        'after_image': item.get('after_image', ''),
+        'service_type': item.get('service_type', ''),
+        'staff_id': item.get('staff_id'),
+        'is_featured': item.get('is_featured', False),
+        'created_at': to_datetime(item.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_page(page):
+    return {
+        'id': page.get('id') or stable_id(page),
+        'title': page.get('title', ''),
+        'slug': page.get('slug', ''),
+        'content': page.get('content', ''),
+        'excerpt': page.get('excerpt', ''),
+        'meta_description': page.get('meta_description', ''),
+        'page_type': page.get('page_type', 'page'),
+        'categories': page.get('categories', []),
+        'tags': page.get('tags', []),
+        'featured_image': page.get('featured_image', ''),
+        'images': page.get('images', []),
+        'videos': page.get('videos', []),
+        'is_published': page.get('is_published', True),
+        'show_in_navigation': page.get('show_in_navigation', False),
+        'navigation_order': page.get('navigation_order', 0),
+        'created_at': to_datetime(page.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_staff_break(break_item):
+    return {
+        'id': break_item.get('id') or stable_id(break_item),
+        'staff_id': break_item.get('staff_id', ''),
+        'start_date': break_item.get('start_date', datetime.now().date()),
+        'end_date': break_item.get('end_date', datetime.now().date()),
+        'start_time': break_item.get('start_time'),
+        'end_time': break_item.get('end_time'),
+        'reason': break_item.get('reason', ''),
+        'is_recurring': break_item.get('is_recurring', False),
+        'recurrence_pattern': break_item.get('recurrence_pattern', ''),
+        'created_at': to_datetime(break_item.get('created_at'), datetime.now(timezone.utc))
+    }
+
+def map_settings(settings):
+    return {
+        'id': 1,  # Fixed ID for settings
+        'site_title': settings.get('site_title', 'Frisor LaFata'),
+        'site_description': settings.get('site_description', 'Klassisk barbering siden 2010'),
+        'contact_phone': settings.get('contact_phone', '+45 12 34 56 78'),
+        'contact_email': settings.get('contact_email', 'info@frisorlafata.dk'),
+        'address': settings.get('address', 'Hovedgaden 123, 1000 København'),
+        'hero_title': settings.get('hero_title', 'Klassisk Barbering'),
+        'hero_subtitle': settings.get('hero_subtitle', 'i Hjertet af Byen'),
+        'hero_description': settings.get('hero_description', 'Oplev den autentiske barber-oplevelse hos Frisor LaFata.'),
+        'hero_image': settings.get('hero_image', ''),
+        # PayPal settings
+        'paypal_client_id': settings.get('paypal_client_id', ''),
+        'paypal_client_secret': settings.get('paypal_client_secret', ''),
+        'paypal_sandbox_mode': settings.get('paypal_sandbox_mode', True),
+        # Email settings
+        'email_smtp_server': settings.get('email_smtp_server', 'smtp.gmail.com'),
+        'email_smtp_port': settings.get('email_smtp_port', 587),
+        'email_user': settings.get('email_user', ''),
+        'email_password': settings.get('email_password', ''),
+        # Email templates
+        'email_subject_template': settings.get('email_subject_template', ''),
+        'email_body_template': settings.get('email_body_template', ''),
+        'reminder_subject_template': settings.get('reminder_subject_template', ''),
+        'reminder_body_template': settings.get('reminder_body_template', ''),
+        'email_confirmation_subject': settings.get('email_confirmation_subject', ''),
+        'email_confirmation_body': settings.get('email_confirmation_body', ''),
+        'email_change_subject': settings.get('email_change_subject', ''),
+        'email_change_body': settings.get('email_change_body', ''),
+        # Social Media Settings
+        'social_media_enabled': settings.get('social_media_enabled', True),
+        'social_media_title': settings.get('social_media_title', 'Follow Us'),
+        'social_media_description': settings.get('social_media_description', 'Se vores seneste arbejde og tilbud på sociale medier'),
+        # Instagram
+        'instagram_enabled': settings.get('instagram_enabled', True),
+        'instagram_username': settings.get('instagram_username', ''),
+        'instagram_hashtag': settings.get('instagram_hashtag', ''),
+        'instagram_embed_code': settings.get('instagram_embed_code', ''),
+        # Facebook
+        'facebook_enabled': settings.get('facebook_enabled', True),
+        'facebook_page_url': settings.get('facebook_page_url', ''),
+        'facebook_embed_code': settings.get('facebook_embed_code', ''),
+        # TikTok
+        'tiktok_enabled': settings.get('tiktok_enabled', False),
+        'tiktok_username': settings.get('tiktok_username', ''),
+        'tiktok_embed_code': settings.get('tiktok_embed_code', ''),
+        # Twitter/X
+        'twitter_enabled': settings.get('twitter_enabled', False),
+        'twitter_username': settings.get('twitter_username', ''),
+        'twitter_embed_code': settings.get('twitter_embed_code', ''),
+        # YouTube
+        'youtube_enabled': settings.get('youtube_enabled', False),
+        'youtube_channel_url': settings.get('youtube_channel_url', ''),
+        'youtube_embed_code': settings.get('youtube_embed_code', '')
+    }
+
+# Migration plan: tables only wait for the tables their foreign keys point to
+MIGRATIONS = [
+    {'collection': 'users', 'table': 'users', 'mapper': map_user, 'depends_on': []},
+    {'collection': 'services', 'table': 'services', 'mapper': map_service, 'depends_on': []},
+    {'collection': 'staff', 'table': 'staff', 'mapper': map_staff, 'depends_on': []},
+    {'collection': 'pages', 'table': 'pages', 'mapper': map_page, 'depends_on': []},
+    {'collection': 'user_passwords', 'table': 'user_passwords', 'mapper': map_user_password, 'depends_on': ['users']},
+    {'collection': 'bookings', 'table': 'bookings', 'mapper': map_booking, 'depends_on': ['users', 'staff']},
+    {'collection': 'gallery', 'table': 'gallery', 'mapper': map_gallery_item, 'depends_on': ['staff']},
+    {'collection': 'staff_breaks', 'table': 'staff_breaks', 'mapper': map_staff_break, 'depends_on': ['staff']},
+]
+
+# Checkpoints
+def load_checkpoints():
+    """Load per-collection progress from the checkpoint file"""
+    if CHECKPOINT_FILE.exists():
+        with open(CHECKPOINT_FILE) as f:
+            return json.load(f)
+    return {}
+
+def save_checkpoints(checkpoints):
+    """Write the checkpoint file atomically"""
+    tmp_path = CHECKPOINT_FILE.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(checkpoints, f, indent=2)
+    os.replace(tmp_path, CHECKPOINT_FILE)
+
+async def upgrade_schema():
+    """Schema changes made after mysql_schema.sql was first applied to existing databases"""
+    existing = await execute_query(
+        "SELECT COUNT(*) AS found FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = 'user_passwords' AND index_name = 'unique_user_password'",
+        fetch_one=True
+    )
+    if existing and existing['found']:
+        return
+    # ON DUPLICATE KEY UPDATE needs the key to dedupe; keep the newest hash per user
+    removed = await execute_query(
+        "DELETE older FROM user_passwords older JOIN user_passwords newer "
+        "ON older.user_id = newer.user_id AND older.id < newer.id"
+    )
+    await execute_query("ALTER TABLE user_passwords ADD UNIQUE KEY unique_user_password (user_id)")
+    print(f"Added unique key on user_passwords.user_id ({removed} duplicate rows removed)")
 
-async def migrate_settings():
+async def migrate_collection(migration, checkpoints, batch_size):
+    """Stream one collection into MySQL in bulk batches, checkpointing after each batch"""
+    collection = migration['collection']
+    table = migration['table']
+    mapper = migration['mapper']
+    checkpoint = checkpoints.setdefault(collection, {'last_id': None, 'rows': 0, 'completed': False})
+    checkpoint.setdefault('failed', [])
+
+    if checkpoint['completed']:
+        print(f"Skipping {collection}: already migrated ({checkpoint['rows']} rows)")
+        return {'collection': collection, 'rows': 0, 'seconds': 0.0, 'skipped': True}
+
+    query = {}
+    if checkpoint['last_id']:
+        query['_id'] = {'$gt': ObjectId(checkpoint['last_id'])}
+        print(f"Resuming {collection} after {checkpoint['last_id']} ({checkpoint['rows']} rows done)")
+    else:
+        print(f"Migrating {collection}...")
+
+    started = perf_counter()
+    migrated = 0
+    failed = 0
+    cursor = mongo_db[collection].find(query).sort('_id', 1).batch_size(batch_size)
+
+    def record_failure(document, stage, error):
+        nonlocal failed
+        failed += 1
+        print(f"Error {stage} {collection} document {document.get('_id')}: {error}")
+        # last_id moves past it, so the checkpoint is the only record it was left out
+        checkpoint['failed'].append({
+            '_id': str(document.get('_id')), 'id': document.get('id'), 'stage': stage, 'error': str(error)
+        })
+
+    async def write_batch(documents):
+        nonlocal migrated
+        mapped = []
+        for document in documents:
+            try:
+                mapped.append((document, mapper(document)))
+            except Exception as e:
+                record_failure(document, 'mapping', e)
+        written = 0
+        if mapped:
+            try:
+                await upsert_many(table, [row for _, row in mapped], batch_size=batch_size)
+                written = len(mapped)
+            except Exception as e:
+                # The whole batch was rolled back; find the offending rows one at a time
+                print(f"Batch of {len(mapped)} {collection} rows failed ({e}), retrying row by row")
+                for document, row in mapped:
+                    try:
+                        await upsert_many(table, [row])
+                        written += 1
+                    except Exception as row_error:
+                        record_failure(document, 'writing', row_error)
+        migrated += written
+        checkpoint['last_id'] = str(documents[-1]['_id'])
+        checkpoint['rows'] += written
+        save_checkpoints(checkpoints)
+
+    batch = []
+    async for document in cursor:
+        batch.append(document)
+        if len(batch) >= batch_size:
+            await write_batch(batch)
+            batch = []
+    if batch:
+        await write_batch(batch)
+
+    checkpoint['completed'] = True
+    save_checkpoints(checkpoints)
+
+    seconds = perf_counter() - started
+    rate = migrated / seconds if seconds > 0 else 0.0
+    print(f"✅ {collection}: {migrated} rows in {seconds:.2f}s ({rate:,.0f} rows/sec)"
+          + (f", {failed} documents failed" if failed else ""))
+    return {'collection': collection, 'rows': migrated, 'seconds': seconds, 'skipped': False}
+
+async def migrate_settings(checkpoints):
     """Migrate site settings from MongoDB to MySQL"""
+    if checkpoints.get('settings', {}).get('completed'):
+        print("Skipping settings: already migrated")
+        return
+
     print("Migrating site settings...")
-    
-    settings = await mongo_db.site_settings.find_one({})
-    
+    settings = await mongo_db.settings.find_one({"type": "site_settings"})
+    if not settings:
+        settings = await mongo_db.site_settings.find_one({})
+
     if settings:
-        settings_data = {
-            'id': 1,  # Fixed ID for settings
-            'site_title': settings.get('site_title', 'Frisor LaFata'),
-            'site_description': settings.get('site_description', 'Klassisk barbering siden 2010'),
-            'contact_phone': settings.get('contact_phone', '+45 12 34 56 78'),
-            'contact_email': settings.get('contact_email', 'info@frisorlafata.dk'),
-            'address': settings.get('address', 'Hovedgaden 123, 1000 København'),
-            'hero_title': settings.get('hero_title', 'Klassisk Barbering'),
-            'hero_subtitle': settings.get('hero_subtitle', 'i Hjertet af Byen'),
-            'hero_description': settings.get('hero_description', 'Oplev den autentiske barber-oplevelse hos Frisor LaFata.'),
-            'hero_image': settings.get('hero_image', ''),
-            # PayPal settings
-            'paypal_client_id': settings.get('paypal_client_id', ''),
-            'paypal_client_secret': settings.get('paypal_client_secret', ''),
-            'paypal_sandbox_mode': settings.get('paypal_sandbox_mode', True),
-            # Email settings
-            'email_smtp_server': settings.get('email_smtp_server', 'smtp.gmail.com'),
-            'email_smtp_port': settings.get('email_smtp_port', 587),
-            'email_user': settings.get('email_user', ''),
-            'email_password': settings.get('email_password', ''),
-            # Email templates
-            'email_subject_template': settings.get('email_subject_template', ''),
-            'email_body_template': settings.get('email_body_template', ''),
-            'reminder_subject_template': settings.get('reminder_subject_template', ''),
-            'reminder_body_template': settings.get('reminder_body_template', ''),
-            'email_confirmation_subject': settings.get('email_confirmation_subject', ''),
-            'email_confirmation_body': settings.get('email_confirmation_body', ''),
-            'email_change_subject': settings.get('email_change_subject', ''),
-            'email_change_body': settings.get('email_change_body', ''),
-            # Social Media Settings
-            'social_media_enabled': settings.get('social_media_enabled', True),
-            'social_media_title': settings.get('social_media_title', 'Follow Us'),
-            'social_media_description': settings.get('social_media_description', 'Se vores seneste arbejde og tilbud på sociale medier'),
-            # Instagram
-            'instagram_enabled': settings.get('instagram_enabled', True),
-            'instagram_username': settings.get('instagram_username', ''),
-            'instagram_hashtag': settings.get('instagram_hashtag', ''),
-            'instagram_embed_code': settings.get('instagram_embed_code', ''),
-            # Facebook
-            'facebook_enabled': settings.get('facebook_enabled', True),
-            'facebook_page_url': settings.get('facebook_page_url', ''),
-            'facebook_embed_code': settings.get('facebook_embed_code', ''),
-            # TikTok
-            'tiktok_enabled': settings.get('tiktok_enabled', False),
-            'tiktok_username': settings.get('tiktok_username', ''),
-            'tiktok_embed_code': settings.get('tiktok_embed_code', ''),
-            # Twitter/X
-            'twitter_enabled': settings.get('twitter_enabled', False),
-            'twitter_username': settings.get('twitter_username', ''),
-            'twitter_embed_code': settings.get('twitter_embed_code', ''),
-            # YouTube
-            'youtube_enabled': settings.get('youtube_enabled', False),
-            'youtube_channel_url': settings.get('youtube_channel_url', ''),
-            'youtube_embed_code': settings.get('youtube_embed_code', '')
-        }
-        
-        try:
-            # Use INSERT ... ON DUPLICATE KEY UPDATE for settings
-            async with get_db_connection() as (connection, cursor):
-                columns = list(settings_data.keys())
-                placeholders = ['%s'] * len(columns)
-                values = list(settings_data.values())
-                
-                # Create the update clause for ON DUPLICATE KEY UPDATE
-                update_clause = ', '.join([f"{col} = VALUES({col})" for col in columns if col != 'id'])
-                
-                query = f"""
-                INSERT INTO site_settings ({', '.join(columns)}) 
-                VALUES ({', '.join(placeholders)}) 
-                ON DUPLICATE KEY UPDATE {update_clause}
-                """
-                
-                await cursor.execute(query, values)
-                print("Migrated site settings")
-        except Exception as e:
-            print(f"Error migrating settings: {e}")
-
-async def migrate_staff_breaks():
-    """Migrate staff breaks from MongoDB to MySQL"""
-    print("Migrating staff breaks...")
-    
-    breaks = await mongo_db.staff_breaks.find({}).to_list(length=None)
-    
-    for break_item in breaks:
-        break_data = {
-            'id': break_item.get('id', str(uuid.uuid4())),
-            'staff_id': break_item.get('staff_id', ''),
-            'start_date': break_item.get('start_date', datetime.now().date()),
-            'end_date': break_item.get('end_date', datetime.now().date()),
-            'start_time': break_item.get('start_time'),
-            'end_time': break_item.get('end_time'),
-            'reason': break_item.get('reason', ''),
-            'is_recurring': break_item.get('is_recurring', False),
-            'recurrence_pattern': break_item.get('recurrence_pattern', ''),
-            'created_at': break_item.get('created_at', datetime.now(timezone.utc))
-        }
-        
+        await upsert_many('site_settings', [map_settings(settings)])
+        print("Migrated site settings")
+
+    checkpoints['settings'] = {'last_id': None, 'rows': 1 if settings else 0, 'completed': True}
+    save_checkpoints(checkpoints)
+
+async def run_migrations(batch_size, only=None):
+    """Run all collection migrations, starting each as soon as its dependencies finish"""
+    checkpoints = load_checkpoints()
+    migrations = [m for m in MIGRATIONS if not only or m['collection'] in only]
+    done = {m['collection']: asyncio.Event() for m in MIGRATIONS}
+    failed = set()
+    for migration in MIGRATIONS:
+        if migration not in migrations:
+            done[migration['collection']].set()
+
+    async def run(migration):
         try:
-            await insert_record('staff_breaks', break_data)
-            print(f"Migrated staff break: {break_data['id']}")
-        except Exception as e:
-            print(f"Error migrating staff break {break_data.get('id', 'unknown')}: {e}")
+            for dependency in migration['depends_on']:
+                await done[dependency].wait()
+                if dependency in failed:
+                    raise RuntimeError(f"{migration['collection']} not migrated because {dependency} failed")
+            return await migrate_collection(migration, checkpoints, batch_size)
+        except Exception:
+            failed.add(migration['collection'])
+            raise
+        finally:
+            done[migration['collection']].set()
+
+    started = perf_counter()
+    tasks = [run(migration) for migration in migrations]
+    if not only or 'settings' in only:
+        tasks.append(migrate_settings(checkpoints))
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    seconds = perf_counter() - started
+    total_rows = 0
+    errors = []
+    print("\nMigration summary:")
+    for result in results:
+        if isinstance(result, Exception):
+            errors.append(result)
+        elif isinstance(result, dict):
+            total_rows += result['rows']
+            status = "skipped" if result['skipped'] else f"{result['rows']} rows in {result['seconds']:.2f}s"
+            print(f"  {result['collection']:<16} {status}")
+    rate = total_rows / seconds if seconds > 0 else 0.0
+    print(f"  {'total':<16} {total_rows} rows in {seconds:.2f}s ({rate:,.0f} rows/sec)")
+
+    failures = [(collection, failure) for collection, checkpoint in checkpoints.items()
+                for failure in checkpoint.get('failed', [])]
+    if failures:
+        print(f"\n⚠️  {len(failures)} documents were not migrated (also listed in {CHECKPOINT_FILE}):")
+        for collection, failure in failures:
+            print(f"  {collection} {failure['_id']} (id {failure['id']}), {failure['stage']}: {failure['error']}")
+
+    if errors:
+        for error in errors:
+            print(f"❌ {error!r}")
+        raise errors[0]
 
 async def main():
     """Main migration function"""
+    parser = argparse.ArgumentParser(description="Migrate MongoDB data to MySQL")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--only", nargs="+", metavar="COLLECTION",
+                        help="Only migrate these collections (including 'settings')")
+    parser.add_argument("--reset", action="store_true", help="Ignore and clear existing checkpoints")
+    args = parser.parse_args()
+
     print("Starting MongoDB to MySQL migration...")
-    
+
+    if args.reset and CHECKPOINT_FILE.exists():
+        CHECKPOINT_FILE.unlink()
+
     try:
         # Initialize MySQL database
         await init_db()
-        
-        # Run migrations in order (users first, then references)
-        await migrate_users()
-        await migrate_services()  
-        await migrate_staff()
-        await migrate_bookings()
-        await migrate_gallery()
-        await migrate_pages()
-        await migrate_settings()
-        await migrate_staff_breaks()
-        
+        await upgrade_schema()
+        await run_migrations(args.batch_size, args.only)
         print("✅ Migration completed successfully!")
-        
+
     except Exception as e:
         print(f"❌ Migration failed: {e}")
+        print(f"Progress is saved in {CHECKPOINT_FILE}; re-run to resume.")
         import traceback
         traceback.print_exc()
     finally:
@@ -335,4 +455,4 @@ async def main():
         mongo_client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Move uploads from the flat "<file_type>/<filename>" layout into shards
+
+Every flat file is moved to "<file_type>/<ab>/<cd>/<filename>" (see
+storage.py). Then media records and every upload URL in the collections that
+reference uploads are rewritten, in bulk batches. serve_uploaded_file
+resolves both layouts, so the site keeps working while this runs. Rerunning
+it is safe and picks up where an interrupted run stopped.
+
+    python migrate_upload_layout.py [--dry-run] [--batch-size 500]
+"""
+import argparse
+import asyncio
+import os
+from pathlib import Path
+from pymongo import UpdateOne
+from storage import get_storage, shard_key
+from media_gc import REFERENCE_COLLECTIONS, UPLOAD_TYPES, UPLOAD_URL
+from media_urls import KEY_PREFIXES
+
+def sharded(key: str) -> str:
+    """Sharded key for a flat key; sharded keys are returned unchanged"""
+    file_type, _, name = key.partition("/")
+    return key if "/" in name else shard_key(file_type, name)
+
+def rewrite_urls(value):
+    """The value with every flat key or upload URL in any nested string pointed at its shard"""
+    if isinstance(value, str):
+        if value.startswith(KEY_PREFIXES):
+            return sharded(value)
+        if "/uploads/" not in value:
+            return value
+        return UPLOAD_URL.sub(lambda match: f"/uploads/{sharded(match[1])}", value)
+    if isinstance(value, dict):
+        return {field: rewrite_urls(item) for field, item in value.items()}
+    if isinstance(value, list):
+        return [rewrite_urls(item) for item in value]
+    return value
+
+async def move_files(dry_run: bool):
+    storage = get_storage()
+    moves = []
+    for file_type in UPLOAD_TYPES:
+        async for key, _ in storage.iter_objects(f"{file_type}/"):
+            name = key.split("/", 1)[1]
+            if "/" not in name and not name.startswith("."):
+                moves.append((key, sharded(key)))
+    if not dry_run:
+        for old_key, new_key in moves:
+            await storage.move(old_key, new_key)
+    return len(moves)
+
+async def flush(collection, operations, dry_run: bool):
+    if operations and not dry_run:
+        await collection.bulk_write(operations, ordered=False)
+    count = len(operations)
+    operations.clear()
+    return count
+
+async def rewrite_media_records(db, batch_size: int, dry_run: bool):
+    operations, updated = [], 0
+    async for media in db.media.find({}, {"key": 1, "variants": 1}).batch_size(batch_size):
+        key = sharded(media["key"])
+        variants = {
+            size: {fmt: sharded(variant_key) for fmt, variant_key in formats.items()}
+            for size, formats in (media.get("variants") or {}).items()
+        }
+        if key != media["key"] or variants != (media.get("variants") or {}):
+            operations.append(UpdateOne({"_id": media["_id"]}, {"$set": {"key": key, "variants": variants}}))
+        if len(operations) >= batch_size:
+            updated += await flush(db.media, operations, dry_run)
+    return updated + await flush(db.media, operations, dry_run)
+
+async def rewrite_references(db, collection_name: str, batch_size: int, dry_run: bool):
+    collection = db[collection_name]
+    operations, updated = [], 0
+    async for document in collection.find({}).batch_size(batch_size):
+        changes = {}
+        for field, value in document.items():
+            if field != "_id":
+                rewritten = rewrite_urls(value)
+                if rewritten != value:
+                    changes[field] = rewritten
+        if changes:
+            operations.append(UpdateOne({"_id": document["_id"]}, {"$set": changes}))
+        if len(operations) >= batch_size:
+            updated += await flush(collection, operations, dry_run)
+    return updated + await flush(collection, operations, dry_run)
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Move uploads into the sharded layout")
+    parser.add_argument("--dry-run", action="store_true", help="Only count what would change")
+    parser.add_argument("--batch-size", type=int, default=500, help="Documents per bulk write")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    verb = "Would update" if args.dry_run else "Updated"
+    try:
+        # Files first: the serving route finds moved files from old URLs, not the reverse
+        moved = await move_files(args.dry_run)
+        print(f"{'Would move' if args.dry_run else 'Moved'} {moved} files into shards")
+        media = await rewrite_media_records(db, args.batch_size, args.dry_run)
+        print(f"{verb} {media} media records")
+        for collection_name in REFERENCE_COLLECTIONS:
+            updated = await rewrite_references(db, collection_name, args.batch_size, args.dry_run)
+            print(f"{verb} {updated} {collection_name} documents")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
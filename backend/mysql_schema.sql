@@ -21,6 +21,7 @@ CREATE TABLE user_passwords (
     user_id VARCHAR(36) NOT NULL,
     password VARCHAR(255) NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY unique_user_password (user_id), -- One hash per user, lets migrations upsert
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
@@ -231,6 +232,7 @@ CREATE INDEX idx_bookings_date ON bookings(booking_date);
 CREATE INDEX idx_bookings_staff ON bookings(staff_id);
 CREATE INDEX idx_bookings_customer ON bookings(customer_id);
 CREATE INDEX idx_bookings_status ON bookings(status);
+CREATE INDEX idx_bookings_revenue ON bookings(payment_status, booking_date, status, staff_id, total_price);
 CREATE INDEX idx_gallery_featured ON gallery(is_featured);
 CREATE INDEX idx_pages_published ON pages(is_published);
 CREATE INDEX idx_pages_slug ON pages(slug);
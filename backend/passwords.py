@@ -0,0 +1,82 @@
+"""
+Password hashing off the event loop
+
+bcrypt takes ~250 ms per hash/verify and blocks every other request when it runs
+on the event loop. PasswordHasher runs passlib in a bounded thread pool (bcrypt
+releases the GIL while hashing) behind an async API, and keeps queue-depth
+metrics so admins can see when logins are backing up.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+class HasherBusy(Exception):
+    """Raised when too many hash requests are already waiting"""
+
+class PasswordHasher:
+    def __init__(self, context, max_workers: int = None, max_queue: int = None):
+        self.context = context
+        self.max_workers = max_workers or min(4, os.cpu_count() or 1)
+        self.max_queue = max_queue or self.max_workers * 25
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="password-hash")
+        self._slots = None
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.peak_queue = 0
+        self.total_wait = 0.0
+        self.total_work = 0.0
+
+    async def _run(self, func, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HasherBusy("Too many password operations waiting")
+        if self._slots is None:
+            # Created lazily so it binds to the running event loop
+            self._slots = asyncio.Semaphore(self.max_workers)
+
+        self.queued += 1
+        self.peak_queue = max(self.peak_queue, self.queued)
+        queued_at = perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        started = perf_counter()
+        self.total_wait += started - queued_at
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        finally:
+            self.in_flight -= 1
+            self.completed += 1
+            self.total_work += perf_counter() - started
+            self._slots.release()
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self.context.verify, password, hashed)
+
+    async def verify_and_update(self, password: str, hashed: str):
+        """Return (valid, new_hash); new_hash is set when the hash should be upgraded"""
+        return await self._run(self.context.verify_and_update, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queued": self.queued,
+            "in_flight": self.in_flight,
+            "peak_queue": self.peak_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_ms": round(self.total_wait / self.completed * 1000, 2) if self.completed else 0,
+            "avg_hash_ms": round(self.total_work / self.completed * 1000, 2) if self.completed else 0,
+        }
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Rewrite stored media URLs in bulk, e.g. after a domain change
+
+    python rewrite_media_urls.py OLD NEW [--backend mongo|mysql] [--dry-run]
+
+    python rewrite_media_urls.py https://old.example.com/uploads/ https://new.example.com/api/uploads/
+
+Every occurrence of OLD is replaced by NEW in all URL-bearing fields. The
+replacement runs in the database: MongoDB gets one `update_many` per
+collection with an aggregation-pipeline `$replaceAll` over strings, lists
+and nested variant maps, and MySQL gets one UPDATE per table with REPLACE().
+No documents are loaded into Python.
+
+Records written since media_urls.py store storage keys, and page content and
+homepage sections store domain-less /api/uploads/ paths; neither needs
+rewriting (set MEDIA_BASE_URL instead). This is for absolute URLs stored
+earlier, external URLs, and the MySQL backend, which still stores URLs.
+"""
+import argparse
+import asyncio
+import os
+import re
+from pathlib import Path
+from media import VARIANT_SIZES, EXTENSIONS
+
+# Collection -> {field: kind}; kinds are "string", "list", "variants" ({size: {format: url}})
+# and "variants_list" (a list of variant maps)
+MONGO_URL_FIELDS = {
+    "staff": {
+        "avatar_url": "string", "portfolio_images": "list",
+        "avatar_variants": "variants", "portfolio_variants": "variants_list",
+    },
+    "gallery": {
+        "before_image": "string", "after_image": "string",
+        "before_image_variants": "variants", "after_image_variants": "variants",
+    },
+    "pages": {"featured_image": "string", "content": "string", "images": "list", "videos": "list"},
+    "settings": {"hero_image": "string", "hero_video": "string"},
+    "homepage_sections": {"button_url": "string", "custom_css": "string"},
+}
+
+# Table -> columns holding URLs, as text or JSON text (mysql_schema.sql)
+MYSQL_URL_COLUMNS = {
+    "staff": ["avatar_url", "portfolio_images"],
+    "gallery": ["before_image", "after_image"],
+    "pages": ["featured_image", "content", "images", "videos"],
+    "site_settings": ["hero_image", "hero_video"],
+    "homepage_sections": ["button_url", "custom_css"],
+}
+
+# MongoDB
+def replace_string(value, old: str, new: str):
+    return {"$cond": [
+        {"$eq": [{"$type": value}, "string"]},
+        {"$replaceAll": {"input": value, "find": old, "replacement": new}},
+        value
+    ]}
+
+def replace_list(value, old: str, new: str, item_expression=None, name: str = "item"):
+    item_expression = item_expression or (lambda item: replace_string(item, old, new))
+    return {"$cond": [
+        {"$isArray": value},
+        {"$map": {"input": value, "as": name, "in": item_expression(f"$${name}")}},
+        value
+    ]}
+
+def replace_map(value, item_expression, name: str):
+    """Apply item_expression to every value of an object"""
+    return {"$cond": [
+        {"$eq": [{"$type": value}, "object"]},
+        {"$arrayToObject": {"$map": {
+            "input": {"$objectToArray": value}, "as": name,
+            "in": {"k": f"$${name}.k", "v": item_expression(f"$${name}.v")}
+        }}},
+        value
+    ]}
+
+def replace_variants(value, old: str, new: str):
+    return replace_map(
+        value, lambda formats: replace_map(formats, lambda url: replace_string(url, old, new), "format"), "size"
+    )
+
+def field_expression(field: str, kind: str, old: str, new: str):
+    value = f"${field}"
+    if kind == "list":
+        return replace_list(value, old, new)
+    if kind == "variants":
+        return replace_variants(value, old, new)
+    if kind == "variants_list":
+        return replace_list(value, old, new, lambda item: replace_variants(item, old, new), "variants")
+    return replace_string(value, old, new)
+
+def match_paths(field: str, kind: str):
+    """Paths to regex-match when filtering documents that contain the old URL"""
+    if kind in ("variants", "variants_list"):
+        formats = sorted(set(EXTENSIONS))
+        return [f"{field}.{size}.{fmt}" for size in VARIANT_SIZES for fmt in formats]
+    return [field]
+
+def mongo_rewrite(collection_fields, old: str, new: str):
+    """(filter, pipeline) for one collection's update_many"""
+    pattern = {"$regex": re.escape(old)}
+    query = {"$or": [
+        {path: pattern} for field, kind in collection_fields.items() for path in match_paths(field, kind)
+    ]}
+    pipeline = [{"$set": {
+        field: field_expression(field, kind, old, new) for field, kind in collection_fields.items()
+    }}]
+    return query, pipeline
+
+async def rewrite_mongo(db, old: str, new: str, dry_run: bool):
+    results = {}
+    for collection, fields in MONGO_URL_FIELDS.items():
+        query, pipeline = mongo_rewrite(fields, old, new)
+        if dry_run:
+            results[collection] = await db[collection].count_documents(query)
+        else:
+            result = await db[collection].update_many(query, pipeline)
+            results[collection] = result.modified_count
+    return results
+
+# MySQL
+def like_pattern(text: str) -> str:
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+def mysql_rewrite(table: str, columns, old: str, new: str):
+    """(query, params) for one table's bulk UPDATE"""
+    assignments = ", ".join(f"{column} = REPLACE({column}, %s, %s)" for column in columns)
+    where = " OR ".join(f"{column} LIKE %s" for column in columns)
+    params = [value for _ in columns for value in (old, new)] + [like_pattern(old)] * len(columns)
+    return f"UPDATE {table} SET {assignments} WHERE {where}", tuple(params)
+
+async def rewrite_mysql(old: str, new: str, dry_run: bool):
+    from database import execute_query, close_db
+
+    results = {}
+    try:
+        for table, columns in MYSQL_URL_COLUMNS.items():
+            if dry_run:
+                where = " OR ".join(f"{column} LIKE %s" for column in columns)
+                row = await execute_query(
+                    f"SELECT COUNT(*) AS matches FROM {table} WHERE {where}",
+                    (like_pattern(old),) * len(columns), fetch_one=True
+                )
+                results[table] = row["matches"] if row else 0
+            else:
+                query, params = mysql_rewrite(table, columns, old, new)
+                results[table] = await execute_query(query, params)
+    finally:
+        await close_db()
+    return results
+
+async def main():
+    from dotenv import load_dotenv
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Replace OLD with NEW in every stored media URL")
+    parser.add_argument("old", help="Text to replace, e.g. https://old.example.com/uploads/")
+    parser.add_argument("new", help="Replacement, e.g. https://new.example.com/api/uploads/")
+    parser.add_argument("--backend", choices=["mongo", "mysql"], default="mongo")
+    parser.add_argument("--dry-run", action="store_true", help="Only count matching records")
+    args = parser.parse_args()
+    if not args.old:
+        parser.error("OLD must not be empty")
+
+    if args.backend == "mysql":
+        results = await rewrite_mysql(args.old, args.new, args.dry_run)
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+        try:
+            results = await rewrite_mongo(client[os.environ['DB_NAME']], args.old, args.new, args.dry_run)
+        finally:
+            client.close()
+
+    verb = "would be updated" if args.dry_run else "updated"
+    for name, count in results.items():
+        print(f"{name}: {count} {verb}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained daily revenue rollups
+
+`daily_stats` holds one document per (date, staff_id, service_id) with the paid
+revenue and booking count for that day. Service rows carry the revenue share of
+each service; a row with service_id "_all" carries the booking totals per staff
+member. Booking writes call `on_booking_changed(db, old, new)`, which applies
+the difference between the old and new contributions with `$inc`, so analytics
+for any period only has to sum a few hundred rollup rows.
+
+The API builds daily_stats in the background on first start and serves
+revenue analytics from raw bookings until it is ready. Rebuild from raw
+bookings (after manual edits):
+    python rollups.py rebuild
+
+A rebuild runs while bookings keep changing. Every rollup write records the
+days it touched in `daily_stats_dirty`, and once the rebuilt collection is
+swapped in, the days touched since the rebuild started are recomputed from raw
+bookings, so deltas that landed in the old collection aren't lost.
+"""
+import argparse
+import asyncio
+import os
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone
+from pymongo import UpdateOne
+from analytics import (
+    REVENUE_STATUSES, MONGO_LINE_ITEMS, booking_line_items, bump_bookings_version,
+    build_revenue_response, lookup_names, mongo_period_key, mongo_revenue_analytics
+)
+
+ALL_SERVICES = "_all"
+BUILT_MARKER = "daily_stats_built"
+# Allowance for clock differences between API servers when replaying dirty days
+CLOCK_SKEW = timedelta(minutes=1)
+
+def booking_day(booking):
+    """Midnight of the day a booking takes place"""
+    start_at = booking.get("start_at")
+    if isinstance(start_at, datetime):
+        day = start_at.date()
+    elif isinstance(booking.get("booking_date"), date):
+        day = booking["booking_date"]
+    else:
+        day = date.fromisoformat(str(booking["booking_date"])[:10])
+    return datetime.combine(day, datetime.min.time())
+
+def counts_as_revenue(booking):
+    return bool(booking) and booking.get("status") in REVENUE_STATUSES and booking.get("payment_status") == "paid"
+
+def booking_contributions(booking):
+    """Map (date, staff_id, service_id) -> [revenue, bookings] for one booking"""
+    if not counts_as_revenue(booking):
+        return {}
+    day = booking_day(booking)
+    staff_id = booking["staff_id"]
+    total_price = float(booking.get("total_price") or 0)
+    contributions = {(day, staff_id, ALL_SERVICES): [total_price, 1]}
+    for service_id, service_revenue in booking_line_items(booking):
+        key = (day, staff_id, service_id)
+        revenue, count = contributions.get(key, [0.0, 0])
+        contributions[key] = [revenue + service_revenue, count + 1]
+    return contributions
+
+async def on_booking_changed(db, old=None, new=None):
+    """
+    Apply the rollup delta between a booking's old and new state.
+
+    Writes that change no paid revenue (pending bookings, notes, reschedules
+    within the same day) leave the bookings version alone, so cached past
+    windows and the analytics snapshot stay valid.
+    """
+    deltas = defaultdict(lambda: [0.0, 0])
+    for sign, booking in ((-1, old), (1, new)):
+        for key, (revenue, count) in booking_contributions(booking).items():
+            deltas[key][0] += sign * revenue
+            deltas[key][1] += sign * count
+
+    operations = [
+        UpdateOne(
+            {"date": day, "staff_id": staff_id, "service_id": service_id},
+            {"$inc": {"revenue": revenue, "bookings": count}},
+            upsert=True
+        )
+        for (day, staff_id, service_id), (revenue, count) in deltas.items()
+        if revenue or count
+    ]
+    if operations:
+        await db.daily_stats.bulk_write(operations, ordered=False)
+        days = list({day for day, _, _ in deltas})
+        await db.daily_stats.delete_many({"date": {"$in": days}, "bookings": {"$lte": 0}})
+        # For a concurrent rebuild to replay
+        now = datetime.now(timezone.utc)
+        await db.daily_stats_dirty.bulk_write(
+            [UpdateOne({"date": day}, {"$set": {"at": now}}, upsert=True) for day in days], ordered=False
+        )
+        await bump_bookings_version(db)
+
+async def ensure_rollup_indexes(db):
+    await db.daily_stats.create_index([("date", 1), ("staff_id", 1), ("service_id", 1)], unique=True)
+    await db.daily_stats_dirty.create_index("date", unique=True)
+    # Only needed for as long as a rebuild can take
+    await db.daily_stats_dirty.create_index("at", expireAfterSeconds=24 * 3600)
+
+def rollup_pipelines(days=None):
+    """Pipelines computing the _all rows and the per-service rows from raw bookings, optionally for some days"""
+    match = {"$match": {"status": {"$in": REVENUE_STATUSES}, "payment_status": "paid"}}
+    day = {"$dateFromString": {"dateString": {"$substrCP": ["$booking_date", 0, 10]}}}
+    with_day = {"$addFields": {"day": {"$ifNull": [
+        {"$dateFromParts": {
+            "year": {"$year": "$start_at"}, "month": {"$month": "$start_at"}, "day": {"$dayOfMonth": "$start_at"}
+        }},
+        day
+    ]}}}
+    if days is not None:
+        with_day = [with_day, {"$match": {"day": {"$in": list(days)}}}]
+    else:
+        with_day = [with_day]
+    totals = [
+        match, *with_day,
+        {"$group": {
+            "_id": {"date": "$day", "staff_id": "$staff_id"},
+            "revenue": {"$sum": "$total_price"}, "bookings": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0, "date": "$_id.date", "staff_id": "$_id.staff_id",
+            "service_id": ALL_SERVICES, "revenue": 1, "bookings": 1
+        }}
+    ]
+    per_service = [
+        match, *with_day,
+        {"$project": {"day": 1, "staff_id": 1, "items": MONGO_LINE_ITEMS}},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": {"date": "$day", "staff_id": "$staff_id", "service_id": "$items.service_id"},
+            "revenue": {"$sum": "$items.revenue"}, "bookings": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0, "date": "$_id.date", "staff_id": "$_id.staff_id",
+            "service_id": "$_id.service_id", "revenue": 1, "bookings": 1
+        }}
+    ]
+    return totals, per_service
+
+async def recompute_days(db, days):
+    """Replace the daily_stats rows of the given days with totals from raw bookings"""
+    totals, per_service = rollup_pipelines(days)
+    await db.daily_stats.delete_many({"date": {"$in": list(days)}})
+    for pipeline in (totals, per_service):
+        await db.bookings.aggregate(pipeline + [{"$merge": {
+            "into": "daily_stats", "on": ["date", "staff_id", "service_id"],
+            "whenMatched": "replace", "whenNotMatched": "insert"
+        }}]).to_list(length=None)
+
+async def replay_dirty_days(db, since: datetime, max_passes: int = 10):
+    """Recompute days touched by booking writes since `since` until a pass finds none"""
+    replayed = 0
+    for _ in range(max_passes):
+        checked_at = datetime.now(timezone.utc)
+        days = await db.daily_stats_dirty.distinct("date", {"at": {"$gte": since - CLOCK_SKEW}})
+        if not days:
+            break
+        await recompute_days(db, days)
+        replayed += len(days)
+        since = checked_at
+    return replayed
+
+async def rebuild_daily_stats(db):
+    """Recompute daily_stats from raw bookings into a scratch collection, then swap it in"""
+    started_at = datetime.now(timezone.utc)
+    totals, per_service = rollup_pipelines()
+    scratch = "daily_stats_rebuild"
+    await db[scratch].drop()
+    await db.bookings.aggregate(totals + [{"$out": scratch}]).to_list(length=None)
+    await db.bookings.aggregate(per_service + [{"$merge": {"into": scratch}}]).to_list(length=None)
+    await db[scratch].create_index([("date", 1), ("staff_id", 1), ("service_id", 1)], unique=True)
+    await db[scratch].rename("daily_stats", dropTarget=True)
+    # Deltas applied to the old collection during the rebuild were dropped with it
+    await replay_dirty_days(db, started_at)
+    await db.counters.update_one(
+        {"_id": BUILT_MARKER}, {"$set": {"at": datetime.now(timezone.utc)}}, upsert=True
+    )
+    await bump_bookings_version(db)
+    return await db.daily_stats.count_documents({})
+
+async def daily_stats_ready(db) -> bool:
+    return await db.counters.find_one({"_id": BUILT_MARKER}) is not None
+
+async def ensure_daily_stats(db):
+    """Build daily_stats on first start; analytics use raw bookings until then"""
+    try:
+        if not await daily_stats_ready(db):
+            rows = await rebuild_daily_stats(db)
+            print(f"Built daily_stats: {rows} rollup rows")
+    except Exception as e:
+        print(f"Error building daily_stats: {e}")
+
+async def rollup_revenue_analytics(db, period, start, end, staff_id=None):
+    """Revenue analytics summed from daily_stats instead of raw bookings"""
+    if not await daily_stats_ready(db):
+        return await mongo_revenue_analytics(db, period, start, end, staff_id)
+    match = {"date": {
+        "$gte": datetime.combine(start, datetime.min.time()),
+        "$lte": datetime.combine(end, datetime.min.time())
+    }}
+    if staff_id:
+        match["staff_id"] = staff_id
+
+    totals = {"revenue": {"$sum": "$revenue"}, "bookings": {"$sum": "$bookings"}}
+    only_totals = {"$match": {"service_id": ALL_SERVICES}}
+    results = await db.daily_stats.aggregate([
+        {"$match": match},
+        {"$facet": {
+            "summary": [only_totals, {"$group": {"_id": None, **totals}}],
+            "by_period": [
+                only_totals,
+                {"$group": {"_id": mongo_period_key(period, "$date"), **totals}},
+                {"$sort": {"_id": 1}}
+            ],
+            "by_service": [
+                {"$match": {"service_id": {"$ne": ALL_SERVICES}}},
+                {"$group": {"_id": "$service_id", **totals}},
+                {"$sort": {"revenue": -1}},
+                {"$limit": 5}
+            ],
+            "by_staff": [
+                only_totals,
+                {"$group": {"_id": "$staff_id", **totals}},
+                {"$sort": {"revenue": -1}}
+            ]
+        }}
+    ]).to_list(length=1)
+
+    facets = results[0] if results else {}
+    summary = (facets.get("summary") or [{}])[0]
+    # Rows whose bookings were all moved or cancelled sum to zero and are left out
+    by_period = [row for row in facets.get("by_period", []) if row["bookings"]]
+    by_service = [row for row in facets.get("by_service", []) if row["bookings"]]
+    by_staff = [row for row in facets.get("by_staff", []) if row["bookings"]]
+
+    service_names = await lookup_names(db.services, [row["_id"] for row in by_service])
+    staff_names = await lookup_names(db.staff, [row["_id"] for row in by_staff])
+    return build_revenue_response(
+        period, start, end, summary, by_period, by_service, by_staff, service_names, staff_names
+    )
+
+async def main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from dotenv import load_dotenv
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Maintain daily revenue rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recompute daily_stats from all bookings")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        if args.command == "rebuild":
+            rows = await rebuild_daily_stats(db)
+            print(f"Rebuilt daily_stats: {rows} rollup rows")
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,12 +1,12 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, File, UploadFile, Request
 from contextlib import asynccontextmanager
-from fastapi.responses import FileResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, EmailStr
@@ -20,12 +20,29 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import paypalrestsdk
 import shutil
-import mimetypes
 from database import (
     init_db, close_db, get_db_connection, execute_query, 
     insert_record, update_record, delete_record,
     prepare_record_for_response, prepare_data_for_insert
 )
+from cache import TTLCache
+from analytics import resolve_window, ensure_analytics_indexes, cached_analytics
+from rollups import on_booking_changed, rollup_revenue_analytics, ensure_rollup_indexes, ensure_daily_stats
+from analytics_engine import revenue_history
+from utilization import staff_utilization, week_start, invalidate_utilization
+from forecasting import staffing_recommendations
+from file_uploads import save_upload, UploadLimitMiddleware, MAX_UPLOAD_BYTES
+from media import process_upload, attach_variants, shutdown_media_pool
+from media_urls import (
+    MediaKey, MediaUrl, MediaVariants, MediaText, MediaTextUrls, media_url,
+    SETTINGS_MEDIA_FIELDS, map_fields, store_as_key, map_text, store_text_keys, text_media_urls
+)
+from upload_responses import upload_response
+from passwords import PasswordHasher, HasherBusy
+from booking_dates import (
+    booking_window, break_window, corporate_duration,
+    ensure_window_indexes, migrate_booking_dates
+)
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -37,11 +54,25 @@ db = client[os.environ['DB_NAME']]
 
 # Security
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with a different cost are upgraded transparently on login
+BCRYPT_ROUNDS = int(os.environ.get('BCRYPT_ROUNDS', '12'))
+pwd_context = CryptContext(
+    schemes=["bcrypt"], deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_desired_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_desired_rounds=BCRYPT_ROUNDS
+)
+password_hasher = PasswordHasher(
+    pwd_context,
+    max_workers=int(os.environ.get('PASSWORD_HASH_WORKERS', '0')) or None
+)
 SECRET_KEY = os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
-# Use the frontend's backend URL for constructing image URLs
-BACKEND_URL = os.environ.get('REACT_APP_BACKEND_URL', 'http://localhost:8001')
+# Resolved users keyed by (token subject, issued-at) so admin screens don't hit the DB per call
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('AUTH_CACHE_SIZE', '1024')),
+    ttl=float(os.environ.get('AUTH_CACHE_TTL', '60'))
+)
 
 # Email configuration (will be configurable from admin)
 EMAIL_CONFIG = {
@@ -71,9 +102,26 @@ paypalrestsdk.configure({
 async def lifespan(app: FastAPI):
     # Initialize MySQL database (temporarily disabled until MySQL is properly configured)
     # await init_db()
+    await ensure_window_indexes(db)
+    await ensure_analytics_indexes(db)
+    await ensure_rollup_indexes(db)
+    # Indexes backing the single-query login lookup
+    await db.users.create_index("email")
+    await db.user_passwords.create_index("user_id")
+    await db.media.create_index("key", unique=True)
+    await db.media.create_index("sha256")
+    # Backfill start_at/end_at before serving: overlap checks and slot listings
+    # only match documents that have them (a no-op once everything is converted)
+    await migrate_booking_dates(db)
+    # Revenue analytics read raw bookings until the rollups are built
+    rollup_task = asyncio.create_task(ensure_daily_stats(db))
     yield
+    rollup_task.cancel()
     # Close MySQL database
     # await close_db()
+    client.close()
+    password_hasher.shutdown()
+    shutdown_media_pool()
 
 app = FastAPI(lifespan=lifespan, title="Frisor LaFata API", version="1.0.0")
 api_router = APIRouter(prefix="/api")
@@ -88,11 +136,16 @@ uploads_dir.mkdir(exist_ok=True)
 # Mount static files for uploads
 app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
+# Fields stored as native BSON dates for indexed range queries
+NATIVE_DATETIME_FIELDS = {"start_at", "end_at"}
+
 # Helper functions
 def prepare_for_mongo(data):
     """Convert datetime objects to ISO strings for MongoDB storage"""
     if isinstance(data, dict):
         for key, value in data.items():
+            if key in NATIVE_DATETIME_FIELDS:
+                continue
             if isinstance(value, datetime):
                 data[key] = value.isoformat()
             elif isinstance(value, date):
@@ -122,14 +175,47 @@ def parse_from_mongo(item):
                     pass
     return item
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+def snapshot_line_items(service_ids, services):
+    """Line items (service_id, name, price, duration) in booking order for the given services"""
+    service_map = {service["id"]: service for service in services}
+    return [
+        {
+            "service_id": service_id,
+            "name": service_map[service_id].get("name", ""),
+            "price": service_map[service_id]["price"],
+            "duration_minutes": service_map[service_id]["duration_minutes"]
+        }
+        for service_id in service_ids if service_id in service_map
+    ]
+
+async def find_overlapping_booking(staff_id, start_at, end_at, exclude_id=None):
+    """Return an active booking for the staff member overlapping [start_at, end_at)"""
+    query = {
+        "staff_id": staff_id,
+        "status": {"$in": ["pending", "confirmed"]},  # Only check active bookings
+        "start_at": {"$lt": end_at},
+        "end_at": {"$gt": start_at}
+    }
+    if exclude_id:
+        query["id"] = {"$ne": exclude_id}
+    return await db.bookings.find_one(query, {"_id": 0, "booking_time": 1})
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+async def verify_and_update_password(plain_password, hashed_password):
+    """Return (valid, new_hash); new_hash is set when the stored hash should be replaced"""
+    try:
+        return await password_hasher.verify_and_update(plain_password, hashed_password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
+
+async def get_password_hash(password):
+    try:
+        return await password_hasher.hash(password)
+    except HasherBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please try again")
 
 def create_access_token(data: dict):
     to_encode = data.copy()
+    to_encode.setdefault("iat", int(datetime.now(timezone.utc).timestamp()))
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -139,13 +225,26 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         user_id = payload.get("sub")
         if user_id is None:
             raise HTTPException(status_code=401, detail="Invalid token")
+        cache_key = (user_id, payload.get("iat"))
+        cached_user = user_cache.get(cache_key)
+        if cached_user is not None:
+            return cached_user
         user = await db.users.find_one({"id": user_id})
         if user is None:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        user_obj = User(**user)
+        user_cache.set(cache_key, user_obj)
+        return user_obj
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+def invalidate_cached_user(user_id: str = None, email: str = None):
+    """Drop cached users after their record changes"""
+    user_cache.discard_where(
+        lambda key, user: (user_id is not None and key[0] == user_id) or
+                          (email is not None and user.email == email)
+    )
+
 # Models
 class StaffBreak(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -186,8 +285,14 @@ class GalleryItem(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
     description: str = ""
-    before_image: str
-    after_image: str
+    before_image: MediaUrl
+    after_image: MediaUrl
+    # Resized copies by size and format, see media.py
+    before_image_variants: Optional[MediaVariants] = None
+    after_image_variants: Optional[MediaVariants] = None
+    # {width, height, placeholder} so pages can lay out before images load
+    before_image_meta: Optional[dict] = None
+    after_image_meta: Optional[dict] = None
     service_type: str = ""  # "haircut", "beard", "styling", etc.
     staff_id: Optional[str] = None
     is_featured: bool = False
@@ -196,8 +301,8 @@ class GalleryItem(BaseModel):
 class GalleryItemCreate(BaseModel):
     title: str
     description: str = ""
-    before_image: str
-    after_image: str
+    before_image: MediaKey
+    after_image: MediaKey
     service_type: str = ""
     staff_id: Optional[str] = None
     is_featured: bool = False
@@ -205,8 +310,8 @@ class GalleryItemCreate(BaseModel):
 class GalleryItemUpdate(BaseModel):
     title: Optional[str] = None
     description: Optional[str] = None
-    before_image: Optional[str] = None
-    after_image: Optional[str] = None
+    before_image: Optional[MediaKey] = None
+    after_image: Optional[MediaKey] = None
     service_type: Optional[str] = None
     staff_id: Optional[str] = None
     is_featured: Optional[bool] = None
@@ -251,8 +356,14 @@ class Staff(BaseModel):
     specialties: List[str] = Field(default_factory=list)
     phone: str = ""
     email: str = ""
-    avatar_url: Optional[str] = ""
-    portfolio_images: List[str] = Field(default_factory=list)
+    avatar_url: Optional[MediaUrl] = ""
+    portfolio_images: List[MediaUrl] = Field(default_factory=list)
+    # Resized copies by size and format, see media.py
+    avatar_variants: Optional[MediaVariants] = None
+    portfolio_variants: List[Optional[MediaVariants]] = Field(default_factory=list)
+    # {width, height, placeholder} so pages can lay out before images load
+    avatar_meta: Optional[dict] = None
+    portfolio_meta: List[Optional[dict]] = Field(default_factory=list)
     # Social Media Links
     instagram_url: str = ""
     facebook_url: str = ""
@@ -279,8 +390,8 @@ class StaffCreate(BaseModel):
     specialties: List[str] = Field(default_factory=list)
     phone: str = ""
     email: str = ""
-    avatar_url: str = ""
-    portfolio_images: List[str] = Field(default_factory=list)
+    avatar_url: MediaKey = ""
+    portfolio_images: List[MediaKey] = Field(default_factory=list)
     # Social Media Links
     instagram_url: str = ""
     facebook_url: str = ""
@@ -306,8 +417,8 @@ class StaffUpdate(BaseModel):
     specialties: Optional[List[str]] = None
     phone: Optional[str] = None
     email: Optional[str] = None
-    avatar_url: Optional[str] = None
-    portfolio_images: Optional[List[str]] = None
+    avatar_url: Optional[MediaKey] = None
+    portfolio_images: Optional[List[MediaKey]] = None
     # Social Media Links
     instagram_url: Optional[str] = None
     facebook_url: Optional[str] = None
@@ -348,6 +459,13 @@ class ServiceUpdate(BaseModel):
     description: Optional[str] = None
     category: Optional[str] = None
 
+class BookingLineItem(BaseModel):
+    # Snapshot of a service at booking time so later price changes don't rewrite history
+    service_id: str
+    name: str = ""
+    price: float
+    duration_minutes: int
+
 class Booking(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     customer_id: str
@@ -356,6 +474,7 @@ class Booking(BaseModel):
     customer_phone: Optional[str] = ""
     staff_id: str
     services: List[str]  # List of service IDs
+    line_items: List[BookingLineItem] = Field(default_factory=list)
     booking_date: date
     booking_time: time
     total_duration: int
@@ -407,6 +526,7 @@ class EmployeeService(BaseModel):
     employee_name: str
     service_ids: List[str]  # List of service IDs for this employee
     notes: Optional[str] = ""
+    line_items: List[BookingLineItem] = Field(default_factory=list)
 
 class CorporateBooking(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -487,15 +607,15 @@ class Page(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
     slug: str
-    content: str
+    content: MediaTextUrls
     meta_description: str = ""
     is_published: bool = True
     show_in_navigation: bool = True
     navigation_order: int = 0
     page_type: str = "page"  # "page", "blog", "about", "service"
-    featured_image: str = ""
-    images: List[str] = Field(default_factory=list)
-    videos: List[str] = Field(default_factory=list)
+    featured_image: MediaUrl = ""
+    images: List[MediaUrl] = Field(default_factory=list)
+    videos: List[MediaUrl] = Field(default_factory=list)
     categories: List[str] = Field(default_factory=list)
     tags: List[str] = Field(default_factory=list)
     excerpt: str = ""
@@ -505,15 +625,15 @@ class Page(BaseModel):
 class PageCreate(BaseModel):
     title: str
     slug: str
-    content: str
+    content: MediaText
     meta_description: str = ""
     is_published: bool = True
     show_in_navigation: bool = True
     navigation_order: int = 0
     page_type: str = "page"
-    featured_image: str = ""
-    images: List[str] = Field(default_factory=list)
-    videos: List[str] = Field(default_factory=list)
+    featured_image: MediaKey = ""
+    images: List[MediaKey] = Field(default_factory=list)
+    videos: List[MediaKey] = Field(default_factory=list)
     categories: List[str] = Field(default_factory=list)
     tags: List[str] = Field(default_factory=list)
     excerpt: str = ""
@@ -521,15 +641,15 @@ class PageCreate(BaseModel):
 class PageUpdate(BaseModel):
     title: Optional[str] = None
     slug: Optional[str] = None
-    content: Optional[str] = None
+    content: Optional[MediaText] = None
     meta_description: Optional[str] = None
     is_published: Optional[bool] = None
     show_in_navigation: Optional[bool] = None
     navigation_order: Optional[int] = None
     page_type: Optional[str] = None
-    featured_image: Optional[str] = None
-    images: Optional[List[str]] = None
-    videos: Optional[List[str]] = None
+    featured_image: Optional[MediaKey] = None
+    images: Optional[List[MediaKey]] = None
+    videos: Optional[List[MediaKey]] = None
     categories: Optional[List[str]] = None
     tags: Optional[List[str]] = None
     excerpt: Optional[str] = None
@@ -708,7 +828,7 @@ async def register_user(user: UserCreate):
     admin_emails = ["admin@frisorlafata.dk", "admin2@frisorlafata.dk", "admin3@frisorlafata.dk", "admin4@frisorlafata.dk", "admin6@frisorlafata.dk"]
     
     # Create user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await get_password_hash(user.password)
     user_dict = user.dict()
     user_dict.pop('password')
     
@@ -729,15 +849,34 @@ async def register_user(user: UserCreate):
     
     return {"access_token": access_token, "token_type": "bearer", "user": user_obj}
 
+async def find_user_credentials(email: str):
+    """Fetch a user together with their password hash in one indexed query"""
+    users = await db.users.aggregate([
+        {"$match": {"email": email}},
+        {"$limit": 1},
+        {"$lookup": {
+            "from": "user_passwords",
+            "localField": "id",
+            "foreignField": "user_id",
+            "as": "credentials"
+        }},
+        {"$addFields": {"password": {"$arrayElemAt": ["$credentials.password", 0]}}},
+        {"$project": {"credentials": 0}}
+    ]).to_list(length=1)
+    return users[0] if users else None
+
 @api_router.post("/auth/login", response_model=dict)
 async def login_user(credentials: UserLogin):
-    user = await db.users.find_one({"email": credentials.email})
-    if not user:
+    user = await find_user_credentials(credentials.email)
+    hashed_password = user.pop("password", None) if user else None
+    if not hashed_password:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
-    password_doc = await db.user_passwords.find_one({"user_id": user["id"]})
-    if not password_doc or not verify_password(credentials.password, password_doc["password"]):
+    is_valid, new_hash = await verify_and_update_password(credentials.password, hashed_password)
+    if not is_valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
+    if new_hash:
+        await db.user_passwords.update_one({"user_id": user["id"]}, {"$set": {"password": new_hash}})
     
     access_token = create_access_token(data={"sub": user["id"]})
     return {"access_token": access_token, "token_type": "bearer", "user": User(**user)}
@@ -758,7 +897,7 @@ async def create_user(user_create: UserCreate, current_user: User = Depends(get_
         raise HTTPException(status_code=400, detail="User with this email already exists")
     
     # Hash password
-    hashed_password = get_password_hash(user_create.password)
+    hashed_password = await get_password_hash(user_create.password)
     
     user_dict = user_create.dict()
     user_dict.pop('password')
@@ -791,7 +930,7 @@ async def update_user(user_id: str, user_update: UserUpdate, current_user: User
         if value is not None:
             if field == "password":
                 # Hash new password
-                value = get_password_hash(value)
+                value = await get_password_hash(value)
                 # Update password in separate collection
                 await db.user_passwords.update_one(
                     {"user_id": user_id}, 
@@ -803,6 +942,7 @@ async def update_user(user_id: str, user_update: UserUpdate, current_user: User
     
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+    invalidate_cached_user(user_id=user_id)
     
     updated_user_data = await db.users.find_one({"id": user_id})
     return User(**parse_from_mongo(updated_user_data))
@@ -819,6 +959,7 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_use
     result = await db.users.delete_one({"id": user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    invalidate_cached_user(user_id=user_id)
     
     # Also delete password record
     await db.user_passwords.delete_one({"user_id": user_id})
@@ -831,7 +972,7 @@ async def create_staff(staff: StaffCreate, current_user: User = Depends(get_curr
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    staff_obj = Staff(**staff.dict())
+    staff_obj = Staff(**await attach_variants(db, "staff", staff.dict()))
     await db.staff.insert_one(prepare_for_mongo(staff_obj.dict()))
     return staff_obj
 
@@ -866,10 +1007,13 @@ async def update_staff(staff_id: str, staff_update: StaffUpdate, current_user: U
     update_data = {k: v for k, v in staff_update.dict().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No fields to update")
+    update_data = await attach_variants(db, "staff", update_data)
     
     result = await db.staff.update_one({"id": staff_id}, {"$set": update_data})
     if result.modified_count == 0:
         raise HTTPException(status_code=404, detail="Staff member not found")
+    if "available_hours" in update_data:
+        await invalidate_utilization(db, staff_id)
     
     updated_staff = await db.staff.find_one({"id": staff_id})
     return Staff(**parse_from_mongo(updated_staff))
@@ -1239,42 +1383,32 @@ async def create_booking(booking: BookingCreate):
     
     total_duration = sum(service["duration_minutes"] for service in services)
     total_price = sum(service["price"] for service in services)
+    line_items = snapshot_line_items(booking.services, services)
     
     # Enhanced conflict checking - prevent double booking
-    booking_start_time = datetime.combine(booking.booking_date, booking.booking_time)
-    booking_end_time = booking_start_time + timedelta(minutes=total_duration)
-    
-    # Find overlapping bookings for the same staff
-    existing_bookings = await db.bookings.find({
-        "staff_id": booking.staff_id,
-        "booking_date": booking.booking_date.isoformat(),
-        "status": {"$in": ["pending", "confirmed"]}  # Only check active bookings
-    }).to_list(length=None)
-    
-    for existing in existing_bookings:
-        existing_start = datetime.combine(
-            booking.booking_date, 
-            datetime.strptime(existing["booking_time"], '%H:%M:%S').time()
+    start_at, end_at = booking_window(booking.booking_date, booking.booking_time, total_duration)
+    existing = await find_overlapping_booking(booking.staff_id, start_at, end_at)
+    if existing:
+        raise HTTPException(
+            status_code=400, 
+            detail=f"Time slot conflicts with existing booking at {existing['booking_time']}"
         )
-        existing_end = existing_start + timedelta(minutes=existing["total_duration"])
-        
-        # Check for overlap
-        if (booking_start_time < existing_end and booking_end_time > existing_start):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Time slot conflicts with existing booking at {existing['booking_time']}"
-            )
     
     booking_dict = booking.dict()
     booking_dict.update({
         "total_duration": total_duration,
         "total_price": total_price,
+        "line_items": line_items,
         "status": "pending",  # New bookings start as pending
         "updated_at": datetime.now(timezone.utc)
     })
     
     booking_obj = Booking(**booking_dict)
-    await db.bookings.insert_one(prepare_for_mongo(booking_obj.dict()))
+    booking_doc = prepare_for_mongo(booking_obj.dict())
+    booking_doc.update({"start_at": start_at, "end_at": end_at})
+    await db.bookings.insert_one(booking_doc)
+    await on_booking_changed(db, None, booking_doc)
+    await invalidate_utilization(db, booking_doc["staff_id"])
     
     # Send initial booking email (pending confirmation)
     await send_booking_email(booking_obj, "created")
@@ -1325,31 +1459,17 @@ async def update_booking(booking_id: str, booking_update: BookingUpdate, current
         else:
             new_time = new_time_str
             
-        # Enhanced conflict checking for rescheduling
-        booking_start_time = datetime.combine(new_date, new_time)
-        booking_end_time = booking_start_time + timedelta(minutes=existing_booking["total_duration"])
-        
-        # Find overlapping bookings (excluding current booking)
-        existing_bookings = await db.bookings.find({
-            "staff_id": existing_booking["staff_id"],
-            "booking_date": new_date.isoformat(),
-            "status": {"$in": ["pending", "confirmed"]},
-            "id": {"$ne": booking_id}  # Exclude current booking
-        }).to_list(length=None)
-        
-        for existing in existing_bookings:
-            existing_start = datetime.combine(
-                new_date, 
-                datetime.strptime(existing["booking_time"], '%H:%M:%S').time()
+        # Enhanced conflict checking for rescheduling (excluding current booking)
+        start_at, end_at = booking_window(new_date, new_time, existing_booking["total_duration"])
+        existing = await find_overlapping_booking(
+            update_data.get("staff_id", existing_booking["staff_id"]), start_at, end_at, exclude_id=booking_id
+        )
+        if existing:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Time slot conflicts with existing booking at {existing['booking_time']}"
             )
-            existing_end = existing_start + timedelta(minutes=existing["total_duration"])
-            
-            # Check for overlap
-            if (booking_start_time < existing_end and booking_end_time > existing_start):
-                raise HTTPException(
-                    status_code=400, 
-                    detail=f"Time slot conflicts with existing booking at {existing['booking_time']}"
-                )
+        update_data.update({"start_at": start_at, "end_at": end_at})
     
     update_data["updated_at"] = datetime.now(timezone.utc)
     
@@ -1357,6 +1477,8 @@ async def update_booking(booking_id: str, booking_update: BookingUpdate, current
     
     # Get updated booking
     updated_booking_data = await db.bookings.find_one({"id": booking_id})
+    await on_booking_changed(db, existing_booking, updated_booking_data)
+    await invalidate_utilization(db, existing_booking.get("staff_id"), updated_booking_data.get("staff_id"))
     updated_booking = Booking(**parse_from_mongo(updated_booking_data))
     
     # Send appropriate email notification
@@ -1384,6 +1506,7 @@ async def confirm_booking(booking_id: str, current_user: User = Depends(get_curr
     
     # Get updated booking and send confirmation email
     updated_booking_data = await db.bookings.find_one({"id": booking_id})
+    await on_booking_changed(db, existing_booking, updated_booking_data)
     updated_booking = Booking(**parse_from_mongo(updated_booking_data))
     
     await send_booking_email(updated_booking, "confirmed")
@@ -1395,9 +1518,11 @@ async def delete_booking(booking_id: str, current_user: User = Depends(get_curre
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.bookings.delete_one({"id": booking_id})
-    if result.deleted_count == 0:
+    deleted_booking = await db.bookings.find_one_and_delete({"id": booking_id})
+    if not deleted_booking:
         raise HTTPException(status_code=404, detail="Booking not found")
+    await on_booking_changed(db, deleted_booking, None)
+    await invalidate_utilization(db, deleted_booking.get("staff_id"))
     
     return {"message": "Booking deleted successfully"}
 
@@ -1422,15 +1547,7 @@ async def get_available_slots(staff_id: str, date_param: str):
     if not business_hours or not business_hours["start"]:
         return {"available_slots": []}
     
-    # Get existing bookings for this date and staff
-    existing_bookings = await db.bookings.find({
-        "staff_id": staff_id,
-        "booking_date": booking_date.isoformat(),
-        "status": {"$ne": "cancelled"}
-    }).to_list(length=None)
-    
     # Generate time slots (30-minute intervals)
-    from datetime import timedelta
     start_time = datetime.strptime(business_hours["start"], "%H:%M").time()
     end_time = datetime.strptime(business_hours["end"], "%H:%M").time()
     
@@ -1438,19 +1555,21 @@ async def get_available_slots(staff_id: str, date_param: str):
     current = datetime.combine(booking_date, start_time)
     end_datetime = datetime.combine(booking_date, end_time)
     
+    # Get existing bookings overlapping business hours for this staff
+    existing_bookings = await db.bookings.find({
+        "staff_id": staff_id,
+        "status": {"$ne": "cancelled"},
+        "start_at": {"$lt": end_datetime},
+        "end_at": {"$gt": current}
+    }, {"_id": 0, "start_at": 1, "end_at": 1}).to_list(length=None)
+    
     while current < end_datetime:
         slot_time = current.time()
-        is_available = True
         
         # Check if slot conflicts with existing bookings
-        for booking in existing_bookings:
-            booking_time = datetime.strptime(booking["booking_time"], "%H:%M:%S").time()
-            booking_end = (datetime.combine(booking_date, booking_time) + 
-                          timedelta(minutes=booking["total_duration"])).time()
-            
-            if (slot_time >= booking_time and slot_time < booking_end):
-                is_available = False
-                break
+        is_available = not any(
+            booking["start_at"] <= current < booking["end_at"] for booking in existing_bookings
+        )
         
         if is_available:
             slots.append(slot_time.strftime("%H:%M"))
@@ -1472,10 +1591,13 @@ async def create_corporate_booking(booking: CorporateBookingCreate):
         total_services_price = sum(service['price'] for service in services)
         
         # Calculate total duration (for scheduling purposes)
-        total_duration = sum(service['duration_minutes'] for service in services)
+        service_durations = {service['id']: service['duration_minutes'] for service in services}
+        total_duration = corporate_duration([e.dict() for e in booking.employees], service_durations)
         
         # Create corporate booking object
         booking_data = booking.dict()
+        for employee in booking_data["employees"]:
+            employee["line_items"] = snapshot_line_items(employee["service_ids"], services)
         booking_data.update({
             "id": str(uuid.uuid4()),
             "total_employees": len(booking.employees),
@@ -1493,6 +1615,9 @@ async def create_corporate_booking(booking: CorporateBookingCreate):
             booking_dict['booking_date'] = booking_dict['booking_date'].isoformat()
         if isinstance(booking_dict.get('booking_time'), time):
             booking_dict['booking_time'] = booking_dict['booking_time'].strftime('%H:%M:%S')
+        booking_dict['start_at'], booking_dict['end_at'] = booking_window(
+            booking.booking_date, booking.booking_time, total_duration
+        )
         
         # Insert into database
         await db.corporate_bookings.insert_one(booking_dict)
@@ -1558,6 +1683,25 @@ async def update_corporate_booking(
     update_data = {k: v for k, v in booking_update.dict().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc)
     
+    # Move the native start_at/end_at window along with the date/time
+    if 'booking_date' in update_data or 'booking_time' in update_data:
+        existing_booking = await db.corporate_bookings.find_one({"id": booking_id})
+        if not existing_booking:
+            raise HTTPException(status_code=404, detail="Corporate booking not found")
+        if existing_booking.get('start_at') and existing_booking.get('end_at'):
+            duration = (existing_booking['end_at'] - existing_booking['start_at']).total_seconds() // 60
+        else:
+            services = await db.services.find({}, {"_id": 0, "id": 1, "duration_minutes": 1}).to_list(length=None)
+            duration = corporate_duration(
+                existing_booking.get('employees', []),
+                {s['id']: s.get('duration_minutes', 0) for s in services}
+            )
+        update_data['start_at'], update_data['end_at'] = booking_window(
+            update_data.get('booking_date', existing_booking['booking_date']),
+            update_data.get('booking_time', existing_booking['booking_time']),
+            duration
+        )
+    
     # Convert date/time objects to strings for MongoDB
     if 'booking_date' in update_data and isinstance(update_data['booking_date'], date):
         update_data['booking_date'] = update_data['booking_date'].isoformat()
@@ -1671,23 +1815,14 @@ async def upload_avatar(avatar: UploadFile = File(...), current_user: User = Dep
     if not avatar.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/avatars")
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    # Stream to disk under the content hash; identical files share one copy
+    key, size, sha256, _ = await save_upload(avatar, "avatars", "jpg")
     
-    # Generate unique filename
-    file_extension = avatar.filename.split('.')[-1] if '.' in avatar.filename else 'jpg'
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = upload_dir / filename
+    # Resized and WebP/AVIF copies
+    variants = await process_upload(db, key, avatar.content_type, size, sha256)
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await avatar.read()
-        buffer.write(content)
-    
-    # Return full URL for the image
-    avatar_url = f"{BACKEND_URL}/api/uploads/avatars/{filename}"
-    return {"avatar_url": avatar_url}
+    # Records store the key; the URL is for previewing right away
+    return {"avatar_url": media_url(key), "key": key, "variants": variants}
 
 @api_router.post("/upload/video")
 async def upload_video(video: UploadFile = File(...), current_user: User = Depends(get_current_user)):
@@ -1699,23 +1834,13 @@ async def upload_video(video: UploadFile = File(...), current_user: User = Depen
     if video.content_type not in allowed_video_types:
         raise HTTPException(status_code=400, detail="File must be a supported video format (mp4, webm, ogg, avi, mov)")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/videos")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = video.filename.split('.')[-1] if '.' in video.filename else 'mp4'
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = upload_dir / filename
+    # Stream to disk under the content hash; identical files share one copy
+    key, size, sha256, _ = await save_upload(video, "videos", "mp4")
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await video.read()
-        buffer.write(content)
+    await process_upload(db, key, video.content_type, size, sha256)
     
-    # Return full URL for the video
-    video_url = f"{BACKEND_URL}/api/uploads/videos/{filename}"
-    return {"video_url": video_url}
+    # Records store the key; the URL is for previewing right away
+    return {"video_url": media_url(key), "key": key}
 
 @api_router.post("/upload/image")
 async def upload_image(image: UploadFile = File(...), current_user: User = Depends(get_current_user)):
@@ -1726,62 +1851,23 @@ async def upload_image(image: UploadFile = File(...), current_user: User = Depen
     if not image.content_type.startswith('image/'):
         raise HTTPException(status_code=400, detail="File must be an image")
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads/images")
-    upload_dir.mkdir(parents=True, exist_ok=True)
-    
-    # Generate unique filename
-    file_extension = image.filename.split('.')[-1] if '.' in image.filename else 'jpg'
-    filename = f"{uuid.uuid4()}.{file_extension}"
-    file_path = upload_dir / filename
+    # Stream to disk under the content hash; identical files share one copy
+    key, size, sha256, _ = await save_upload(image, "images", "jpg")
     
-    # Save file
-    with open(file_path, "wb") as buffer:
-        content = await image.read()
-        buffer.write(content)
+    # Resized and WebP/AVIF copies
+    variants = await process_upload(db, key, image.content_type, size, sha256)
     
-    # Return full URL for the image
-    image_url = f"{BACKEND_URL}/api/uploads/images/{filename}"
-    return {"image_url": image_url}
+    # Records store the key; the URL is for previewing right away
+    return {"image_url": media_url(key), "key": key, "variants": variants}
 
-@api_router.get("/uploads/{file_type}/{filename}")
-async def serve_uploaded_file(file_type: str, filename: str):
-    """Serve uploaded files with correct content-type headers"""
+@api_router.get("/uploads/{file_type}/{file_path:path}")
+async def serve_uploaded_file(file_type: str, file_path: str, request: Request):
+    """Serve uploaded files (flat or sharded paths) with validators, conditional GETs and byte ranges"""
     allowed_types = ["avatars", "images", "videos"]
     if file_type not in allowed_types:
         raise HTTPException(status_code=404, detail="File type not found")
     
-    file_path = f"uploads/{file_type}/{filename}"
-    
-    if not os.path.exists(file_path):
-        raise HTTPException(status_code=404, detail="File not found")
-    
-    # Determine the correct MIME type
-    content_type, _ = mimetypes.guess_type(file_path)
-    if content_type is None:
-        # Default content types based on file extension
-        if filename.lower().endswith('.jpg') or filename.lower().endswith('.jpeg'):
-            content_type = "image/jpeg"
-        elif filename.lower().endswith('.png'):
-            content_type = "image/png"
-        elif filename.lower().endswith('.gif'):
-            content_type = "image/gif"
-        elif filename.lower().endswith('.webp'):
-            content_type = "image/webp"
-        elif filename.lower().endswith('.mp4'):
-            content_type = "video/mp4"
-        elif filename.lower().endswith('.webm'):
-            content_type = "video/webm"
-        elif filename.lower().endswith('.ogg'):
-            content_type = "video/ogg"
-        else:
-            content_type = "application/octet-stream"
-    
-    return FileResponse(
-        file_path, 
-        media_type=content_type,
-        headers={"Cache-Control": "public, max-age=3600"}
-    )
+    return await upload_response(db, request, file_type, file_path)
 
 # Page routes
 @api_router.post("/pages", response_model=Page)
@@ -1866,7 +1952,7 @@ async def get_settings(current_user: User = Depends(get_current_user)):
     # Remove MongoDB _id and type fields
     settings.pop("_id", None)
     settings.pop("type", None)
-    return settings
+    return map_fields(settings, SETTINGS_MEDIA_FIELDS, media_url)
 
 @api_router.put("/settings")
 async def update_settings(settings: Dict[str, Any], current_user: User = Depends(get_current_user)):
@@ -1876,7 +1962,7 @@ async def update_settings(settings: Dict[str, Any], current_user: User = Depends
     settings_data = {
         "type": "site_settings",
         "updated_at": datetime.now(timezone.utc).isoformat(),
-        **settings
+        **map_fields(settings, SETTINGS_MEDIA_FIELDS, store_as_key)
     }
     
     await db.settings.update_one(
@@ -1948,7 +2034,7 @@ async def get_public_settings():
         settings.pop("email_user", None)
         settings.pop("email_password", None)
         
-        return settings
+        return map_fields(settings, SETTINGS_MEDIA_FIELDS, media_url)
         
     except Exception as e:
         print(f"Error getting public settings: {e}")
@@ -1989,6 +2075,7 @@ async def get_homepage_sections(current_user: User = Depends(get_current_user)):
         # Remove MongoDB _id field from each section
         for section in sections:
             section.pop("_id", None)
+        sections = map_text(sections, text_media_urls)
         
         # If no sections exist, create default sections
         if not sections:
@@ -2094,7 +2181,7 @@ async def get_public_homepage_sections():
         for section in sections:
             section.pop("_id", None)
             
-        return sections
+        return map_text(sections, text_media_urls)
     except Exception as e:
         print(f"Error getting public homepage sections: {e}")
         # Return default sections if database error
@@ -2135,9 +2222,10 @@ async def reorder_homepage_sections(reorder_data: HomepageSectionReorder, curren
 async def update_homepage_section(section_id: str, section_data: dict, current_user: User = Depends(get_current_user)):
     """Update a homepage section"""
     try:
+        # Upload URLs in any field (button_url, custom_css, ...) are stored without a domain
         result = await db.homepage_sections.update_one(
             {"id": section_id}, 
-            {"$set": section_data}
+            {"$set": map_text(section_data, store_text_keys)}
         )
         if result.modified_count == 0:
             raise HTTPException(status_code=404, detail="Section not found")
@@ -2237,10 +2325,12 @@ async def execute_paypal_payment(payment_id: str, payer_id: str):
             # Update booking payment status
             payment_doc = await db.payments.find_one({"paypal_payment_id": payment_id})
             if payment_doc:
-                await db.bookings.update_one(
+                previous_booking = await db.bookings.find_one_and_update(
                     {"id": payment_doc["booking_id"]},
                     {"$set": {"payment_status": "paid"}}
                 )
+                if previous_booking:
+                    await on_booking_changed(db, previous_booking, {**previous_booking, "payment_status": "paid"})
             
             return {"status": "success", "payment_id": payment_id}
         else:
@@ -2274,7 +2364,7 @@ async def create_gallery_item(gallery_item: GalleryItemCreate, current_user: Use
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    new_gallery_item = GalleryItem(**gallery_item.dict())
+    new_gallery_item = GalleryItem(**await attach_variants(db, "gallery", gallery_item.dict()))
     await db.gallery.insert_one(prepare_for_mongo(new_gallery_item.dict()))
     
     return new_gallery_item
@@ -2310,6 +2400,7 @@ async def update_gallery_item(item_id: str, gallery_update: GalleryItemUpdate, c
             update_data[field] = value
     
     if update_data:
+        update_data = await attach_variants(db, "gallery", update_data)
         await db.gallery.update_one({"id": item_id}, {"$set": update_data})
     
     updated_item_data = await db.gallery.find_one({"id": item_id})
@@ -2338,7 +2429,12 @@ async def create_staff_break(break_data: StaffBreakCreate, current_user: User =
         raise HTTPException(status_code=404, detail="Staff member not found")
     
     new_break = StaffBreak(**break_data.dict(), created_by=current_user.id)
-    await db.staff_breaks.insert_one(prepare_for_mongo(new_break.dict()))
+    break_doc = prepare_for_mongo(new_break.dict())
+    break_doc["start_at"], break_doc["end_at"] = break_window(
+        new_break.start_date, new_break.start_time, new_break.end_date, new_break.end_time
+    )
+    await db.staff_breaks.insert_one(break_doc)
+    await invalidate_utilization(db, new_break.staff_id)
     
     return new_break
 
@@ -2358,12 +2454,9 @@ async def get_staff_breaks(
         query["staff_id"] = staff_id
     
     if start_date and end_date:
-        query["$or"] = [
-            {
-                "start_date": {"$lte": end_date},
-                "end_date": {"$gte": start_date}
-            }
-        ]
+        # Breaks whose start_at/end_at envelope overlaps the requested days
+        query["start_at"] = {"$lt": datetime.fromisoformat(end_date) + timedelta(days=1)}
+        query["end_at"] = {"$gte": datetime.fromisoformat(start_date)}
     
     breaks = await db.staff_breaks.find(query).sort("start_date", 1).to_list(length=None)
     return [StaffBreak(**parse_from_mongo(break_item)) for break_item in breaks]
@@ -2381,11 +2474,11 @@ async def check_staff_availability(
         start_time_obj = datetime.strptime(start_time, '%H:%M:%S').time()
         end_time_obj = datetime.strptime(end_time, '%H:%M:%S').time()
         
-        # Find overlapping breaks
+        # Find breaks whose envelope overlaps the checked time on that day
         breaks = await db.staff_breaks.find({
             "staff_id": staff_id,
-            "start_date": {"$lte": check_date_obj.isoformat()},
-            "end_date": {"$gte": check_date_obj.isoformat()}
+            "start_at": {"$lt": datetime.combine(check_date_obj, end_time_obj)},
+            "end_at": {"$gt": datetime.combine(check_date_obj, start_time_obj)}
         }).to_list(length=None)
         
         conflicts = []
@@ -2426,10 +2519,17 @@ async def update_staff_break(break_id: str, break_update: StaffBreakUpdate, curr
         if value is not None:
             update_data[field] = prepare_for_mongo({field: value})[field]
     
+    if update_data.keys() & {"start_date", "start_time", "end_date", "end_time"}:
+        window = {**existing_break, **update_data}
+        update_data["start_at"], update_data["end_at"] = break_window(
+            window["start_date"], window["start_time"], window["end_date"], window["end_time"]
+        )
+    
     if update_data:
         await db.staff_breaks.update_one({"id": break_id}, {"$set": update_data})
     
     updated_break_data = await db.staff_breaks.find_one({"id": break_id})
+    await invalidate_utilization(db, existing_break.get("staff_id"), updated_break_data.get("staff_id"))
     return StaffBreak(**parse_from_mongo(updated_break_data))
 
 @api_router.delete("/staff-breaks/{break_id}")
@@ -2437,9 +2537,10 @@ async def delete_staff_break(break_id: str, current_user: User = Depends(get_cur
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.staff_breaks.delete_one({"id": break_id})
-    if result.deleted_count == 0:
+    deleted_break = await db.staff_breaks.find_one_and_delete({"id": break_id})
+    if not deleted_break:
         raise HTTPException(status_code=404, detail="Staff break not found")
+    await invalidate_utilization(db, deleted_break.get("staff_id"))
     
     return {"message": "Staff break deleted successfully"}
 
@@ -2457,134 +2558,86 @@ async def get_revenue_analytics(
         raise HTTPException(status_code=403, detail="Admin access required")
     
     try:
-        # Set default date range if not provided
-        if not start_date:
-            if period == "daily":
-                start_date = (datetime.now(timezone.utc) - timedelta(days=30)).date()
-            elif period == "weekly":
-                start_date = (datetime.now(timezone.utc) - timedelta(weeks=12)).date()
-            elif period == "monthly":
-                start_date = (datetime.now(timezone.utc) - timedelta(days=365)).date()
-            else:  # yearly
-                start_date = (datetime.now(timezone.utc) - timedelta(days=1095)).date()  # 3 years
-        else:
-            start_date = datetime.fromisoformat(start_date).date()
-            
-        if not end_date:
-            end_date = datetime.now(timezone.utc).date()
-        else:
-            end_date = datetime.fromisoformat(end_date).date()
-        
-        # Build query
-        query = {
-            "booking_date": {
-                "$gte": start_date.isoformat(),
-                "$lte": end_date.isoformat()
-            },
-            "status": {"$in": ["confirmed", "completed"]},
-            "payment_status": "paid"
-        }
-        
-        if staff_id:
-            query["staff_id"] = staff_id
-        
-        # Get bookings
-        bookings = await db.bookings.find(query).to_list(length=None)
-        
-        # Calculate metrics
-        total_revenue = sum(booking["total_price"] for booking in bookings)
-        total_bookings = len(bookings)
-        average_booking_value = total_revenue / total_bookings if total_bookings > 0 else 0
-        
-        # Group by period
-        revenue_by_period = {}
-        for booking in bookings:
-            booking_date = datetime.fromisoformat(booking["booking_date"]).date()
-            
-            if period == "daily":
-                key = booking_date.isoformat()
-            elif period == "weekly":
-                # Get Monday of the week
-                week_start = booking_date - timedelta(days=booking_date.weekday())
-                key = week_start.isoformat()
-            elif period == "monthly":
-                key = f"{booking_date.year}-{booking_date.month:02d}"
-            else:  # yearly
-                key = str(booking_date.year)
-            
-            if key not in revenue_by_period:
-                revenue_by_period[key] = {"revenue": 0, "bookings": 0}
-            
-            revenue_by_period[key]["revenue"] += booking["total_price"]
-            revenue_by_period[key]["bookings"] += 1
-        
-        # Get top services
-        service_revenue = {}
-        for booking in bookings:
-            for service_id in booking["services"]:
-                if service_id not in service_revenue:
-                    service_revenue[service_id] = {"revenue": 0, "bookings": 0}
-                service_revenue[service_id]["revenue"] += booking["total_price"] / len(booking["services"])
-                service_revenue[service_id]["bookings"] += 1
-        
-        # Get service names
-        services = await db.services.find().to_list(length=None)
-        service_map = {s["id"]: s["name"] for s in services}
-        
-        top_services = [
-            {
-                "service_name": service_map.get(service_id, "Unknown"),
-                "revenue": data["revenue"],
-                "bookings": data["bookings"]
-            }
-            for service_id, data in sorted(service_revenue.items(), key=lambda x: x[1]["revenue"], reverse=True)[:5]
-        ]
-        
-        # Get staff performance
-        staff_revenue = {}
-        for booking in bookings:
-            staff_id = booking["staff_id"]
-            if staff_id not in staff_revenue:
-                staff_revenue[staff_id] = {"revenue": 0, "bookings": 0}
-            staff_revenue[staff_id]["revenue"] += booking["total_price"]
-            staff_revenue[staff_id]["bookings"] += 1
-        
-        # Get staff names
-        staff_list = await db.staff.find().to_list(length=None)
-        staff_map = {s["id"]: s["name"] for s in staff_list}
-        
-        staff_performance = [
-            {
-                "staff_name": staff_map.get(staff_id, "Unknown"),
-                "staff_id": staff_id,
-                "revenue": data["revenue"],
-                "bookings": data["bookings"],
-                "average_per_booking": data["revenue"] / data["bookings"] if data["bookings"] > 0 else 0
-            }
-            for staff_id, data in sorted(staff_revenue.items(), key=lambda x: x[1]["revenue"], reverse=True)
-        ]
-        
-        return {
-            "summary": {
-                "total_revenue": total_revenue,
-                "total_bookings": total_bookings,
-                "average_booking_value": round(average_booking_value, 2),
-                "period": period,
-                "start_date": start_date.isoformat(),
-                "end_date": end_date.isoformat()
-            },
-            "revenue_by_period": [
-                {"period": period, "revenue": data["revenue"], "bookings": data["bookings"]}
-                for period, data in sorted(revenue_by_period.items())
-            ],
-            "top_services": top_services,
-            "staff_performance": staff_performance
-        }
+        start, end = resolve_window(period, start_date, end_date)
+        return await cached_analytics(
+            db, ("revenue", period, start, end, staff_id), end,
+            lambda: rollup_revenue_analytics(db, period, start, end, staff_id)
+        )
         
     except Exception as e:
         print(f"Error in revenue analytics: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate revenue analytics")
 
+@api_router.get("/analytics/revenue/history")
+async def get_revenue_history(
+    period: str = "monthly",  # daily, weekly, monthly, yearly
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Multi-year revenue analytics computed from the columnar booking snapshot"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        start = datetime.fromisoformat(start_date).date() if start_date else None
+        end = datetime.fromisoformat(end_date).date() if end_date else None
+        return await cached_analytics(
+            db, ("revenue_history", period, start, end, staff_id), end,
+            lambda: revenue_history(db, period, start, end, staff_id), versioned=True
+        )
+        
+    except Exception as e:
+        print(f"Error in revenue history: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate revenue history")
+
+@api_router.get("/analytics/utilization")
+async def get_staff_utilization(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Booked vs available minutes per staff member and a weekday x hour occupancy heatmap"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    try:
+        end = datetime.fromisoformat(end_date).date() if end_date else datetime.now(timezone.utc).date()
+        start = datetime.fromisoformat(start_date).date() if start_date else end - timedelta(weeks=4)
+        if start > end:
+            raise HTTPException(status_code=400, detail="start_date must be before end_date")
+        return await staff_utilization(db, start, end, BUSINESS_HOURS, staff_id)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error in utilization analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate utilization analytics")
+
+@api_router.get("/analytics/staffing-recommendations")
+async def get_staffing_recommendations(
+    week_start_date: Optional[str] = None,
+    current_user: User = Depends(get_current_user)
+):
+    """Forecast demand vs configured staff capacity per weekday and hour (defaults to next week)"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if week_start_date:
+        try:
+            target_week = week_start(datetime.fromisoformat(week_start_date).date())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid week_start_date, expected YYYY-MM-DD")
+    else:
+        target_week = week_start(datetime.now(timezone.utc).date()) + timedelta(weeks=1)
+    
+    recommendations = await staffing_recommendations(db, target_week, BUSINESS_HOURS)
+    if recommendations is None:
+        raise HTTPException(status_code=404, detail="No demand forecast yet, run forecasting.py first")
+    return recommendations
+
 # Admin management route
 @api_router.post("/admin/create-admin")
 async def create_admin_user():
@@ -2601,10 +2654,11 @@ async def create_admin_user():
             {"email": admin_email},
             {"$set": {"is_admin": True}}
         )
+        invalidate_cached_user(email=admin_email)
         return {"message": f"Updated {admin_email} to admin status"}
     else:
         # Create new admin user
-        hashed_password = get_password_hash(admin_password)
+        hashed_password = await get_password_hash(admin_password)
         admin_user = {
             "id": str(uuid.uuid4()),
             "name": "Admin LaFata",
@@ -2629,12 +2683,24 @@ async def make_user_admin(user_email: str):
         {"email": user_email},
         {"$set": {"is_admin": True}}
     )
+    invalidate_cached_user(email=user_email)
     
     if result.modified_count > 0:
         return {"message": f"Successfully made {user_email} an admin"}
     else:
         raise HTTPException(status_code=404, detail="User not found")
 
+@api_router.get("/admin/metrics/auth")
+async def get_auth_metrics(current_user: User = Depends(get_current_user)):
+    """Password hashing queue depth and user cache statistics"""
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "password_hashing": password_hasher.stats(),
+        "user_cache": user_cache.stats()
+    }
+
 # Initialize default data
 @api_router.post("/admin/init-data")
 async def initialize_default_data():
@@ -2761,6 +2827,13 @@ async def send_booking_confirmation(booking: Booking):
 # Include the router in the main app
 app.include_router(api_router)
 
+# Rejects oversized uploads before the multipart body is spooled; added first so CORS wraps its 413s
+app.add_middleware(UploadLimitMiddleware, limits={
+    "/api/upload/avatar": MAX_UPLOAD_BYTES["avatars"],
+    "/api/upload/image": MAX_UPLOAD_BYTES["images"],
+    "/api/upload/video": MAX_UPLOAD_BYTES["videos"],
+})
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -2775,7 +2848,3 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
-
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
@@ -25,6 +25,7 @@ from database import (
     insert_record, update_record, delete_record,
     prepare_record_for_response, prepare_data_for_insert
 )
+from analytics import resolve_window, mysql_revenue_analytics
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -526,6 +527,27 @@ async def upload_image(file: UploadFile = File(...), admin_user: User = Depends(
     
     return {"url": f"{BACKEND_URL}/uploads/images/{filename}"}
 
+# Analytics endpoints
+@api_router.get("/analytics/revenue")
+async def get_revenue_analytics(
+    period: str = "monthly",  # daily, weekly, monthly, yearly
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    staff_id: Optional[str] = None,
+    admin_user: User = Depends(get_admin_user)
+):
+    """Revenue analytics aggregated by MySQL, same response as the MongoDB server"""
+    try:
+        start, end = resolve_window(period, start_date, end_date)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format")
+    
+    try:
+        return await mysql_revenue_analytics(period, start, end, staff_id)
+    except Exception as e:
+        print(f"Error in revenue analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to generate revenue analytics")
+
 # Root endpoint
 @app.get("/")
 async def root():
@@ -533,7 +555,7 @@ async def root():
 
 @app.get("/api")
 async def api_root():
-    return {"message": "Frisor LaFata API v1.0", "endpoints": ["auth", "users", "staff", "services", "bookings", "settings"]}
+    return {"message": "Frisor LaFata API v1.0", "endpoints": ["auth", "users", "staff", "services", "bookings", "settings", "analytics"]}
 
 # Include API router
 app.include_router(api_router)
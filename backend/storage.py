@@ -0,0 +1,251 @@
+"""
+Storage backends for uploaded files
+
+Files are addressed by key. New uploads use a sharded layout,
+"<file_type>/<ab>/<cd>/<filename>" where ab and cd are the first characters of
+the (hash or uuid) file name, so no directory grows past a few hundred
+entries. Files uploaded earlier may still sit at "<file_type>/<filename>"
+until migrate_upload_layout.py has moved them.
+
+`LocalStorage` keeps files under backend/uploads. `S3Storage` keeps them in an S3-compatible
+bucket, so several API servers can share uploads. Large files go up as
+multipart uploads, and reads stream byte ranges straight from the bucket.
+
+Selected with STORAGE_BACKEND=local|s3. The S3 backend reads S3_BUCKET,
+S3_PREFIX and S3_ENDPOINT_URL (set the endpoint for MinIO or another local
+stand-in), plus the usual AWS_* credentials.
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, NamedTuple, Optional
+
+MB = 1024 * 1024
+
+def shard_key(file_type: str, filename: str) -> str:
+    return f"{file_type}/{filename[:2]}/{filename[2:4]}/{filename}"
+
+def with_file_type(key: str, file_type: str) -> str:
+    """The same file name and shard under another upload type"""
+    return f"{file_type}/{key.split('/', 1)[1]}"
+
+class StoredObject(NamedTuple):
+    size: int
+    mtime: float
+
+class LocalStorage:
+    """Files on the local disk under root"""
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+
+    def path(self, key: str) -> Path:
+        return self.root / key
+
+    def local_path(self, key: str) -> Optional[Path]:
+        """Path that can be served directly, or None for remote backends"""
+        return self.path(key)
+
+    def staging_dir(self) -> Path:
+        """
+        Where uploads are spooled before put(): beside root rather than inside it,
+        so partial files are never served, and on the same filesystem, so put()
+        is a rename
+        """
+        directory = self.root.parent / f".{self.root.name}-staging"
+        directory.mkdir(parents=True, exist_ok=True)
+        return directory
+
+    async def exists(self, key: str) -> bool:
+        return await asyncio.to_thread(self.path(key).is_file)
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        path = self.path(key)
+        try:
+            stat_result = await asyncio.to_thread(os.stat, path)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        if not path.is_file():
+            return None
+        return StoredObject(stat_result.st_size, stat_result.st_mtime)
+
+    async def put(self, local_file: Path, key: str, content_type: Optional[str] = None):
+        """Move a finished local file into storage"""
+        destination = self.path(key)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(os.replace, local_file, destination)
+
+    async def copy(self, source_key: str, key: str):
+        """Hard link where possible, so the copy costs no extra disk"""
+        def link():
+            destination = self.path(key)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(self.path(source_key), destination)
+            except FileExistsError:
+                pass
+            except OSError:
+                shutil.copyfile(self.path(source_key), destination)
+        await asyncio.to_thread(link)
+
+    async def move(self, source_key: str, key: str):
+        def rename():
+            destination = self.path(key)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(self.path(source_key), destination)
+        await asyncio.to_thread(rename)
+
+    async def delete(self, key: str):
+        try:
+            await asyncio.to_thread(os.unlink, self.path(key))
+        except FileNotFoundError:
+            pass
+
+    @asynccontextmanager
+    async def local_file(self, key: str):
+        """A local path holding the object's content for the duration of the block"""
+        yield self.path(key)
+
+    async def iter_range(self, key: str, start: int, length: int, chunk_size: int = MB) -> AsyncIterator[bytes]:
+        import anyio
+        async with await anyio.open_file(self.path(key), "rb") as f:
+            await f.seek(start)
+            remaining = length
+            while remaining > 0:
+                chunk = await f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
+
+    async def iter_objects(self, prefix: str = "") -> AsyncIterator[tuple]:
+        """(key, StoredObject) for every stored file whose key starts with prefix"""
+        def scan():
+            found = []
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    path = Path(directory) / filename
+                    key = path.relative_to(self.root).as_posix()
+                    if key.startswith(prefix):
+                        stat_result = path.stat()
+                        found.append((key, StoredObject(stat_result.st_size, stat_result.st_mtime)))
+            return found
+        for item in await asyncio.to_thread(scan):
+            yield item
+
+class S3Storage:
+    """Objects in an S3-compatible bucket"""
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: Optional[str] = None, client=None):
+        import boto3
+        from boto3.s3.transfer import TransferConfig
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.client = client or boto3.client("s3", endpoint_url=endpoint_url)
+        self.transfer_config = TransferConfig(
+            multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=4
+        )
+
+    def object_key(self, key: str) -> str:
+        return self.prefix + key
+
+    def local_path(self, key: str) -> Optional[Path]:
+        return None
+
+    def staging_dir(self) -> Path:
+        return Path(tempfile.gettempdir())
+
+    async def stat(self, key: str) -> Optional[StoredObject]:
+        from botocore.exceptions import ClientError
+        try:
+            head = await asyncio.to_thread(self.client.head_object, Bucket=self.bucket, Key=self.object_key(key))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return StoredObject(head["ContentLength"], head["LastModified"].timestamp())
+
+    async def exists(self, key: str) -> bool:
+        return await self.stat(key) is not None
+
+    async def put(self, local_file: Path, key: str, content_type: Optional[str] = None):
+        """Upload a finished local file (multipart above 8 MB), then remove the local copy"""
+        extra_args = {"ContentType": content_type} if content_type else None
+        await asyncio.to_thread(
+            self.client.upload_file, str(local_file), self.bucket, self.object_key(key),
+            ExtraArgs=extra_args, Config=self.transfer_config
+        )
+        await asyncio.to_thread(os.unlink, local_file)
+
+    async def copy(self, source_key: str, key: str):
+        """Server-side copy, nothing goes through this process"""
+        await asyncio.to_thread(
+            self.client.copy, {"Bucket": self.bucket, "Key": self.object_key(source_key)},
+            self.bucket, self.object_key(key), Config=self.transfer_config
+        )
+
+    async def move(self, source_key: str, key: str):
+        await self.copy(source_key, key)
+        await self.delete(source_key)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete_object, Bucket=self.bucket, Key=self.object_key(key))
+
+    @asynccontextmanager
+    async def local_file(self, key: str):
+        fd, tmp_path = tempfile.mkstemp(suffix=Path(key).suffix)
+        os.close(fd)
+        try:
+            await asyncio.to_thread(
+                self.client.download_file, self.bucket, self.object_key(key), tmp_path,
+                Config=self.transfer_config
+            )
+            yield Path(tmp_path)
+        finally:
+            os.unlink(tmp_path)
+
+    async def iter_range(self, key: str, start: int, length: int, chunk_size: int = MB) -> AsyncIterator[bytes]:
+        if length <= 0:
+            # "bytes=N-(N-1)" is not a valid range
+            return
+        response = await asyncio.to_thread(
+            self.client.get_object, Bucket=self.bucket, Key=self.object_key(key),
+            Range=f"bytes={start}-{start + length - 1}"
+        )
+        body = response["Body"]
+        try:
+            while chunk := await asyncio.to_thread(body.read, chunk_size):
+                yield chunk
+        finally:
+            body.close()
+
+    async def iter_objects(self, prefix: str = "") -> AsyncIterator[tuple]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = iter(paginator.paginate(Bucket=self.bucket, Prefix=self.object_key(prefix)))
+        while page := await asyncio.to_thread(next, pages, None):
+            for item in page.get("Contents", []):
+                key = item["Key"][len(self.prefix):]
+                yield key, StoredObject(item["Size"], item["LastModified"].timestamp())
+
+_storage = None
+
+def get_storage():
+    """The configured backend, created on first use (after .env is loaded)"""
+    global _storage
+    if _storage is None:
+        backend = os.environ.get('STORAGE_BACKEND', 'local')
+        if backend == 's3':
+            _storage = S3Storage(
+                os.environ['S3_BUCKET'],
+                prefix=os.environ.get('S3_PREFIX', ''),
+                endpoint_url=os.environ.get('S3_ENDPOINT_URL') or None
+            )
+        elif backend == 'local':
+            _storage = LocalStorage(Path(os.environ.get('UPLOADS_DIR', Path(__file__).parent / 'uploads')))
+        else:
+            raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
+    return _storage
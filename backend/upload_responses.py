@@ -0,0 +1,180 @@
+"""
+Responses for uploaded files
+
+Every response carries an ETag and Last-Modified, and conditional requests
+are answered with 304 Not Modified. Single byte ranges are served as 206
+Partial Content, so browsers can seek and resume videos. Ranges are read
+from the storage backend (storage.py), so S3 objects are never fully buffered. Content types come
+from the media record written at upload time and are cached in memory, so
+serving a file never guesses from the file name twice.
+
+Content-hashed names (see file_uploads.py) never change content, so they
+are cached as immutable for a year. Their ETag is the hash itself.
+"""
+import mimetypes
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import Optional
+from fastapi import HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from cache import TTLCache
+from storage import StoredObject, get_storage, shard_key
+
+HASHED_NAME = re.compile(r"^([0-9a-f]{64})(_(?:thumb|medium|large))?\.\w+$")
+UPLOAD_TYPES = ("avatars", "images", "videos")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "public, max-age=3600"
+
+FALLBACK_CONTENT_TYPES = {
+    ".jpg": "image/jpeg", ".jpeg": "image/jpeg", ".png": "image/png", ".gif": "image/gif",
+    ".webp": "image/webp", ".avif": "image/avif",
+    ".mp4": "video/mp4", ".webm": "video/webm", ".ogg": "video/ogg", ".mov": "video/quicktime",
+}
+
+content_type_cache = TTLCache(maxsize=10_000, ttl=3600)
+
+async def resolve_content_type(db, key: str) -> str:
+    """Content type recorded at upload time, falling back to the file extension"""
+    content_type = content_type_cache.get(key)
+    if content_type is None:
+        media = await db.media.find_one({"key": key}, {"_id": 0, "content_type": 1})
+        content_type = (media or {}).get("content_type")
+        if not content_type:
+            content_type = (
+                mimetypes.guess_type(key)[0]
+                or FALLBACK_CONTENT_TYPES.get(Path(key).suffix.lower(), "application/octet-stream")
+            )
+        content_type_cache.set(key, content_type)
+    return content_type
+
+def file_validators(filename: str, stored: StoredObject):
+    """(etag, last_modified, immutable) for a stored file"""
+    match = HASHED_NAME.match(filename)
+    if match:
+        etag = f'"{match[1]}{match[2] or ""}"'
+    else:
+        etag = f'"{int(stored.mtime * 1_000_000):x}-{stored.size:x}"'
+    return etag, formatdate(stored.mtime, usegmt=True), bool(match)
+
+def etag_matches(header: str, etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET)"""
+    if header.strip() == "*":
+        return True
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in tags
+
+def not_modified(request: Request, etag: str, stored: StoredObject) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag_matches(if_none_match, etag)
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(stored.mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def parse_range(header: str, size: int) -> Optional[tuple]:
+    """
+    (start, end) inclusive for a single "bytes=" range.
+
+    Returns None when the header should be ignored (multiple ranges, another
+    unit or malformed bounds, per RFC 9110) and raises ValueError when the
+    range can't be satisfied, which includes any range of an empty file.
+    """
+    unit, _, ranges = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+    first, _, last = (part.strip() for part in ranges.strip().partition("-"))
+    if not (first or last) or any(bound and not bound.isdigit() for bound in (first, last)):
+        return None
+    if first and last and int(last) < int(first):
+        return None
+    if size == 0:
+        raise ValueError("Empty file")
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length <= 0:
+            raise ValueError("Empty suffix range")
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+def range_applies(request: Request, etag: str, last_modified: str) -> bool:
+    """If-Range: only honour the range when the client's copy is current"""
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+async def resolve_upload(storage, file_type: str, file_path: str):
+    """
+    (key, StoredObject) for a requested path in either layout.
+
+    Sharded paths are used as is; a bare file name is looked up flat first and
+    then in its shard, so URLs stored before the migration keep working.
+    """
+    parts = file_path.split("/")
+    if file_type not in UPLOAD_TYPES or any(part in ("", ".", "..") or part.startswith(".") for part in parts):
+        return None, None
+    candidates = [f"{file_type}/{file_path}"]
+    if len(parts) == 1:
+        candidates.append(shard_key(file_type, file_path))
+    for key in candidates:
+        stored = await storage.stat(key)
+        if stored is not None:
+            return key, stored
+    return None, None
+
+async def upload_response(db, request: Request, file_type: str, file_path: str) -> Response:
+    """Conditional, range-aware response for an uploaded file"""
+    storage = get_storage()
+    key, stored = await resolve_upload(storage, file_type, file_path)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    filename = key.rsplit("/", 1)[1]
+
+    etag, last_modified, immutable = file_validators(filename, stored)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": IMMUTABLE_CACHE_CONTROL if immutable else DEFAULT_CACHE_CONTROL,
+    }
+    if not_modified(request, etag, stored):
+        return Response(status_code=304, headers=headers)
+
+    content_type = await resolve_content_type(db, key)
+    size = stored.size
+    range_header = request.headers.get("range")
+    if range_header and range_applies(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            length = end - start + 1
+            return StreamingResponse(
+                storage.iter_range(key, start, length),
+                status_code=206,
+                media_type=content_type,
+                headers={
+                    **headers,
+                    "Content-Range": f"bytes {start}-{end}/{size}",
+                    "Content-Length": str(length),
+                }
+            )
+
+    local_path = storage.local_path(key)
+    if local_path is not None:
+        return FileResponse(local_path, media_type=content_type, headers=headers)
+    return StreamingResponse(
+        storage.iter_range(key, 0, size),
+        media_type=content_type,
+        headers={**headers, "Content-Length": str(size)}
+    )
@@ -0,0 +1,227 @@
+"""
+Staff utilization and weekday x hour occupancy
+
+Each staff member's working time is a minute mask per day built from
+`available_hours` (or the business hours), minus staff breaks. Bookings are
+clipped to that mask, so booked minutes never exceed available minutes.
+Intervals are applied with `np.add.at` on difference arrays and a cumulative
+sum, so a year of bookings is a few array operations per staff member.
+
+Results are cached per (staff, week) as 7 x 24 grids of minutes; a request
+for any window only recomputes the weeks that aren't cached yet. Cache keys
+include a per-staff version (a `counters` document) that booking, break and
+working-hours writes bump through `invalidate_utilization`, so a write shows
+up immediately, in every worker, instead of when the entry expires.
+"""
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import Optional
+import numpy as np
+from cache import TTLCache
+
+DAY_NAMES = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MINUTES_PER_DAY = 24 * 60
+
+# Past weeks rarely change; the current week is recomputed often
+PAST_WEEK_TTL = 3600
+CURRENT_WEEK_TTL = 60
+week_cache = TTLCache(maxsize=20_000, ttl=PAST_WEEK_TTL)
+
+def version_id(staff_id: str) -> str:
+    return f"utilization:{staff_id}"
+
+async def staff_versions(db, staff_ids) -> dict:
+    counters = await db.counters.find(
+        {"_id": {"$in": [version_id(staff_id) for staff_id in staff_ids]}}
+    ).to_list(length=None)
+    values = {counter["_id"]: counter["value"] for counter in counters}
+    return {staff_id: values.get(version_id(staff_id), 0) for staff_id in staff_ids}
+
+async def invalidate_utilization(db, *staff_ids):
+    """Make cached weeks of these staff members stale after their bookings, breaks or hours change"""
+    for staff_id in {staff_id for staff_id in staff_ids if staff_id}:
+        await db.counters.update_one({"_id": version_id(staff_id)}, {"$inc": {"value": 1}}, upsert=True)
+
+def to_minutes(value) -> Optional[int]:
+    """Minutes since midnight for "HH:MM" / "HH:MM:SS" strings"""
+    if not value:
+        return None
+    parts = str(value).split(":")
+    return int(parts[0]) * 60 + int(parts[1])
+
+def weekday_hours(staff, business_hours):
+    """(start, end) minutes per weekday, preferring the staff member's own enabled hours"""
+    hours = []
+    for day_name in DAY_NAMES:
+        staff_hours = (staff.get("available_hours") or {}).get(day_name)
+        if isinstance(staff_hours, dict) and staff_hours.get("enabled", False):
+            day_hours = staff_hours
+        else:
+            day_hours = business_hours.get(day_name) or {}
+        start, end = to_minutes(day_hours.get("start")), to_minutes(day_hours.get("end"))
+        hours.append((start, end) if start is not None and end is not None and end > start else None)
+    return hours
+
+def interval_mask(starts, ends, length):
+    """Boolean mask covering the union of [start, end) minute intervals"""
+    diff = np.zeros(length + 1, dtype=np.int32)
+    starts = np.clip(np.asarray(starts, dtype=np.int64), 0, length)
+    ends = np.clip(np.asarray(ends, dtype=np.int64), 0, length)
+    valid = ends > starts
+    np.add.at(diff, starts[valid], 1)
+    np.add.at(diff, ends[valid], -1)
+    return np.cumsum(diff[:-1]) > 0
+
+def break_intervals(breaks, first_day: date, days: int):
+    """Minute intervals (relative to first_day) blocked by breaks, one per affected day"""
+    starts, ends = [], []
+    for break_item in breaks:
+        break_start = to_minutes(break_item.get("start_time"))
+        break_end = to_minutes(break_item.get("end_time"))
+        if break_start is None or break_end is None:
+            continue
+        start_date = date.fromisoformat(str(break_item["start_date"])[:10])
+        end_date = date.fromisoformat(str(break_item["end_date"])[:10])
+        recurring_days = set(break_item.get("recurring_days") or []) if break_item.get("is_recurring") else None
+        day = max(start_date, first_day)
+        while day <= end_date and (day - first_day).days < days:
+            if recurring_days is None or DAY_NAMES[day.weekday()] in recurring_days:
+                offset = (day - first_day).days * MINUTES_PER_DAY
+                starts.append(offset + break_start)
+                ends.append(offset + (break_end if break_end > break_start else MINUTES_PER_DAY))
+            day += timedelta(days=1)
+    return starts, ends
+
+def staff_grids(first_day: date, weeks: int, hours, breaks, bookings):
+    """Available and booked minutes as (days, 24) arrays for consecutive weeks starting on first_day"""
+    days = weeks * 7
+    length = days * MINUTES_PER_DAY
+    origin = datetime.combine(first_day, datetime.min.time())
+
+    starts, ends = [], []
+    for day in range(days):
+        day_hours = hours[day % 7]  # first_day is a Monday
+        if day_hours:
+            starts.append(day * MINUTES_PER_DAY + day_hours[0])
+            ends.append(day * MINUTES_PER_DAY + day_hours[1])
+    available = interval_mask(starts, ends, length)
+
+    blocked_starts, blocked_ends = break_intervals(breaks, first_day, days)
+    available &= ~interval_mask(blocked_starts, blocked_ends, length)
+
+    booking_starts = [int((b["start_at"] - origin).total_seconds() // 60) for b in bookings]
+    booking_ends = [int((b["end_at"] - origin).total_seconds() // 60) for b in bookings]
+    booked = interval_mask(booking_starts, booking_ends, length) & available
+
+    return (
+        available.reshape(days, 24, 60).sum(axis=2),
+        booked.reshape(days, 24, 60).sum(axis=2)
+    )
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+async def load_missing_weeks(db, staff_list, missing, business_hours, versions):
+    """Compute and cache grids for the (staff_id, week) pairs that aren't cached"""
+    first_week, last_week = min(w for _, w in missing), max(w for _, w in missing)
+    weeks = (last_week - first_week).days // 7 + 1
+    window_start = datetime.combine(first_week, datetime.min.time())
+    window_end = window_start + timedelta(days=weeks * 7)
+    staff_ids = list({staff_id for staff_id, _ in missing})
+
+    bookings = await db.bookings.find({
+        "staff_id": {"$in": staff_ids},
+        "status": {"$ne": "cancelled"},
+        "start_at": {"$lt": window_end},
+        "end_at": {"$gt": window_start}
+    }, {"_id": 0, "staff_id": 1, "start_at": 1, "end_at": 1}).to_list(length=None)
+    breaks = await db.staff_breaks.find({
+        "staff_id": {"$in": staff_ids},
+        "start_at": {"$lt": window_end},
+        "end_at": {"$gt": window_start}
+    }, {"_id": 0}).to_list(length=None)
+
+    current_week = week_start(date.today())
+    grids = {}
+    for staff in staff_list:
+        if staff["id"] not in staff_ids:
+            continue
+        available, booked = await asyncio.to_thread(
+            staff_grids, first_week, weeks, weekday_hours(staff, business_hours),
+            [b for b in breaks if b["staff_id"] == staff["id"]],
+            [b for b in bookings if b["staff_id"] == staff["id"]]
+        )
+        for index in range(weeks):
+            week = first_week + timedelta(weeks=index)
+            ttl = PAST_WEEK_TTL if week < current_week else CURRENT_WEEK_TTL
+            rows = slice(index * 7, index * 7 + 7)
+            grids[(staff["id"], week)] = (available[rows], booked[rows])
+            week_cache.set((staff["id"], week, versions[staff["id"]]), grids[(staff["id"], week)], ttl=ttl)
+    return grids
+
+async def staff_utilization(db, start: date, end: date, business_hours, staff_id: Optional[str] = None):
+    """Booked vs available minutes per staff member and a weekday x hour occupancy heatmap"""
+    query = {"id": staff_id} if staff_id else {}
+    staff_list = await db.staff.find(query, {"_id": 0, "id": 1, "name": 1, "available_hours": 1}).to_list(length=None)
+
+    weeks = []
+    week = week_start(start)
+    while week <= end:
+        weeks.append(week)
+        week += timedelta(weeks=1)
+
+    # Read before any bookings are loaded, so a write racing the load only makes the entry stale
+    versions = await staff_versions(db, [s["id"] for s in staff_list])
+    grids = {(s["id"], w): week_cache.get((s["id"], w, versions[s["id"]])) for s in staff_list for w in weeks}
+    missing = [key for key, grid in grids.items() if grid is None]
+    if missing:
+        grids.update(await load_missing_weeks(db, staff_list, missing, business_hours, versions))
+
+    heatmap_available = np.zeros((7, 24), dtype=np.int64)
+    heatmap_booked = np.zeros((7, 24), dtype=np.int64)
+    staff_rows = []
+    for staff in staff_list:
+        available_total = booked_total = 0
+        for week in weeks:
+            available, booked = grids[(staff["id"], week)]
+            # Clip partial weeks at either end of the window
+            in_window = np.array([start <= week + timedelta(days=d) <= end for d in range(7)])
+            available = available * in_window[:, None]
+            booked = booked * in_window[:, None]
+            heatmap_available += available
+            heatmap_booked += booked
+            available_total += int(available.sum())
+            booked_total += int(booked.sum())
+        staff_rows.append({
+            "staff_id": staff["id"],
+            "staff_name": staff.get("name", "Unknown"),
+            "available_minutes": available_total,
+            "booked_minutes": booked_total,
+            "utilization": round(booked_total / available_total, 4) if available_total else 0
+        })
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        occupancy = np.where(heatmap_available > 0, heatmap_booked / heatmap_available, np.nan)
+    available_total = int(heatmap_available.sum())
+    booked_total = int(heatmap_booked.sum())
+
+    return {
+        "start_date": start.isoformat(),
+        "end_date": end.isoformat(),
+        "summary": {
+            "available_minutes": available_total,
+            "booked_minutes": booked_total,
+            "utilization": round(booked_total / available_total, 4) if available_total else 0
+        },
+        "staff": sorted(staff_rows, key=lambda row: row["utilization"], reverse=True),
+        "heatmap": {
+            "weekdays": DAY_NAMES,
+            "hours": list(range(24)),
+            "available_minutes": heatmap_available.tolist(),
+            "booked_minutes": heatmap_booked.tolist(),
+            "occupancy": [
+                [None if np.isnan(value) else round(float(value), 4) for value in row]
+                for row in occupancy
+            ]
+        }
+    }
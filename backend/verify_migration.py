@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Verify MongoDB -> MySQL migration parity with per-chunk checksums
+
+Both sides are streamed ordered by key (`id`, or `user_id` for passwords) in
+chunks bounded by the MongoDB keys; MySQL compares keys with utf8mb4_bin so
+its chunks hold the same rows as MongoDB's binary ordering. Every record is
+normalized with the same mappers the migration uses and hashed; the record
+hashes are folded into one rolling hash per chunk. Columns the mappers fill
+with generated defaults (the current time) are left out of a record on both
+sides. Only chunks whose hashes differ are drilled into, and only the
+differing records are re-fetched to report field-level mismatches. Memory use
+is bounded by the chunk size.
+
+Usage:
+    python verify_migration.py [--chunk-size 5000] [--tables bookings users] [--max-report 20]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+from time import perf_counter
+from datetime import datetime, date, time, timedelta
+from decimal import Decimal
+from database import init_db, close_db, get_db_connection, JSON_FIELDS
+from migrate_to_mysql import MIGRATIONS, mongo_db, mongo_client, to_datetime
+
+# Key column per table (defaults to id)
+KEY_COLUMNS = {'user_passwords': 'user_id'}
+
+# Column -> document fields it is mapped from; when the document has none of
+# them the mapper generates a value, so the column can't be compared
+GENERATED_COLUMNS = {'created_at': ('created_at',)}
+TABLE_GENERATED_COLUMNS = {
+    'bookings': {
+        'booking_date': ('booking_date', 'date'),
+        'booking_time': ('booking_time', 'time'),
+    },
+    'staff_breaks': {'start_date': ('start_date',), 'end_date': ('end_date',)},
+}
+
+def normalize_value(column, value):
+    """Normalize a value from either side into a comparable JSON-safe form"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (float, Decimal)):
+        return f"{float(value):.2f}"
+    if isinstance(value, datetime):
+        return to_datetime(value).replace(microsecond=0).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, time):
+        return value.strftime('%H:%M:%S')
+    if isinstance(value, timedelta):
+        seconds = int(value.total_seconds())
+        return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+    if isinstance(value, str) and column in JSON_FIELDS:
+        try:
+            value = json.loads(value)
+        except (json.JSONDecodeError, ValueError):
+            return value
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, sort_keys=True, default=str) if value else None
+    if isinstance(value, str) and column.endswith('_at'):
+        parsed = to_datetime(value)
+        if isinstance(parsed, datetime):
+            return parsed.replace(microsecond=0).isoformat()
+    return value
+
+def generated_columns(table, document):
+    """Columns the mapper would fill with generated defaults for this document"""
+    sources = {**GENERATED_COLUMNS, **TABLE_GENERATED_COLUMNS.get(table, {})}
+    return {
+        column for column, fields in sources.items()
+        if all(document.get(field) is None for field in fields)
+    }
+
+def canonical_mongo(document, mapper, table):
+    """Map a MongoDB document like the migration does and normalize it"""
+    skipped = generated_columns(table, document)
+    return {
+        column: normalize_value(column, value)
+        for column, value in mapper(document).items() if column not in skipped
+    }
+
+def canonical_mysql(row, columns):
+    """Normalize a MySQL row restricted to the compared columns"""
+    return {column: normalize_value(column, row.get(column)) for column in columns}
+
+def record_digest(record):
+    return hashlib.blake2b(
+        json.dumps(record, sort_keys=True, default=str).encode('utf-8'), digest_size=16
+    ).digest()
+
+def chunk_digest(digests):
+    """Fold (key, record digest) pairs into one rolling chunk hash"""
+    rolling = hashlib.blake2b(digest_size=16)
+    for key in sorted(digests):
+        rolling.update(key.encode('utf-8'))
+        rolling.update(digests[key])
+    return rolling.hexdigest()
+
+class TableReport:
+    def __init__(self, table):
+        self.table = table
+        self.mongo_rows = 0
+        self.mysql_rows = 0
+        self.chunks = 0
+        self.mismatched_chunks = 0
+        self.unverifiable = 0
+        self.missing_in_mysql = []
+        self.extra_in_mysql = []
+        self.different = []
+        self.seconds = 0.0
+
+    @property
+    def ok(self):
+        return not (self.missing_in_mysql or self.extra_in_mysql or self.different)
+
+async def fetch_mysql_range(table, key, lower, upper):
+    """Fetch MySQL rows with lower < key <= upper (open-ended when upper is None), in binary key order"""
+    binary_key = f"{key} COLLATE utf8mb4_bin"
+    query = f"SELECT * FROM {table} WHERE {binary_key} > %s"
+    params = [lower]
+    if upper is not None:
+        query += f" AND {binary_key} <= %s"
+        params.append(upper)
+    query += f" ORDER BY {binary_key}"
+    async with get_db_connection() as (connection, cursor):
+        await cursor.execute(query, params)
+        return await cursor.fetchall()
+
+async def drill_down(table, key, mapper, keys, report, max_report):
+    """Re-fetch only the differing records and record field-level differences"""
+    if len(report.different) >= max_report:
+        report.different.extend({'key': k} for k in keys)
+        return
+    keys = list(keys)
+    documents = await mongo_db[mapper_collection(table)].find({key: {'$in': keys}}).to_list(length=None)
+    placeholders = ', '.join(['%s'] * len(keys))
+    async with get_db_connection() as (connection, cursor):
+        await cursor.execute(f"SELECT * FROM {table} WHERE {key} IN ({placeholders})", keys)
+        mysql_rows = {row[key]: row for row in await cursor.fetchall()}
+
+    for document in documents:
+        expected = canonical_mongo(document, mapper, table)
+        actual = canonical_mysql(mysql_rows.get(document[key], {}), list(expected.keys()))
+        fields = {
+            column: {'mongo': expected[column], 'mysql': actual[column]}
+            for column in expected if expected[column] != actual[column]
+        }
+        # Changed since the chunk was hashed: not a difference any more
+        if fields:
+            report.different.append({'key': document[key], 'fields': fields})
+
+def mapper_collection(table):
+    return next(m['collection'] for m in MIGRATIONS if m['table'] == table)
+
+async def verify_table(migration, chunk_size, max_report):
+    """Compare one collection with its MySQL table chunk by chunk"""
+    table = migration['table']
+    mapper = migration['mapper']
+    key = KEY_COLUMNS.get(table, 'id')
+    report = TableReport(table)
+    started = perf_counter()
+
+    cursor = mongo_db[migration['collection']].find(
+        {key: {'$exists': True}}
+    ).sort(key, 1).batch_size(chunk_size)
+
+    lower = ''
+
+    async def compare_chunk(mongo_digests, columns, upper):
+        rows = await fetch_mysql_range(table, key, lower, upper)
+        report.mysql_rows += len(rows)
+        # Each row is compared on the columns of its MongoDB record
+        mysql_digests = {
+            row[key]: record_digest(canonical_mysql(row, columns.get(row[key], ())))
+            for row in rows
+        }
+        report.chunks += 1
+        if chunk_digest(mongo_digests) == chunk_digest(mysql_digests):
+            return
+
+        report.mismatched_chunks += 1
+        report.missing_in_mysql.extend(k for k in mongo_digests if k not in mysql_digests)
+        report.extra_in_mysql.extend(k for k in mysql_digests if k not in mongo_digests)
+        changed = [k for k in mongo_digests if k in mysql_digests and mongo_digests[k] != mysql_digests[k]]
+        if changed:
+            await drill_down(table, key, mapper, changed, report, max_report)
+
+    chunk, columns = {}, {}
+    async for document in cursor:
+        record = canonical_mongo(document, mapper, table)
+        chunk[document[key]] = record_digest(record)
+        columns[document[key]] = list(record.keys())
+        report.mongo_rows += 1
+        if len(chunk) >= chunk_size:
+            upper = max(chunk)
+            await compare_chunk(chunk, columns, upper)
+            lower = upper
+            chunk, columns = {}, {}
+
+    # The final chunk is open-ended so rows that only exist in MySQL are found
+    await compare_chunk(chunk, columns, None)
+
+    report.unverifiable = await mongo_db[migration['collection']].count_documents({key: {'$exists': False}})
+    report.seconds = perf_counter() - started
+    return report
+
+def print_report(report, max_report):
+    status = "✅" if report.ok else "❌"
+    print(f"{status} {report.table}: mongo={report.mongo_rows} mysql={report.mysql_rows} "
+          f"chunks={report.chunks} mismatched_chunks={report.mismatched_chunks} "
+          f"({report.seconds:.2f}s)")
+    if report.unverifiable:
+        print(f"   ⚠️ {report.unverifiable} MongoDB documents have no key and were not compared")
+    for label, keys in (("missing in MySQL", report.missing_in_mysql), ("only in MySQL", report.extra_in_mysql)):
+        if keys:
+            print(f"   {len(keys)} {label}: {', '.join(map(str, keys[:max_report]))}"
+                  + (" ..." if len(keys) > max_report else ""))
+    if report.different:
+        print(f"   {len(report.different)} records differ:")
+        for difference in report.different[:max_report]:
+            print(f"     {difference['key']}: {json.dumps(difference.get('fields', {}), default=str)}")
+
+async def main():
+    parser = argparse.ArgumentParser(description="Verify MongoDB -> MySQL migration parity")
+    parser.add_argument("--chunk-size", type=int, default=5000)
+    parser.add_argument("--tables", nargs="+", metavar="TABLE", help="Only verify these tables")
+    parser.add_argument("--max-report", type=int, default=20, help="Records to list per category")
+    args = parser.parse_args()
+
+    migrations = [m for m in MIGRATIONS if not args.tables or m['table'] in args.tables]
+    await init_db()
+    try:
+        reports = await asyncio.gather(*[
+            verify_table(migration, args.chunk_size, args.max_report) for migration in migrations
+        ])
+    finally:
+        await close_db()
+        mongo_client.close()
+
+    for report in reports:
+        print_report(report, args.max_report)
+
+    if all(report.ok for report in reports):
+        print("✅ MongoDB and MySQL are in parity")
+    else:
+        print("❌ Differences found")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    asyncio.run(main())
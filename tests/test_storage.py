@@ -0,0 +1,126 @@
+"""
+Contract tests for the upload storage backends (backend/storage.py)
+
+Every test runs against LocalStorage in a temporary directory and against
+S3Storage on a moto-mocked bucket.
+"""
+import asyncio
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from storage import MB, LocalStorage, S3Storage  # noqa: E402
+
+KEY = "images/ab/cd/abcdef.jpg"
+
+
+@pytest.fixture(params=["local", "s3"])
+def storage(request, tmp_path, monkeypatch):
+    if request.param == "local":
+        yield LocalStorage(tmp_path / "uploads")
+        return
+
+    import boto3
+    from moto import mock_aws
+
+    for name, value in (
+        ("AWS_ACCESS_KEY_ID", "testing"), ("AWS_SECRET_ACCESS_KEY", "testing"),
+        ("AWS_DEFAULT_REGION", "us-east-1"),
+    ):
+        monkeypatch.setenv(name, value)
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket="uploads")
+        yield S3Storage("uploads", prefix="media", client=client)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def write_file(directory: Path, content: bytes) -> Path:
+    path = directory / f"upload-{len(content)}.tmp"
+    path.write_bytes(content)
+    return path
+
+
+async def read_all(storage, key: str) -> bytes:
+    stored = await storage.stat(key)
+    return b"".join([chunk async for chunk in storage.iter_range(key, 0, stored.size)])
+
+
+async def read_local(storage, key: str) -> bytes:
+    async with storage.local_file(key) as path:
+        return Path(path).read_bytes()
+
+
+def test_put_and_get(storage, tmp_path):
+    content = b"image bytes" * 100
+    local_file = write_file(tmp_path, content)
+
+    run(storage.put(local_file, KEY, "image/jpeg"))
+
+    assert not local_file.exists()
+    assert run(storage.exists(KEY))
+    assert run(storage.stat(KEY)).size == len(content)
+    assert run(read_all(storage, KEY)) == content
+    assert run(read_local(storage, KEY)) == content
+
+
+def test_multipart_upload(storage, tmp_path):
+    # Above S3Storage's 8 MB multipart threshold
+    content = os.urandom(9 * MB + 123)
+    run(storage.put(write_file(tmp_path, content), "videos/12/34/1234.mp4", "video/mp4"))
+
+    assert run(storage.stat("videos/12/34/1234.mp4")).size == len(content)
+    assert run(read_all(storage, "videos/12/34/1234.mp4")) == content
+
+
+def test_iter_range(storage, tmp_path):
+    content = bytes(range(256)) * 40
+    run(storage.put(write_file(tmp_path, content), KEY))
+
+    async def read_range(start, length, chunk_size=MB):
+        return b"".join([chunk async for chunk in storage.iter_range(KEY, start, length, chunk_size)])
+
+    assert run(read_range(10, 20)) == content[10:30]
+    assert run(read_range(len(content) - 5, 5)) == content[-5:]
+    assert run(read_range(100, 1000, chunk_size=64)) == content[100:1100]
+    assert run(read_range(50, 0)) == b""
+
+
+def test_delete(storage, tmp_path):
+    run(storage.put(write_file(tmp_path, b"x" * 10), KEY))
+
+    run(storage.delete(KEY))
+
+    assert not run(storage.exists(KEY))
+    assert run(storage.stat(KEY)) is None
+    # Deleting again is not an error
+    run(storage.delete(KEY))
+
+
+def test_exists_for_missing_key(storage):
+    assert not run(storage.exists("images/no/ne/none.jpg"))
+    assert run(storage.stat("images/no/ne/none.jpg")) is None
+
+
+def test_copy_move_and_list(storage, tmp_path):
+    run(storage.put(write_file(tmp_path, b"original"), KEY))
+
+    run(storage.copy(KEY, "avatars/ab/cd/abcdef.jpg"))
+    run(storage.move(KEY, "images/abcdef.jpg"))
+
+    assert not run(storage.exists(KEY))
+    assert run(read_all(storage, "avatars/ab/cd/abcdef.jpg")) == b"original"
+    assert run(read_all(storage, "images/abcdef.jpg")) == b"original"
+
+    async def list_keys(prefix):
+        return sorted([key async for key, _ in storage.iter_objects(prefix)])
+
+    assert run(list_keys("images/")) == ["images/abcdef.jpg"]
+    assert run(list_keys("")) == ["avatars/ab/cd/abcdef.jpg", "images/abcdef.jpg"]